@@ -0,0 +1,268 @@
+"""
+DB障害時のサーキットブレーカーと読み取り専用モード
+接続失敗が続いたらブレーカーを開き、以降のDBアクセスは待たずに即失敗させる。
+開いている間はバックグラウンドで接続を試し、成功したら閉じる。
+ページはその間、最後に取得できたタスク一覧・ランキングを読み取り専用で表示する。
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import psycopg2
+import psycopg2.errors
+
+from metrics import DB_CIRCUIT_OPEN, DB_CIRCUIT_TRIPS, DB_CONNECTIONS_OPENED
+
+logger = logging.getLogger(__name__)
+
+# ブレーカーの状態
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+
+
+class DatabaseUnavailableError(Exception):
+    """DBに接続できない（ページは読み取り専用モードに切り替える）"""
+
+
+class CircuitOpenError(DatabaseUnavailableError):
+    """ブレーカーが開いているため、DBにアクセスせず失敗した"""
+
+
+class DatabaseBusyError(Exception):
+    """DBは動いているが混雑していて処理できない（読み取り専用にはせず、混雑中の案内を出す）"""
+
+
+class QueryTimeoutError(DatabaseBusyError):
+    """statement_timeout / lock_timeout でクエリが打ち切られた（ブレーカーには数えない）"""
+
+
+class PoolExhaustedError(DatabaseBusyError):
+    """接続プールの接続がすべて使用中で、待ち時間内に空かなかった（ブレーカーには数えない）"""
+
+
+# ページで捕まえる「DBが使えない」例外
+DB_UNAVAILABLE_ERRORS = (DatabaseUnavailableError, psycopg2.OperationalError)
+# ページで捕まえる「DBが混雑している」例外（psycopg2 のタイムアウトは OperationalError のサブクラスなので、
+# DB_UNAVAILABLE_ERRORS より先に捕まえる）
+DB_BUSY_ERRORS = (DatabaseBusyError, psycopg2.errors.QueryCanceled, psycopg2.errors.LockNotAvailable)
+
+_DB_BREAKER = None
+_DB_BREAKER_LOCK = threading.Lock()
+_READ_ONLY_CACHE = None
+_READ_ONLY_CACHE_LOCK = threading.Lock()
+
+
+class CircuitBreaker:
+    """連続失敗で開き、バックグラウンドの疎通確認で閉じるサーキットブレーカー（スレッドセーフ）"""
+
+    def __init__(self, failure_threshold: int = 3, probe_interval: float = 5.0, probe=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            failure_threshold: この回数連続で失敗したら開く
+            probe_interval: 開いている間に疎通確認する間隔（秒）
+            probe: 疎通確認の関数（例外を投げなければ成功）。Noneなら自動では閉じない
+        """
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._last_error = None
+        self._probe_thread = None
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def opened_at(self) -> Optional[float]:
+        """開いた時刻（clock基準。閉じていれば None）"""
+        return self._opened_at
+
+    @property
+    def last_error(self) -> Optional[str]:
+        return self._last_error
+
+    def before_call(self):
+        """DBアクセス前に呼ぶ（開いていれば即 CircuitOpenError）"""
+        if self._state == STATE_OPEN:
+            raise CircuitOpenError(f"database circuit is open: {self._last_error}")
+
+    def record_success(self):
+        """DBアクセス成功を記録"""
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self, error: Exception):
+        """DBアクセス失敗を記録（しきい値に達したら開く）"""
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error).strip() or type(error).__name__
+            if self._state == STATE_OPEN or self._failures < self.failure_threshold:
+                return
+            self._state = STATE_OPEN
+            self._opened_at = self._clock()
+        DB_CIRCUIT_OPEN.set(1)
+        DB_CIRCUIT_TRIPS.inc()
+        logger.error(f"Database circuit opened after {self._failures} failures: {self._last_error}")
+        self._start_probe()
+
+    def close(self):
+        """ブレーカーを閉じる（疎通確認の成功時）"""
+        with self._lock:
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._opened_at = None
+        DB_CIRCUIT_OPEN.set(0)
+        logger.info("Database circuit closed")
+
+    def call(self, function, *args, **kwargs):
+        """ブレーカー越しに関数を呼ぶ（DB接続系の例外を失敗として数える）"""
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except DB_UNAVAILABLE_ERRORS as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def _start_probe(self):
+        if self.probe is None:
+            return
+        if self._probe_thread and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="db-circuit-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        """開いている間、一定間隔で疎通確認する"""
+        while self._state == STATE_OPEN:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self._last_error = str(e).strip() or type(e).__name__
+                logger.debug(f"Database probe failed: {e}")
+                continue
+            self.close()
+
+
+def _probe_database():
+    """短いタイムアウトで接続して SELECT 1"""
+    from task_db import load_connection_params
+
+    params = load_connection_params()
+    params["connect_timeout"] = min(int(params.get("connect_timeout") or 2), 2)
+    with psycopg2.connect(**params) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+    conn.close()
+
+
+def get_db_breaker() -> CircuitBreaker:
+    """プロセス共有のDBサーキットブレーカーを取得"""
+    global _DB_BREAKER
+
+    with _DB_BREAKER_LOCK:
+        if _DB_BREAKER is None:
+            _DB_BREAKER = CircuitBreaker(
+                failure_threshold=int(os.getenv("DB_CIRCUIT_FAILURES", "3")),
+                probe_interval=float(os.getenv("DB_CIRCUIT_PROBE_INTERVAL", "5")),
+                probe=_probe_database,
+            )
+        return _DB_BREAKER
+
+
+def connect(connection_params: dict):
+    """ブレーカー越しに psycopg2 で接続"""
+    connection = get_db_breaker().call(psycopg2.connect, **connection_params)
+    DB_CONNECTIONS_OPENED.inc()
+    return connection
+
+
+class ReadOnlyCache:
+    """読み取り専用モード用に、最後に取得できたタスク一覧・進捗・ランキングを保持"""
+
+    def __init__(self, max_users: int = 10_000):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._catalog_at = None
+        self._user_completed = OrderedDict()
+        self._ranking = None
+        self._ranking_at = None
+
+    def remember_snapshot(self, user_id: int, snapshot: dict):
+        """ダッシュボードの取得結果を保存"""
+        tasks = snapshot["tasks"]
+        with self._lock:
+            self._catalog = [{**task, "completed": False} for task in tasks]
+            self._catalog_at = datetime.now()
+            self._user_completed[user_id] = (
+                {task['id'] for task in tasks if task['completed']}, snapshot.get("rank")
+            )
+            self._user_completed.move_to_end(user_id)
+            while len(self._user_completed) > self.max_users:
+                self._user_completed.popitem(last=False)
+
+    def remember_ranking(self, ranking):
+        """ランキングの取得結果を保存"""
+        with self._lock:
+            self._ranking = list(ranking)
+            self._ranking_at = datetime.now()
+
+    def _yaml_catalog(self) -> list:
+        """まだ一度もDBから取得できていなければ tasks.yml からタスク一覧を作る"""
+        from tasks import load_tasks_from_yaml
+
+        yaml_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks.yml")
+        return [
+            {
+                "id": task["id"],
+                "title": task["title"],
+                "task_type": task.get("type"),
+                "description": task.get("description"),
+                "content": task.get("content"),
+                "completed": False,
+            }
+            for task in load_tasks_from_yaml(yaml_path)
+        ]
+
+    def dashboard_snapshot(self, user_id: int) -> dict:
+        """読み取り専用のダッシュボード用データ（as_of は取得時刻。YAMLからなら None）"""
+        with self._lock:
+            catalog, as_of = self._catalog, self._catalog_at
+            completed, rank = self._user_completed.get(user_id, (set(), None))
+        if catalog is None:
+            catalog = self._yaml_catalog()
+        return {
+            "tasks": [{**task, "completed": task['id'] in completed} for task in catalog],
+            "rank": rank,
+            "task_stats": {},
+            "as_of": as_of,
+        }
+
+    def ranking(self) -> tuple[Optional[list], Optional[datetime]]:
+        """最後に取得できたランキングと取得時刻"""
+        with self._lock:
+            return self._ranking, self._ranking_at
+
+
+def get_read_only_cache() -> ReadOnlyCache:
+    """プロセス共有の読み取り専用キャッシュを取得"""
+    global _READ_ONLY_CACHE
+
+    with _READ_ONLY_CACHE_LOCK:
+        if _READ_ONLY_CACHE is None:
+            _READ_ONLY_CACHE = ReadOnlyCache()
+        return _READ_ONLY_CACHE
@@ -0,0 +1,221 @@
+"""
+ミッション完了のローカルジャーナル
+完了をローカルディスクの追記専用ジャーナルに書いて fsync してから受け付け、
+Postgres に書き込めた位置をチェックポイントとして記録する。
+DBが瞬断しても完了は失われず、再接続後（またはプロセス再起動後）にまとめて再送する。
+再送は INSERT ... ON CONFLICT (user_id, task_id) DO NOTHING なので何度流しても結果は同じ。
+
+ファイル構成（ディレクトリ内）:
+- journal-00000001.seg ... 事前確保した固定長セグメント（mmap して32バイトの固定長レコードを追記）
+- checkpoint           ... DBに反映済みの位置（セグメント番号, オフセット）
+
+有効化: secrets.toml の [database] completion_journal_dir または環境変数 COMPLETION_JOURNAL_DIR
+（write-behind の CompletionWriter と組み合わせて使う）
+"""
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from datetime import datetime
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# magic, version, task_id, user_id, completed_at（UNIXマイクロ秒）, crc32, padding
+RECORD = struct.Struct("<HHiqqI4x")
+RECORD_MAGIC = 0x4356
+RECORD_VERSION = 1
+CHECKPOINT = struct.Struct("<QQ")
+SEGMENT_NAME_RE = re.compile(r"^journal-(\d{8})\.seg$")
+
+
+class JournalPosition(NamedTuple):
+    """ジャーナル上の位置（レコード末尾）"""
+    segment: int
+    offset: int
+
+
+class JournalRecord(NamedTuple):
+    """ジャーナルの1レコード"""
+    user_id: int
+    task_id: int
+    completed_at: datetime
+    position: JournalPosition
+
+
+def _fsync_directory(path: str):
+    """ファイルの作成・リネームを永続化するためディレクトリを fsync"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_record(user_id: int, task_id: int, completed_at: datetime) -> bytes:
+    """レコードをバイト列に変換"""
+    micros = int(completed_at.timestamp() * 1_000_000)
+    body = struct.pack("<HHiqq", RECORD_MAGIC, RECORD_VERSION, task_id, user_id, micros)
+    return RECORD.pack(RECORD_MAGIC, RECORD_VERSION, task_id, user_id, micros, zlib.crc32(body))
+
+
+def decode_record(data: bytes):
+    """バイト列からレコードを復元（未使用領域・書きかけなら None）"""
+    magic, version, task_id, user_id, micros, crc = RECORD.unpack(data)
+    if magic != RECORD_MAGIC or version != RECORD_VERSION:
+        return None
+    if zlib.crc32(data[:24]) != crc:
+        return None
+    return user_id, task_id, datetime.fromtimestamp(micros / 1_000_000)
+
+
+class CompletionJournal:
+    """mmap セグメントによる追記専用の完了ジャーナル"""
+
+    def __init__(self, directory: str, segment_size: int = 1024 * 1024):
+        """
+        Args:
+            directory: ジャーナルを置くディレクトリ（なければ作成）
+            segment_size: 1セグメントのバイト数（レコード長の倍数に切り下げる）
+        """
+        self.directory = directory
+        self.segment_size = max(RECORD.size, segment_size // RECORD.size * RECORD.size)
+        self._lock = threading.Lock()
+        self._page_size = mmap.ALLOCATIONGRANULARITY
+        os.makedirs(directory, exist_ok=True)
+        self._checkpoint = self._read_checkpoint()
+        self._segment = None
+        self._mmap = None
+        self._offset = 0
+        self._open_tail()
+
+    # --- ファイル操作 ---
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"journal-{segment:08d}.seg")
+
+    def _segments(self) -> list[int]:
+        """ディレクトリ内のセグメント番号（昇順）"""
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME_RE.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _read_checkpoint(self) -> JournalPosition:
+        try:
+            with open(os.path.join(self.directory, "checkpoint"), "rb") as f:
+                return JournalPosition(*CHECKPOINT.unpack(f.read(CHECKPOINT.size)))
+        except (FileNotFoundError, struct.error):
+            return JournalPosition(0, 0)
+
+    def _write_checkpoint(self, position: JournalPosition):
+        """チェックポイントを一時ファイル経由で原子的に更新"""
+        path = os.path.join(self.directory, "checkpoint")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CHECKPOINT.pack(*position))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_directory(self.directory)
+
+    def _map_segment(self, segment: int, create: bool) -> mmap.mmap:
+        path = self._segment_path(segment)
+        if create:
+            with open(path, "wb") as f:
+                f.truncate(self.segment_size)
+                os.fsync(f.fileno())
+            _fsync_directory(self.directory)
+        with open(path, "r+b") as f:
+            return mmap.mmap(f.fileno(), 0)
+
+    def _scan(self, data, start: int = 0):
+        """セグメント内の有効なレコードを先頭から読む（書きかけ・未使用領域で止まる）"""
+        for offset in range(start, len(data) - RECORD.size + 1, RECORD.size):
+            decoded = decode_record(data[offset:offset + RECORD.size])
+            if decoded is None:
+                return
+            yield offset + RECORD.size, decoded
+
+    def _open_tail(self):
+        """最後のセグメントを開き、追記位置を有効なレコードの直後に合わせる"""
+        segments = self._segments()
+        if not segments:
+            self._segment = max(1, self._checkpoint.segment)
+            self._mmap = self._map_segment(self._segment, create=True)
+            self._offset = 0
+            return
+        self._segment = segments[-1]
+        self._mmap = self._map_segment(self._segment, create=False)
+        self._offset = 0
+        for end, _ in self._scan(self._mmap):
+            self._offset = end
+
+    def _roll_segment(self):
+        """次のセグメントに切り替える"""
+        self._mmap.close()
+        self._segment += 1
+        self._mmap = self._map_segment(self._segment, create=True)
+        self._offset = 0
+
+    # --- 公開API ---
+
+    def append(self, user_id: int, task_id: int, completed_at: datetime) -> JournalPosition:
+        """レコードを追記してディスクに同期（戻ったら電源断でも失われない）"""
+        data = encode_record(user_id, task_id, completed_at)
+        with self._lock:
+            if self._offset + RECORD.size > self.segment_size:
+                self._roll_segment()
+            start = self._offset
+            self._mmap[start:start + RECORD.size] = data
+            # msync はページ境界から指定する必要がある
+            page_start = start - start % self._page_size
+            self._mmap.flush(page_start, start + RECORD.size - page_start)
+            self._offset = start + RECORD.size
+            return JournalPosition(self._segment, self._offset)
+
+    def pending(self) -> list[JournalRecord]:
+        """チェックポイント以降（DBに未反映）のレコード"""
+        with self._lock:
+            checkpoint = self._checkpoint
+            records = []
+            for segment in self._segments():
+                if segment < checkpoint.segment:
+                    continue
+                start = checkpoint.offset if segment == checkpoint.segment else 0
+                if segment == self._segment:
+                    data = self._mmap
+                else:
+                    with open(self._segment_path(segment), "rb") as f:
+                        data = f.read()
+                for end, (user_id, task_id, completed_at) in self._scan(data, start):
+                    records.append(JournalRecord(user_id, task_id, completed_at, JournalPosition(segment, end)))
+            return records
+
+    def mark_applied(self, position: JournalPosition):
+        """position までDBに反映済みとして記録し、不要になったセグメントを削除"""
+        with self._lock:
+            if position <= self._checkpoint:
+                return
+            self._write_checkpoint(position)
+            self._checkpoint = position
+            for segment in self._segments():
+                if segment < position.segment:
+                    os.remove(self._segment_path(segment))
+
+    @property
+    def checkpoint(self) -> JournalPosition:
+        """DBに反映済みの位置"""
+        return self._checkpoint
+
+    def close(self):
+        """セグメントを閉じる"""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
@@ -0,0 +1,379 @@
+"""
+ミッション完了の書き込み遅延（write-behind）
+完了操作をプロセス内キューに積み、バックグラウンドスレッドが数ms分をまとめて
+複数行の INSERT ... ON CONFLICT DO NOTHING 1文で書き込む。
+画面にはキュー内の完了も即座に反映する（楽観的更新）。
+
+耐久性:
+- 正常終了時（SIGTERM を含む）は atexit でキューを書き切ってから終了する
+- 接続断・タイムアウトなどのDBエラー時はバッチを捨てずにキューへ戻し、再接続して再試行する
+- 行そのものが原因のエラー（存在しないタスクなど）は1行ずつ書き直して特定し、その行だけ捨ててログに残す
+  （キューの先頭で同じバッチが失敗し続けて後続の完了が書けなくなるのを防ぐ）
+- ジャーナル（completion_journal）を設定すると、受け付け前にローカルディスクへ fsync し、
+  起動時に未反映分を再送する。未設定でプロセスが強制終了された場合、未書き込みの完了
+  （通常は数ms分）は失われる
+
+有効化: secrets.toml の [database] write_behind = true または環境変数 DB_WRITE_BEHIND=1
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Optional
+
+import psycopg2
+from psycopg2.extras import execute_values
+import streamlit as st
+
+from completion_journal import CompletionJournal
+from task_db import load_connection_params, get_completion_journal_dir, with_timeouts
+from metrics import (
+    DB_CONNECTIONS_OPENED, COMPLETION_QUEUE_DEPTH, COMPLETION_BATCH_SIZE, COMPLETION_FLUSH_ERRORS,
+    COMPLETION_REJECTED
+)
+
+logger = logging.getLogger(__name__)
+
+# 同じ (user_id, task_id) が既にあれば最初の完了時刻を残す（同期の MARK_TASK_COMPLETE_SQL と同じ扱い）
+INSERT_COMPLETIONS_SQL = """
+    INSERT INTO progress (user_id, task_id, completed_at)
+    VALUES %s
+    ON CONFLICT (user_id, task_id) DO NOTHING
+"""
+
+# 再試行しても通らないエラー（行の内容が原因）
+REJECTED_ROW_ERRORS = (psycopg2.IntegrityError, psycopg2.DataError)
+
+
+class CompletionWriter:
+    """完了をまとめて書き込むバックグラウンドライター"""
+
+    def __init__(self, connection_params: dict = None, flush_interval: float = 0.005,
+                 max_batch: int = 500, retry_interval: float = 1.0,
+                 journal: Optional[CompletionJournal] = None):
+        """
+        Args:
+            flush_interval: 最初の1件を受け取ってから書き込むまでに溜める秒数
+            max_batch: 1文で書き込む最大行数
+            retry_interval: 書き込み失敗時に再試行するまでの秒数
+            journal: 受け付け前に完了を記録するローカルジャーナル（Noneで使わない）
+        """
+        self.connection_params = connection_params or load_connection_params()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_interval = retry_interval
+        self._queue = deque()
+        # 未書き込みの完了（画面への反映用）: (user_id, task_id) -> 件数
+        self._pending = {}
+        self._submitted = 0
+        self._written = 0
+        self._flush_waiters = 0
+        self._condition = threading.Condition(threading.RLock())
+        self._stop = False
+        self._thread = None
+        self._conn = None
+        self.journal = journal
+        COMPLETION_QUEUE_DEPTH.set_function(lambda: len(self._queue))
+        if journal is not None:
+            # 前回までにDBへ反映できなかった完了を再送キューに戻す
+            replayed = journal.pending()
+            for record in replayed:
+                self._enqueue((record.user_id, record.task_id, record.completed_at, record.position))
+            if replayed:
+                logger.info(f"Replaying {len(replayed)} journaled completions")
+
+    def _enqueue(self, row: tuple):
+        with self._condition:
+            self._queue.append(row)
+            key = (row[0], row[1])
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._submitted += 1
+            self._condition.notify_all()
+
+    def submit(self, task_id: int, user_id: int, completed_at: datetime = None):
+        """完了をキューに積む（ジャーナルがあれば書いて同期してから戻る。DBへの書き込みは待たない）"""
+        completed_at = completed_at or datetime.now()
+        with self._condition:
+            # ジャーナル上の順序とキューの順序を揃える（チェックポイントが未書き込み分を追い越さないように）
+            position = None
+            if self.journal is not None:
+                position = self.journal.append(user_id, task_id, completed_at)
+            self._enqueue((user_id, task_id, completed_at, position))
+
+    def pending_task_ids(self, user_id: int) -> set:
+        """まだDBに書き込まれていないユーザーの完了タスクID"""
+        with self._condition:
+            return {task_id for (pending_user, task_id) in self._pending if pending_user == user_id}
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """この呼び出しまでに積まれた完了が書き込まれるまで待つ（タイムアウトで False）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            target = self._submitted
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                return self._wait_written(target, deadline)
+            finally:
+                self._flush_waiters -= 1
+
+    def _wait_written(self, target: int, deadline: Optional[float]) -> bool:
+        """書き込み件数が target に達するまで待つ（ロック取得済みで呼ぶ）"""
+        while self._written < target:
+            if self._thread is None or not self._thread.is_alive():
+                # ワーカーがいなければ呼び出し元で書き込む
+                self._condition.release()
+                try:
+                    self._drain_once()
+                finally:
+                    self._condition.acquire()
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._condition.wait(remaining)
+        return True
+
+    def _get_connection(self):
+        if self._conn is None or self._conn.closed:
+            DB_CONNECTIONS_OPENED.inc()
+            self._conn = psycopg2.connect(**self.connection_params)
+        return self._conn
+
+    def write_batch(self, rows: list) -> None:
+        """複数行を1文・1トランザクションで書き込む"""
+        conn = self._get_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, with_timeouts("write", INSERT_COMPLETIONS_SQL), rows, page_size=len(rows))
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+    def _write_or_reject(self, rows: list) -> None:
+        """バッチを書き込む（行が原因で失敗したら1行ずつ書き直し、書けない行は捨ててログに残す）"""
+        try:
+            self.write_batch(rows)
+            return
+        except REJECTED_ROW_ERRORS as e:
+            logger.warning(f"Completion batch rejected ({len(rows)} rows), retrying row by row: {e}")
+        for row in rows:
+            try:
+                self.write_batch([row])
+            except REJECTED_ROW_ERRORS as e:
+                COMPLETION_REJECTED.inc()
+                logger.error(f"Dropping completion user_id={row[0]} task_id={row[1]} "
+                             f"completed_at={row[2]}: {e}")
+
+    def _drain_once(self) -> int:
+        """キューから1バッチ取り出して書き込む（接続断などで失敗したらキューの先頭に戻す）"""
+        with self._condition:
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+        if not batch:
+            return 0
+        # 同じ (user_id, task_id) は最初の完了時刻の1行にまとめる
+        rows = {}
+        for user_id, task_id, completed_at, _ in batch:
+            rows.setdefault((user_id, task_id), (user_id, task_id, completed_at))
+        try:
+            self._write_or_reject(list(rows.values()))
+        except Exception as e:
+            COMPLETION_FLUSH_ERRORS.inc()
+            logger.error(f"Completion write failed ({len(batch)} rows), will retry: {e}")
+            # 接続が壊れている可能性があるので次回は張り直す
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            self._conn = None
+            with self._condition:
+                self._queue.extendleft(reversed(batch))
+            raise
+        COMPLETION_BATCH_SIZE.observe(len(rows))
+        positions = [row[3] for row in batch if row[3] is not None]
+        if positions:
+            self.journal.mark_applied(max(positions))
+        with self._condition:
+            for user_id, task_id, _, _ in batch:
+                key = (user_id, task_id)
+                count = self._pending.get(key, 0) - 1
+                if count > 0:
+                    self._pending[key] = count
+                else:
+                    self._pending.pop(key, None)
+            self._written += len(batch)
+            self._condition.notify_all()
+        return len(batch)
+
+    def _run(self):
+        """ワーカーループ"""
+        logger.info("Completion writer started")
+        while True:
+            with self._condition:
+                while not self._queue and not self._stop:
+                    self._condition.wait()
+                if not self._queue and self._stop:
+                    break
+                # 最初の1件から flush_interval の間に届いた分をまとめる（flush 待ちがあれば即書き込む）
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stop and not self._flush_waiters and len(self._queue) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            try:
+                self._drain_once()
+            except Exception:
+                with self._condition:
+                    if self._stop:
+                        break
+                    self._condition.wait(self.retry_interval)
+        logger.info("Completion writer stopped")
+
+    def start(self):
+        """バックグラウンドワーカーを起動"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="completion-writer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """キューを書き切ってからワーカーを停止（atexit から呼ばれる）"""
+        try:
+            flushed = self.flush(timeout)
+        except Exception as e:
+            logger.error(f"Completion writer flush failed on close: {e}")
+            flushed = False
+        if not flushed:
+            logger.error(f"Completion writer closed with {len(self._queue)} unwritten completions")
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        if self.journal is not None:
+            self.journal.close()
+
+
+class WriteBehindTaskService:
+    """完了書き込みをライターに任せ、読み出しに未書き込みの完了を重ねるタスクサービス"""
+
+    def __init__(self, service, writer: CompletionWriter, max_cached_users: int = 10_000,
+                 service_factory: Optional[Callable] = None):
+        """
+        Args:
+            service: 読み出しに使うタスクサービス（None なら service_factory で初回のDB操作時に作る）
+            service_factory: タスクサービスを作る関数（DB障害中に起動しても完了の受け付けは止めないため、
+                テーブル作成などのDB操作を伴う生成を後回しにする。失敗したら次の呼び出しで作り直す）
+        """
+        self._service = service
+        self._service_factory = service_factory
+        self._service_lock = threading.Lock()
+        self._writer = writer
+        self._max_cached_users = max_cached_users
+        # 直近に読み出したユーザーごとの完了済みタスクID（完了数の計算でDBを読まないため）
+        self._completed_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def service(self):
+        """読み出しに使うタスクサービス（未作成なら作る）"""
+        if self._service is None:
+            with self._service_lock:
+                if self._service is None:
+                    self._service = self._service_factory()
+        return self._service
+
+    def __getattr__(self, name):
+        return getattr(self.service, name)
+
+    def _remember(self, user_id: int, completed_ids: set):
+        with self._cache_lock:
+            self._completed_cache[user_id] = completed_ids
+            self._completed_cache.move_to_end(user_id)
+            while len(self._completed_cache) > self._max_cached_users:
+                self._completed_cache.popitem(last=False)
+
+    def _overlay(self, user_id: int, tasks):
+        """未書き込みの完了を completed=True として反映"""
+        pending = self._writer.pending_task_ids(user_id)
+        if pending:
+            tasks = [{**task, "completed": True} if task['id'] in pending else task for task in tasks]
+        self._remember(user_id, {task['id'] for task in tasks if task['completed']})
+        return tasks
+
+    def mark_task_complete(self, task_id: int, user_id: int):
+        """タスクを完了にマーク（キューに積むだけ）"""
+        self._writer.submit(task_id, user_id)
+
+    def mark_task_complete_and_count(self, task_id: int, user_id: int) -> int:
+        """タスクを完了にマークし、ユーザーの完了数を返す
+
+        完了は受け付けた時点で確定する（ジャーナルがあれば記録済み）ので、完了数のためのDBの読み出しに
+        失敗しても例外にはせず、最後に読めた内容と未書き込みの完了から数える。
+        """
+        self._writer.submit(task_id, user_id)
+        with self._cache_lock:
+            completed = self._completed_cache.get(user_id)
+        if completed is None:
+            try:
+                tasks = self.get_tasks_with_progress(user_id)
+                return len([task for task in tasks if task['completed']])
+            except Exception as e:
+                from circuit_breaker import get_read_only_cache
+                logger.warning(f"Counting completions for user {user_id} without the database: {e}")
+                tasks = get_read_only_cache().dashboard_snapshot(user_id)["tasks"]
+                completed = {task['id'] for task in tasks if task['completed']}
+        completed = completed | self._writer.pending_task_ids(user_id) | {task_id}
+        self._remember(user_id, completed)
+        return len(completed)
+
+    def get_tasks_with_progress(self, user_id: int):
+        """タスクと進捗を取得"""
+        return self._overlay(user_id, self.service.get_tasks_with_progress(user_id))
+
+    def get_dashboard_snapshot(self, user_id: int, aggregates: bool = False) -> dict:
+        """ダッシュボード用データを取得（順位・達成人数は書き込み済みの分で集計）"""
+        snapshot = self.service.get_dashboard_snapshot(user_id, aggregates)
+        return {**snapshot, "tasks": self._overlay(user_id, snapshot["tasks"])}
+
+
+@st.cache_resource
+def get_completion_writer() -> CompletionWriter:
+    """プロセス共有の完了ライター（ワーカー起動済み、終了時に書き切る）を取得"""
+    try:
+        db_config = st.secrets.get("database", {})
+    except Exception:
+        db_config = {}
+    journal_dir = get_completion_journal_dir()
+    writer = CompletionWriter(
+        flush_interval=float(db_config.get("write_behind_interval", 0.005)),
+        max_batch=int(db_config.get("write_behind_max_batch", 500)),
+        journal=CompletionJournal(journal_dir) if journal_dir else None,
+    )
+    writer.start()
+    atexit.register(writer.close)
+    return writer
+
+
+@st.cache_resource
+def get_write_behind_task_service() -> WriteBehindTaskService:
+    """write-behind モードのタスクサービスを取得
+
+    ライター（とジャーナル）はDBに接続せずに作るので、DB障害中に起動しても完了は受け付ける。
+    テーブル作成を伴う読み出し用のサービスは、最初に読み出すときに作る。
+    """
+    from task_db import TaskService, get_db_backend
+
+    def create_service():
+        if get_db_backend() in ("async", "pipeline"):
+            from task_db_async import get_async_task_service
+            return get_async_task_service()
+        return TaskService()
+
+    return WriteBehindTaskService(None, get_completion_writer(), service_factory=create_service)
@@ -0,0 +1,63 @@
+"""
+ダッシュボードのセッション状態
+ミッションごとの show_swt_{id} / show_quiz_{id} / show_sns_{id} や、クリア・報酬ダイアログのフラグを
+セッション状態の別々のキーに持つ代わりに、1セッション1つの小さなオブジェクトにまとめる。
+開いているミッションは同時に1つだけ（別のミッションを開くと前のものは閉じる）。
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import streamlit as st
+
+# st.session_state に置くキー
+STATE_KEY = "dashboard_state"
+
+
+@dataclass(slots=True)
+class DashboardState:
+    """1セッション分のダッシュボードの表示状態"""
+    # 詳細を開いているミッションのID
+    open_task_id: Optional[int] = None
+    # 未完了のミッションだけを表示するか
+    show_only_incomplete: bool = False
+    # クリアしたミッションの名前（クリアダイアログを表示する間だけ入る）
+    cleared_task_title: Optional[str] = None
+    # 達成したマイルストーンの完了数（報酬ダイアログを表示する間だけ 0 以外）
+    reward_milestone: int = 0
+
+    def open_task(self, task_id: int):
+        self.open_task_id = task_id
+
+    def close_task(self, task_id: int):
+        if self.open_task_id == task_id:
+            self.open_task_id = None
+
+    def is_open(self, task_id: int) -> bool:
+        return self.open_task_id == task_id
+
+    def mission_cleared(self, task_id: int, title: str, milestone: int = 0):
+        """ミッション完了後: 詳細を閉じてクリアダイアログ（マイルストーン達成なら続けて報酬ダイアログ）を出す"""
+        self.close_task(task_id)
+        self.cleared_task_title = title
+        if milestone:
+            self.reward_milestone = milestone
+
+    def dismiss_clear_dialog(self):
+        """クリアダイアログを閉じる（報酬ダイアログが続かなければ未完了のみの表示に切り替える）"""
+        self.cleared_task_title = None
+        if not self.reward_milestone:
+            self.show_only_incomplete = True
+
+    def dismiss_reward_dialog(self):
+        """報酬ダイアログを閉じて未完了のみの表示に切り替える"""
+        self.reward_milestone = 0
+        self.show_only_incomplete = True
+
+
+def get_dashboard_state() -> DashboardState:
+    """このセッションのダッシュボード状態（なければ作る）"""
+    state = st.session_state.get(STATE_KEY)
+    if state is None:
+        state = DashboardState()
+        st.session_state[STATE_KEY] = state
+    return state
@@ -6,21 +6,10 @@ Login screen with user registration and authentication
 import streamlit as st
 import os
 import base64
-import time
-from user import UserService
-
-@st.fragment
-def handle_user_validation(name: str):
-    """
-    Handle user existence check with fragment for better performance
-    """
-    user_service = UserService()
-    
-    with st.spinner("ユーザー情報を確認中..."):
-        success, message, user = user_service.login_user(name)
-        user_exists = user is not None
-    
-    return user_exists
+from user import get_user_service, LOGIN_NOT_FOUND, LOGIN_TIMEOUT
+from circuit_breaker import DB_UNAVAILABLE_ERRORS
+from metrics import track_rerun
+from session_token import remember_login, restore_session
 
 def display_messages():
     """
@@ -49,45 +38,47 @@ def handle_submit(intent: str):
     if name and name.strip():
         name = name.strip()
         
-        # Use fragment for user validation
-        user_exists = handle_user_validation(name)
-        
-        user_service = UserService()
-        
+        try:
+            user_service = get_user_service()
+        except DB_UNAVAILABLE_ERRORS:
+            # DB障害中（サーキットブレーカーが開いている間）は待たせずに案内する
+            st.session_state.error_message = "現在サーバーに接続できません。しばらくしてから再度お試しください。"
+            return
+
         if intent == 'play':  # New user registration
-            if user_exists:
+            # 存在確認と登録を1文で行う（同時登録でも重複しない）
+            with st.spinner("新規登録中..."):
+                success, message, user, created = user_service.get_or_create_user(name)
+            if not success:
+                st.session_state.error_message = message
+            elif not created:
                 # Existing user - show popup message and prompt to use login button
                 st.session_state.popup_message = f"⚠️ 「{name}」は既に登録済みです。登録済みの方は下の「登録済みの方はこちら」ボタンからログインしてください。"
                 st.session_state.popup_type = "existing_user"
             else:
-                # New user registration
-                with st.spinner("新規登録中..."):
-                    success, message, user = user_service.register_user(name)
-                if success and user:
-                    st.session_state.popup_message = f"登録完了！{name}さん、ようこそSnowVillageへ！"
-                    st.session_state.popup_type = "new_user"
-                    st.session_state.result = {
-                        "name": name,
-                        "intent": "new_user",
-                        "user": user
-                    }
-                else:
-                    st.session_state.error_message = message
+                st.session_state.popup_message = f"登録完了！{name}さん、ようこそSnowVillageへ！"
+                st.session_state.popup_type = "new_user"
+                st.session_state.result = {
+                    "name": name,
+                    "intent": "new_user",
+                    "user": user
+                }
         
         elif intent == 'login':  # Existing user login
-            if not user_exists:
+            with st.spinner("ログイン中..."):
+                success, message, user, status = user_service.login_user(name)
+            if success and user:
+                st.session_state.result = {
+                    "name": name,
+                    "intent": "existing_user",
+                    "user": user
+                }
+            elif status == LOGIN_NOT_FOUND:
                 st.session_state.error_message = f"「{name}」は登録されていません。新規登録してください。"
+            elif status == LOGIN_TIMEOUT:
+                st.session_state.error_message = message
             else:
-                with st.spinner("ログイン中..."):
-                    success, message, user = user_service.login_user(name)
-                if success and user:
-                    st.session_state.result = {
-                        "name": name,
-                        "intent": "existing_user",
-                        "user": user
-                    }
-                else:
-                    st.session_state.error_message = f"「{name}」は登録済みですが、ログインに失敗しました。管理者にお問い合わせください。"
+                st.session_state.error_message = f"「{name}」は登録済みですが、ログインに失敗しました。管理者にお問い合わせください。"
         
         # Clear error messages if not login intent
         if 'error_message' in st.session_state and intent != 'login':
@@ -210,6 +201,25 @@ def launch_screen():
     
     return None
 
+# ログイン後、お祝いの表示を見せてからダッシュボードへ移動するまでの秒数
+LOGIN_REDIRECT_SECONDS = 4
+
+
+@st.fragment(run_every=LOGIN_REDIRECT_SECONDS)
+def redirect_to_dashboard():
+    """
+    Redirect to the dashboard once the celebration has been shown
+
+    待ち時間はブラウザ側のタイマー（run_every）で数えるので、待っている間スクリプトのスレッドを占有しない。
+    ページと一緒の初回実行では予約だけして、タイマーによる次の実行で移動する。
+    """
+    if st.session_state.get("redirect_armed"):
+        del st.session_state.redirect_pending
+        del st.session_state.redirect_armed
+        st.switch_page("pages/dashboard.py")
+    st.session_state.redirect_armed = True
+
+
 def main():
     """
     Main function to run the Snow Village application
@@ -226,6 +236,10 @@ def main():
 
     st.markdown("<style>[data-testid='stSidebar'] { display: none; }</style>", unsafe_allow_html=True)
 
+    # 署名付きトークンで前回のログインを復元できれば、名前の入力もDBへの問い合わせもせずにダッシュボードへ
+    if not st.session_state.get("user_info") and restore_session():
+        st.switch_page("pages/dashboard.py")
+
     if "user_info" not in st.session_state:
         st.session_state.user_info = None
 
@@ -233,20 +247,22 @@ def main():
 
     if login_result:
         st.session_state.user_info = login_result
-        st.session_state.authenticated_user = login_result.get('user')
+        remember_login(login_result['user'])
         
         if login_result['intent'] == 'new_user':
             st.snow()
             st.success(f"🎉 ようこそ {st.session_state.user_info['name']} さん！")
             st.info("ダッシュボードへ移動します...")
-            time.sleep(4)
-            st.switch_page("pages/dashboard.py")
+            st.session_state.redirect_pending = True
         elif login_result['intent'] == 'existing_user':
             st.snow()
             st.success(f"おかえりなさい {st.session_state.user_info['name']} さん！")
             st.info("ダッシュボードへ移動します...")
-            time.sleep(4)
-            st.switch_page("pages/dashboard.py")
+            st.session_state.redirect_pending = True
+
+    if st.session_state.get("redirect_pending"):
+        redirect_to_dashboard()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with track_rerun("launch_screen"):
+        main()
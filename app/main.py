@@ -4,6 +4,8 @@ This file imports and runs the launch screen application
 """
 
 from launch_screen import main
+from metrics import track_rerun
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with track_rerun("launch_screen"):
+        main()
\ No newline at end of file
@@ -0,0 +1,441 @@
+"""
+Prometheus形式のメトリクス
+プロセス内レジストリと、Streamlitと並走するテキスト形式のエクスポーズ用HTTPサーバーを提供
+"""
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# Prometheusクライアントと同じデフォルトバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _escape_label_value(value) -> str:
+    """ラベル値をエクスポーズ形式用にエスケープ"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra: str = "") -> str:
+    """ラベル部分 `{a="1",b="2"}` を生成"""
+    parts = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    """数値をエクスポーズ形式に変換"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """メトリクス共通処理"""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        """ラベル辞書を内部キーに変換"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        """エクスポーズ形式の行を返す"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """単調増加カウンター"""
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """カウンターを加算"""
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """増減するゲージ"""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        """値を設定"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1, **labels):
+        """値を加算"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        """値を減算"""
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """スクレイプ時に評価する関数を設定（ラベルなしゲージ専用）"""
+        self._function = function
+
+    def render(self) -> list[str]:
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception as e:
+                logger.debug(f"Gauge callback for {self.name} failed: {e}")
+        return super().render()
+
+
+class Histogram(_Metric):
+    """累積バケット付きヒストグラム"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        """観測値を記録"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ブロックの実行時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        with self._lock:
+            items = sorted((key, dict(state, counts=list(state["counts"]))) for key, state in self._values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{label_str} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録とエクスポーズ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric: _Metric):
+        """メトリクスを登録"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric name: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str):
+        """名前でメトリクスを取得"""
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """全メトリクスをテキストエクスポーズ形式で出力"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- アプリケーションメトリクス ---
+DB_QUERY_SECONDS = Histogram(
+    "snowvillage_db_query_duration_seconds",
+    "Duration of database operations in seconds.",
+    ["query"],
+)
+DB_QUERY_ERRORS = Counter(
+    "snowvillage_db_query_errors_total",
+    "Database operations that raised an exception.",
+    ["query"],
+)
+DB_CONNECTIONS_OPENED = Counter(
+    "snowvillage_db_connections_opened_total",
+    "Database connections opened by the app process.",
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "snowvillage_db_connections_in_use",
+    "Database operations currently holding a connection.",
+)
+PAGE_RERUN_SECONDS = Histogram(
+    "snowvillage_page_rerun_duration_seconds",
+    "Duration of Streamlit script reruns per page in seconds.",
+    ["page"],
+)
+SLACK_SEND_SECONDS = Histogram(
+    "snowvillage_slack_send_duration_seconds",
+    "Duration of Slack webhook posts in seconds.",
+    ["outcome"],
+)
+SLACK_RATE_LIMITED = Counter(
+    "snowvillage_slack_rate_limited_total",
+    "Slack posts held back by the local token bucket or rejected with 429.",
+    ["source"],
+)
+SLACK_DIGESTS = Counter(
+    "snowvillage_slack_digests_total",
+    "Digest messages that coalesced several queued posts.",
+)
+SLACK_OUTBOX_ENQUEUED = Counter(
+    "snowvillage_slack_outbox_enqueued_total",
+    "Anonymous posts added to the Slack outbox.",
+)
+SLACK_OUTBOX_DELIVERIES = Counter(
+    "snowvillage_slack_outbox_deliveries_total",
+    "Slack outbox delivery attempts by result (sent, retry, failed).",
+    ["result"],
+)
+MODERATION_RESULTS = Counter(
+    "snowvillage_moderation_results_total",
+    "Anonymous posts by moderation decision (allow, hold, reject).",
+    ["action"],
+)
+FLOOD_REJECTIONS = Counter(
+    "snowvillage_flood_rejections_total",
+    "Anonymous posts rejected by rate limiting or duplicate detection.",
+    ["reason"],
+)
+COMPLETION_QUEUE_DEPTH = Gauge(
+    "snowvillage_completion_queue_depth",
+    "Task completions queued by the write-behind writer and not yet written.",
+)
+COMPLETION_BATCH_SIZE = Histogram(
+    "snowvillage_completion_batch_rows",
+    "Rows written per write-behind completion batch.",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500),
+)
+COMPLETION_FLUSH_ERRORS = Counter(
+    "snowvillage_completion_flush_errors_total",
+    "Write-behind completion batches that failed and were requeued.",
+)
+COMPLETION_REJECTED = Counter(
+    "snowvillage_completion_rejected_total",
+    "Write-behind completions dropped because the database rejected the row (e.g. unknown task).",
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "snowvillage_db_pool_wait_seconds",
+    "Time spent waiting for a free connection in the sync connection pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+DB_CIRCUIT_OPEN = Gauge(
+    "snowvillage_db_circuit_open",
+    "1 while the database circuit breaker is open (read-only mode), else 0.",
+)
+DB_CIRCUIT_TRIPS = Counter(
+    "snowvillage_db_circuit_trips_total",
+    "Times the database circuit breaker opened after repeated connection failures.",
+)
+READ_ONLY_RENDERS = Counter(
+    "snowvillage_read_only_renders_total",
+    "Page renders served from cached data while the database was unavailable.",
+    ["page"],
+)
+DB_QUERY_TIMEOUTS = Counter(
+    "snowvillage_db_query_timeouts_total",
+    "Database operations cancelled by statement_timeout or lock_timeout.",
+    ["query", "kind"],
+)
+USER_AUTH_TOTAL = Counter(
+    "snowvillage_user_auth_total",
+    "Login and registration attempts by result.",
+    ["action", "result"],
+)
+ACTIVE_SESSIONS = Gauge(
+    "snowvillage_active_sessions",
+    "Browser sessions that reran a page in this process within the last active window.",
+)
+
+# 最後のページ再実行からこの秒数以内のセッションをアクティブとみなす
+ACTIVE_SESSION_WINDOW_SECONDS = 300
+
+
+class SessionActivity:
+    """セッションごとの最終再実行時刻（Streamlitランタイムの内部に頼らずにアクティブセッション数を数える）"""
+
+    def __init__(self, window_seconds: float = ACTIVE_SESSION_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._last_seen = {}
+
+    def touch(self, session_id: str, now: float = None):
+        """セッションの再実行を記録"""
+        with self._lock:
+            self._last_seen[session_id] = time.monotonic() if now is None else now
+
+    def count(self, now: float = None) -> int:
+        """ウィンドウ内に再実行したセッション数（古いものは捨てる）"""
+        cutoff = (time.monotonic() if now is None else now) - self.window_seconds
+        with self._lock:
+            self._last_seen = {sid: seen for sid, seen in self._last_seen.items() if seen >= cutoff}
+            return len(self._last_seen)
+
+
+SESSION_ACTIVITY = SessionActivity()
+ACTIVE_SESSIONS.set_function(SESSION_ACTIVITY.count)
+
+
+def _current_session_id():
+    """実行中のスクリプトのセッションID（Streamlitの外なら None）"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+# SQLSTATE: statement_timeout による取り消し / lock_timeout によるロック取得失敗
+QUERY_TIMEOUT_SQLSTATES = {"57014": "statement", "55P03": "lock"}
+
+
+def query_timeout_kind(error: BaseException):
+    """タイムアウトによるDBエラーなら "statement" / "lock"、それ以外は None（psycopg2 / psycopg 3 共通）"""
+    sqlstate = getattr(error, "sqlstate", None) or getattr(error, "pgcode", None)
+    return QUERY_TIMEOUT_SQLSTATES.get(sqlstate)
+
+
+def record_query_error(name: str, error: BaseException) -> bool:
+    """DB操作のエラーを記録（例外を握りつぶして失敗を返す呼び出し元用）。タイムアウトなら True"""
+    DB_QUERY_ERRORS.inc(query=name)
+    return record_query_timeout(name, error)
+
+
+def record_query_timeout(name: str, error: BaseException) -> bool:
+    """タイムアウトによるエラーなら件数を記録して True"""
+    kind = query_timeout_kind(error)
+    if kind is None:
+        return False
+    DB_QUERY_TIMEOUTS.inc(query=name, kind=kind)
+    return True
+
+
+@contextmanager
+def track_query(name: str):
+    """DB操作の所要時間・エラー・使用中接続数を記録（デコレーターとしても利用可能）"""
+    DB_CONNECTIONS_IN_USE.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_query_error(name, e)
+        raise
+    finally:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, query=name)
+        DB_CONNECTIONS_IN_USE.dec()
+
+
+@contextmanager
+def track_rerun(page: str):
+    """ページのスクリプト再実行時間を記録（初回にメトリクスサーバーを起動）"""
+    ensure_metrics_server()
+    session_id = _current_session_id()
+    if session_id is not None:
+        SESSION_ACTIVITY.touch(session_id)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PAGE_RERUN_SECONDS.observe(time.perf_counter() - start, page=page)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics を返すハンドラー"""
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # スクレイプごとのアクセスログは出さない
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = None) -> ThreadingHTTPServer:
+    """メトリクスサーバーをデーモンスレッドで起動"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or REGISTRY})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Metrics server listening on {host}:{server.server_address[1]}")
+    return server
+
+
+@st.cache_resource
+def ensure_metrics_server():
+    """メトリクスサーバーをプロセスで一度だけ起動"""
+    if os.getenv("METRICS_ENABLED", "1") == "0":
+        return None
+    # 既定ではローカルからのスクレイプだけを受ける（コンテナなどで外に出すときは METRICS_HOST=0.0.0.0）
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+    port = int(os.getenv("METRICS_PORT", "9108"))
+    try:
+        return start_metrics_server(port, host)
+    except OSError as e:
+        logger.warning(f"Metrics server could not bind {host}:{port}: {e}")
+        return None
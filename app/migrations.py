@@ -0,0 +1,154 @@
+"""
+スキーママイグレーション
+CREATE TABLE IF NOT EXISTS で作った初期スキーマに対する変更（主にインデックス）を
+番号順に一度だけ適用し、適用済みの番号を schema_migrations に記録する。
+複数プロセスが同時に起動しても advisory lock で1つずつ適用される（ロックを取れなかったプロセスは
+待たずに適用を任せて起動を続ける。ロック待ちで起動が失敗し、読み取り専用モードに落ちないように）。
+
+既にデータがある本番DBでは、トランザクション内のインデックス作成は完了登録の書き込みを
+作成が終わるまで止めてしまう。アプリを更新する前に、書き込みを止めずに作る
+CREATE INDEX CONCURRENTLY で先にインデックスを作っておく（作成済みならマイグレーションでは作らない）:
+
+実行例:
+    DB_HOST=127.0.0.1 python migrations.py --prebuild-indexes
+
+インデックスは実際のクエリ（task_db.py / user.py の SQL 定数）から設計している:
+- TASKS_WITH_PROGRESS_SQL / COMPLETED_COUNT_SQL: progress を user_id で引く
+- USER_RANKING_SQL / USER_RANK_SQL: progress 全体を user_id 順に集計し completed_at の最大を取る
+- MARK_TASK_COMPLETE_SQL / 完了の一括INSERT: ON CONFLICT (user_id, task_id)
+- ログイン・登録: users.username の完全一致（UNIQUE 制約のインデックスで足りる）
+"""
+import argparse
+import logging
+
+import psycopg2
+import psycopg2.errors
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_xact_lock のキー（任意の固定値）
+MIGRATION_LOCK_ID = 7_301_204
+
+CREATE_MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# (番号, 説明, SQL文のリスト)。適用済みの番号の内容は変更しないこと
+MIGRATIONS = [
+    (
+        1,
+        "progress: (user_id, task_id) の一意インデックスに completed_at を含める",
+        [
+            # ランキング集計を Index Only Scan + Merge Join で読めるようにする（ヒープを読まない）。
+            # ON CONFLICT (user_id, task_id) はこの一意インデックスで判定される
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS progress_user_task_idx
+                ON progress (user_id, task_id) INCLUDE (completed_at)
+            """,
+            # 同じキーの UNIQUE 制約のインデックスは不要になるので削除（書き込みコストを増やさない）
+            "ALTER TABLE progress DROP CONSTRAINT IF EXISTS progress_user_id_task_id_key",
+        ],
+    ),
+]
+
+# マイグレーションより先に書き込みを止めずに作れるインデックス: (インデックス名, CREATE INDEX CONCURRENTLY 文)
+PREBUILD_INDEXES = [
+    (
+        "progress_user_task_idx",
+        """
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS progress_user_task_idx
+            ON progress (user_id, task_id) INCLUDE (completed_at)
+        """,
+    ),
+]
+
+
+def apply_migrations(conn, lock_timeout_ms: int = 1000) -> list[int]:
+    """未適用のマイグレーションを適用して、適用した番号を返す（コミットは呼び出し側）
+
+    他のプロセスが適用中なら待たずに何もしない。DDL がロック待ちのタイムアウトになった場合は
+    そのマイグレーションを取り消して以降を次回の起動に回す。
+    """
+    applied_now = []
+    with conn.cursor() as cur:
+        # インデックス作成は時間がかかりうるので文のタイムアウトは外す
+        cur.execute("SET LOCAL statement_timeout = 0")
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        if not cur.fetchone()[0]:
+            logger.info("Schema migrations are being applied by another process; skipping")
+            return applied_now
+        # ロックを取れてから、DDL が使用中のテーブルを待つ時間だけ制限する
+        cur.execute(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}")
+        cur.execute(CREATE_MIGRATIONS_TABLE_SQL)
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+        for version, description, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            cur.execute("SAVEPOINT migration")
+            try:
+                for sql in statements:
+                    cur.execute(sql)
+            except psycopg2.errors.LockNotAvailable as e:
+                cur.execute("ROLLBACK TO SAVEPOINT migration")
+                logger.warning(f"Schema migration {version} postponed (table busy): {e}")
+                break
+            cur.execute("RELEASE SAVEPOINT migration")
+            cur.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            applied_now.append(version)
+    return applied_now
+
+
+def prebuild_indexes(conn) -> list[str]:
+    """PREBUILD_INDEXES を CREATE INDEX CONCURRENTLY で作り、作ったインデックス名を返す
+
+    トランザクションの外で実行するため conn は autocommit にする。途中で失敗して無効のまま
+    残ったインデックスは作り直す。
+    """
+    conn.autocommit = True
+    built = []
+    with conn.cursor() as cur:
+        cur.execute("SET statement_timeout = 0")
+        for name, sql in PREBUILD_INDEXES:
+            cur.execute("""
+                SELECT i.indisvalid FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+            """, (name,))
+            row = cur.fetchone()
+            if row and row[0]:
+                continue
+            if row:
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            cur.execute(sql)
+            built.append(name)
+    return built
+
+
+def main():
+    parser = argparse.ArgumentParser(description="schema migrations")
+    parser.add_argument("--prebuild-indexes", action="store_true",
+                        help="マイグレーションのインデックスを CREATE INDEX CONCURRENTLY で先に作る")
+    args = parser.parse_args()
+    if not args.prebuild_indexes:
+        parser.error("--prebuild-indexes を指定してください")
+
+    from task_db import load_connection_params
+
+    conn = psycopg2.connect(**load_connection_params())
+    try:
+        built = prebuild_indexes(conn)
+    finally:
+        conn.close()
+    print(f"作成したインデックス: {', '.join(built) or 'なし（作成済み）'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""
+匿名投稿のモデレーション
+NGワードをAho–Corasick法でまとめて照合し、投稿を許可・保留・拒否に振り分ける
+"""
+import hashlib
+import heapq
+import hmac
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+import yaml
+import streamlit as st
+
+from metrics import MODERATION_RESULTS, FLOOD_REJECTIONS
+
+# 判定結果
+ACTION_ALLOW = "allow"
+ACTION_HOLD = "hold"
+ACTION_REJECT = "reject"
+
+DEFAULT_NG_WORDS_PATH = os.path.join(os.path.dirname(__file__), "ng_words.yml")
+
+# カタカナ（ァ〜ヶ）→ひらがなの対応表
+_KATAKANA_TO_HIRAGANA = {chr(code): chr(code - 0x60) for code in range(ord("ァ"), ord("ヶ") + 1)}
+_HIRAGANA_TO_KATAKANA = {hiragana: katakana for katakana, hiragana in _KATAKANA_TO_HIRAGANA.items()}
+_KATAKANA_TRANSLATION = str.maketrans(_KATAKANA_TO_HIRAGANA)
+# 照合前に取り除く文字（空白・区切り記号・ゼロ幅文字）。「ば か」「ば.か」のような分割を検出するため
+_SEPARATORS_RE = re.compile("[ \t\r\n\u3000・.,、。\\-_/*~〜|\u200b\u200c\u200d\ufeff]+")
+
+
+def normalize_text(text: str, fold_kana: bool = True) -> str:
+    """照合用に正規化（全角/半角統一・大文字小文字・区切り除去・カタカナ→ひらがな）"""
+    # NFKC で全角英数→半角、半角カナ→全角カナ、濁点の合成などを揃える
+    text = _SEPARATORS_RE.sub("", unicodedata.normalize("NFKC", text).casefold())
+    # 本文側はオートマトンがカタカナの遷移を持つため、1文字ずつの変換（遅い）を省略できる
+    return text.translate(_KATAKANA_TRANSLATION) if fold_kana else text
+
+
+class AhoCorasick:
+    """複数パターンを1パスで照合するAho–Corasickオートマトン"""
+
+    def __init__(self, patterns, aliases: dict = None):
+        """
+        Args:
+            patterns: 照合するパターン
+            aliases: 同一視する文字の対応 {パターン側の文字: 本文側で同じ扱いにする文字}
+        """
+        self.patterns = list(patterns)
+        # 状態ごとの遷移表・失敗遷移・出力（その状態で終わるパターン番号）
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for index, pattern in enumerate(self.patterns):
+            self._add(pattern, index)
+        self._build_failure_links()
+        if aliases:
+            self._add_aliases(aliases)
+        # 照合ループで属性参照を省くため、各状態の dict.get を束縛しておく
+        self._lookups = [transitions.get for transitions in self._goto]
+
+    def _add(self, pattern: str, index: int):
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] = self._output[state] + (index,)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                # 失敗遷移先の出力も引き継ぎ、照合時に失敗リンクをたどらずに済むようにする
+                if self._output[self._fail[next_state]]:
+                    self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def _add_aliases(self, aliases: dict):
+        """別名の文字にも同じ遷移を張る（失敗遷移の計算後に行う）"""
+        for transitions in self._goto:
+            extra = {aliases[ch]: next_state for ch, next_state in transitions.items() if ch in aliases}
+            for ch, next_state in extra.items():
+                transitions.setdefault(ch, next_state)
+
+    def find_all(self, text: str) -> set[int]:
+        """text 中に出現するパターン番号の集合を返す"""
+        lookups = self._lookups
+        fail = self._fail
+        output = self._output
+        found = set()
+        state = 0
+        for ch in text:
+            next_state = lookups[state](ch)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = lookups[state](ch)
+            state = next_state or 0
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def __len__(self) -> int:
+        """状態数"""
+        return len(self._goto)
+
+
+@dataclass
+class ModerationResult:
+    """モデレーション結果"""
+    action: str
+    matches: list[str] = field(default_factory=list)
+
+    @property
+    def allowed(self) -> bool:
+        return self.action == ACTION_ALLOW
+
+
+class NgWordFilter:
+    """NGワードフィルター"""
+
+    def __init__(self, reject_words=(), hold_words=()):
+        words = []
+        actions = []
+        seen = set()
+        # 同じ語が両方にある場合は拒否を優先
+        for action, source in ((ACTION_REJECT, reject_words), (ACTION_HOLD, hold_words)):
+            for word in source:
+                normalized = normalize_text(str(word))
+                if normalized and normalized not in seen:
+                    seen.add(normalized)
+                    words.append(normalized)
+                    actions.append(action)
+        self._actions = actions
+        # パターンはひらがなに揃え、本文側のカタカナはオートマトンの別名遷移で吸収する
+        self._matcher = AhoCorasick(words, aliases=_HIRAGANA_TO_KATAKANA)
+
+    @classmethod
+    def from_yaml(cls, path: str) -> "NgWordFilter":
+        """YAML（reject: [...], hold: [...]）から読み込み"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        return cls(data.get("reject") or [], data.get("hold") or [])
+
+    def scan(self, text: str) -> ModerationResult:
+        """投稿本文を判定"""
+        found = self._matcher.find_all(normalize_text(text, fold_kana=False))
+        if not found:
+            return ModerationResult(ACTION_ALLOW)
+        matches = sorted(self._matcher.patterns[i] for i in found)
+        if any(self._actions[i] == ACTION_REJECT for i in found):
+            return ModerationResult(ACTION_REJECT, matches)
+        return ModerationResult(ACTION_HOLD, matches)
+
+
+@st.cache_resource
+def get_ng_word_filter() -> NgWordFilter:
+    """プロセス共有のNGワードフィルターを取得（オートマトン構築は1回だけ）"""
+    try:
+        moderation_config = st.secrets.get("moderation", {})
+    except Exception:
+        moderation_config = {}
+    path = moderation_config.get("ng_words_path") or os.getenv("NG_WORDS_PATH", DEFAULT_NG_WORDS_PATH)
+    if not os.path.exists(path):
+        print(f"NG word list not found: {path}")
+        return NgWordFilter()
+    return NgWordFilter.from_yaml(path)
+
+
+def get_moderators() -> set[str]:
+    """保留中の投稿を承認・却下できるユーザー名（[moderation] moderators または環境変数 MODERATORS のカンマ区切り）"""
+    try:
+        moderators = st.secrets.get("moderation", {}).get("moderators")
+    except Exception:
+        moderators = None
+    if moderators is None:
+        moderators = os.getenv("MODERATORS", "").split(",")
+    elif isinstance(moderators, str):
+        moderators = moderators.split(",")
+    return {name.strip() for name in moderators if name and name.strip()}
+
+
+def is_moderator(username: str) -> bool:
+    """保留中の投稿を確認できるユーザー名か（ログインは名前だけなので、確認画面には合言葉も必要）"""
+    return bool(username) and username in get_moderators()
+
+
+def get_moderator_passphrase() -> Optional[str]:
+    """確認画面の合言葉（[moderation] passphrase または環境変数 MODERATOR_PASSPHRASE。未設定なら None）"""
+    try:
+        passphrase = st.secrets.get("moderation", {}).get("passphrase")
+    except Exception:
+        passphrase = None
+    return passphrase or os.getenv("MODERATOR_PASSPHRASE") or None
+
+
+def check_moderator_passphrase(entered: str) -> bool:
+    """入力された合言葉が正しいか（未設定なら常に False で、確認画面は使えない）"""
+    passphrase = get_moderator_passphrase()
+    if not passphrase or not entered:
+        return False
+    return hmac.compare_digest(entered.encode("utf-8"), passphrase.encode("utf-8"))
+
+
+def moderate(text: str) -> ModerationResult:
+    """投稿本文をモデレーションし、結果をメトリクスに記録"""
+    result = get_ng_word_filter().scan(text)
+    MODERATION_RESULTS.inc(action=result.action)
+    return result
+
+
+# --- 連投・重複投稿の検出 ---
+
+# 判定理由
+REASON_USER_RATE = "user_rate"
+REASON_GLOBAL_RATE = "global_rate"
+REASON_DUPLICATE = "duplicate"
+
+
+def minhash_sketch(text: str, k: int = 64, shingle_size: int = 3) -> tuple[int, ...]:
+    """文字n-gramのbottom-k MinHashスケッチ（1種類のハッシュで小さい方からk個）"""
+    if len(text) <= shingle_size:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+    hashes = (
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in shingles
+    )
+    return tuple(heapq.nsmallest(k, hashes))
+
+
+def estimate_similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    """2つのbottom-kスケッチからJaccard係数を推定"""
+    if not a or not b:
+        return 0.0
+    k = min(len(a), len(b))
+    union_bottom = heapq.nsmallest(k, set(a) | set(b))
+    common = set(a) & set(b)
+    return sum(1 for h in union_bottom if h in common) / k
+
+
+@dataclass(eq=False)
+class FloodRecord:
+    """FloodGuard に記録した1件の投稿（cancel でこの1件だけを取り消す目印）"""
+    user_id: object
+    recorded_at: float
+    digest: bytes
+
+
+@dataclass
+class FloodCheckResult:
+    """連投チェック結果（check_and_record で記録した場合は record にその記録が入る）"""
+    allowed: bool
+    reason: Optional[str] = None
+    retry_after: float = 0.0
+    record: Optional[FloodRecord] = None
+
+
+class FloodGuard:
+    """ユーザー別・全体のレート制限と近似重複検出（メモリ上限とTTL付き）"""
+
+    def __init__(self, per_user_limit: int = 3, per_user_window: float = 60.0,
+                 global_limit: int = 30, global_window: float = 10.0,
+                 duplicate_window: float = 600.0, duplicate_threshold: float = 0.8,
+                 max_users: int = 10_000, max_recent: int = 500, sketch_size: int = 64,
+                 clock=time.monotonic):
+        """
+        Args:
+            per_user_limit / per_user_window: ユーザーごとに window 秒あたり limit 件まで
+            global_limit / global_window: プロセス全体で window 秒あたり limit 件まで
+            duplicate_window: 重複判定で比較する直近投稿の保持秒数
+            duplicate_threshold: この推定Jaccard係数以上なら近似重複とみなす
+            max_users: 投稿時刻を保持するユーザー数の上限（古いものから捨てる）
+            max_recent: 重複判定用に保持する直近投稿数の上限
+        """
+        self.per_user_limit = per_user_limit
+        self.per_user_window = per_user_window
+        self.global_limit = global_limit
+        self.global_window = global_window
+        self.duplicate_window = duplicate_window
+        self.duplicate_threshold = duplicate_threshold
+        self.max_users = max_users
+        self.sketch_size = sketch_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # user_id -> FloodRecord のdeque（LRU順）
+        self._user_events: OrderedDict = OrderedDict()
+        self._global_events = deque()
+        # (FloodRecord, スケッチ, スケッチの集合)
+        self._recent = deque(maxlen=max_recent)
+        self._recent_digests = {}
+
+    def _evict(self, now: float):
+        """期限切れの記録を捨てる（ロック取得済みで呼ぶ）"""
+        while self._global_events and now - self._global_events[0].recorded_at >= self.global_window:
+            self._global_events.popleft()
+        while self._recent and now - self._recent[0][0].recorded_at >= self.duplicate_window:
+            self._release_digest(self._recent.popleft()[0].digest)
+        # LRU先頭（最も古く更新されたユーザー）から、期限切れ分を捨てる
+        while self._user_events:
+            user_id, events = next(iter(self._user_events.items()))
+            if events and now - events[-1].recorded_at < self.per_user_window and len(self._user_events) <= self.max_users:
+                break
+            self._user_events.popitem(last=False)
+
+    def _release_digest(self, digest: bytes):
+        count = self._recent_digests.get(digest, 0) - 1
+        if count > 0:
+            self._recent_digests[digest] = count
+        else:
+            self._recent_digests.pop(digest, None)
+
+    def _fingerprint(self, text: str) -> tuple[bytes, tuple[int, ...]]:
+        normalized = normalize_text(text)
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        return digest, minhash_sketch(normalized, self.sketch_size)
+
+    def check(self, user_id, text: str) -> FloodCheckResult:
+        """投稿可否を判定（記録はしない）"""
+        digest, sketch = self._fingerprint(text)
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            return self._check_locked(user_id, digest, sketch, now)
+
+    def check_and_record(self, user_id, text: str) -> FloodCheckResult:
+        """投稿可否を判定し、許可なら同じロックの中で記録する（同じユーザーの連続送信が両方通らない）"""
+        digest, sketch = self._fingerprint(text)
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            result = self._check_locked(user_id, digest, sketch, now)
+            if result.allowed:
+                result.record = self._record_locked(user_id, digest, sketch, now)
+            return result
+
+    def _check_locked(self, user_id, digest: bytes, sketch: tuple[int, ...], now: float) -> FloodCheckResult:
+        events = self._user_events.get(user_id)
+        if events:
+            while events and now - events[0].recorded_at >= self.per_user_window:
+                events.popleft()
+            if len(events) >= self.per_user_limit:
+                return self._reject(REASON_USER_RATE, events[0].recorded_at + self.per_user_window - now)
+
+        if len(self._global_events) >= self.global_limit:
+            return self._reject(REASON_GLOBAL_RATE, self._global_events[0].recorded_at + self.global_window - now)
+
+        if digest in self._recent_digests:
+            return self._reject(REASON_DUPLICATE)
+        # 共通ハッシュ数は推定値の上限なので、まず集合の積だけで大半を除外する
+        sketch_set = frozenset(sketch)
+        required = self.duplicate_threshold * min(len(sketch), self.sketch_size)
+        for _, recent_sketch, recent_set in self._recent:
+            if len(sketch_set & recent_set) < required:
+                continue
+            if estimate_similarity(sketch, recent_sketch) >= self.duplicate_threshold:
+                return self._reject(REASON_DUPLICATE)
+        return FloodCheckResult(True)
+
+    def _reject(self, reason: str, retry_after: float = 0.0) -> FloodCheckResult:
+        FLOOD_REJECTIONS.inc(reason=reason)
+        return FloodCheckResult(False, reason, max(0.0, retry_after))
+
+    def record(self, user_id, text: str) -> FloodRecord:
+        """受け付けた投稿を記録"""
+        digest, sketch = self._fingerprint(text)
+        with self._lock:
+            now = self._clock()
+            record = self._record_locked(user_id, digest, sketch, now)
+            self._evict(now)
+            return record
+
+    def _record_locked(self, user_id, digest: bytes, sketch: tuple[int, ...], now: float) -> FloodRecord:
+        record = FloodRecord(user_id, now, digest)
+        events = self._user_events.pop(user_id, None) or deque()
+        events.append(record)
+        self._user_events[user_id] = events
+        self._global_events.append(record)
+        if len(self._recent) == self._recent.maxlen:
+            self._release_digest(self._recent[0][0].digest)
+        self._recent.append((record, sketch, frozenset(sketch)))
+        self._recent_digests[record.digest] = self._recent_digests.get(record.digest, 0) + 1
+        return record
+
+    def cancel(self, record: FloodRecord):
+        """check_and_record で記録した投稿を取り消す（送信の受付に失敗した場合。再送が重複扱いにならない）
+
+        同じユーザーが並行して送った別の投稿の記録には触れず、この record の1件だけを外す。
+        期限切れなどで既に捨てられていれば何もしない。
+        """
+        with self._lock:
+            _remove_identical(self._user_events.get(record.user_id, ()), record)
+            _remove_identical(self._global_events, record)
+            for index in range(len(self._recent) - 1, -1, -1):
+                if self._recent[index][0] is record:
+                    del self._recent[index]
+                    self._release_digest(record.digest)
+                    break
+
+    def tracked_users(self) -> int:
+        """保持しているユーザー数"""
+        with self._lock:
+            return len(self._user_events)
+
+
+def _remove_identical(records, record: FloodRecord):
+    """deque から record と同一のオブジェクトを1つ取り除く（新しい側から探す）"""
+    for index in range(len(records) - 1, -1, -1):
+        if records[index] is record:
+            del records[index]
+            return
+
+
+@st.cache_resource
+def get_flood_guard() -> FloodGuard:
+    """プロセス共有の連投ガードを取得"""
+    try:
+        flood_config = st.secrets.get("flood", {})
+    except Exception:
+        flood_config = {}
+    return FloodGuard(
+        per_user_limit=int(flood_config.get("per_user_limit", 3)),
+        per_user_window=float(flood_config.get("per_user_window", 60)),
+        global_limit=int(flood_config.get("global_limit", 30)),
+        global_window=float(flood_config.get("global_window", 10)),
+        duplicate_window=float(flood_config.get("duplicate_window", 600)),
+        duplicate_threshold=float(flood_config.get("duplicate_threshold", 0.8)),
+    )
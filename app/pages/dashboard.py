@@ -4,6 +4,9 @@ Simple Dashboard Page
 import streamlit as st
 import os
 import base64
+from metrics import track_rerun
+from session_token import forget_login, restore_session
+from dashboard_state import get_dashboard_state
 
 # ページ設定
 st.set_page_config(
@@ -25,8 +28,8 @@ def get_base64_img(path):
 
 def main():
     """メイン関数"""
-    # 認証チェック
-    if 'user_info' not in st.session_state or not st.session_state.user_info:
+    # 認証チェック（ブラウザのセッションが切れていても、署名付きトークンがあればDBに問い合わせずに復元）
+    if not restore_session():
         st.error("ログインが必要です")
         st.info("ログインページにリダイレクトしています...")
         st.switch_page("main.py")
@@ -921,14 +924,35 @@ def main():
     </h1>
     ''', unsafe_allow_html=True)
     
-    # タスクシステムの初期化と同期
-    init_task_system()
-    
+    from circuit_breaker import DB_BUSY_ERRORS, DB_UNAVAILABLE_ERRORS, get_read_only_cache
+    from task_db import get_task_service
+    # 完了登録に使うサービス（読み出しに失敗しても、取得できていれば書き込みはそのまま試す）
+    task_service = None
+    try:
+        # タスクシステムの初期化と同期
+        init_task_system()
+
+        # 再実行ごとに取得するのはユーザー自身の進捗だけ（全ユーザーの集計はランキングページで行う）
+        task_service = get_task_service()
+        snapshot = task_service.get_dashboard_snapshot(user.id)
+        get_read_only_cache().remember_snapshot(user.id, snapshot)
+    except DB_BUSY_ERRORS:
+        # 混雑（接続待ち・タイムアウト）は障害ではないので、最後に取得できた内容を表示して案内だけ出す
+        from user import BUSY_MESSAGE
+        st.warning(BUSY_MESSAGE)
+        snapshot = get_read_only_cache().dashboard_snapshot(user.id)
+    except DB_UNAVAILABLE_ERRORS:
+        # DB障害中は最後に取得できた内容を読み取り専用で表示
+        from metrics import READ_ONLY_RENDERS
+        READ_ONLY_RENDERS.inc(page="dashboard")
+        snapshot = get_read_only_cache().dashboard_snapshot(user.id)
+        display_read_only_banner(snapshot.get("as_of"))
+
     # ナビゲーションボタン（進捗状況の上）
     display_navigation_buttons()
-    
+
     # タスク進捗状況セクション
-    display_progress_overview()
+    display_progress_overview(snapshot)
     
     # フィルター切り替えボタン
     display_task_filter_toggle()
@@ -940,16 +964,45 @@ def main():
     display_mission_clear_notification()
     
     # タスクの表示と管理
-    display_tasks()
+    display_tasks(snapshot, task_service)
     
     # ログアウトボタン
     if st.button("ログアウト", use_container_width=True, type="primary", key="logout_btn"):
-        # セッションクリア
+        # セッションクリア（URL のトークンも消して、再読み込みで復元されないようにする）
+        forget_login()
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
 
 
+def display_read_only_banner(as_of):
+    """DB障害中の読み取り専用モードの表示"""
+    detail = f"{as_of:%H:%M}時点の内容を表示しています。" if as_of else "ミッション一覧のみ表示しています。"
+    st.warning(f"現在サーバーに接続できないため、読み取り専用モードです。{detail}")
+
+
+def complete_mission(task_service, task_id, user_id):
+    """ミッションを完了登録して完了数を返す（登録できなければ警告を出して None）
+
+    表示が読み取り専用モードでも、完了登録は毎回DBに試す（失敗したときだけ警告する）。
+    """
+    from circuit_breaker import DB_BUSY_ERRORS, DB_UNAVAILABLE_ERRORS
+    from task_db import get_task_service
+    from user import BUSY_MESSAGE
+
+    try:
+        if task_service is None:
+            task_service = get_task_service()
+        return task_service.mark_task_complete_and_count(task_id, user_id)
+    except DB_BUSY_ERRORS:
+        st.warning(BUSY_MESSAGE)
+        return None
+    except DB_UNAVAILABLE_ERRORS:
+        st.warning("現在サーバーに接続できないため（読み取り専用モード）、完了を登録できませんでした。"
+                   "しばらくしてから再度お試しください。")
+        return None
+
+
 @st.cache_resource
 def init_task_system():
     """タスクシステムの初期化（1回のみ実行）"""
@@ -965,17 +1018,9 @@ def init_task_system():
         sync_yaml_to_db(yaml_path)
 
 
-def display_progress_overview():
+def display_progress_overview(snapshot):
     """進捗状況の概要を表示"""
-    from task_db import TaskService
-    
-    # ユーザー情報を取得
-    user_info = st.session_state.user_info
-    user = user_info.get('user')
-    user_id = user.id
-    
-    task_service = TaskService()
-    tasks = task_service.get_tasks_with_progress(user_id)
+    tasks = snapshot["tasks"]
     
     if not tasks:
         st.info("現在、利用可能なミッションはありません。")
@@ -1054,18 +1099,18 @@ def display_task_filter_toggle():
     """タスクフィルターの切り替えボタンを表示"""
     
     # 現在のフィルター状態を取得
-    show_only_incomplete = st.session_state.get("show_only_incomplete", False)
+    state = get_dashboard_state()
     
     # フィルターToggle
     _, col2, _ = st.columns([1, 2, 1])
     with col2:
-        if show_only_incomplete:
+        if state.show_only_incomplete:
             if st.button("すべてのミッションを表示", key="show_all_tasks", type="secondary", use_container_width=True):
-                st.session_state["show_only_incomplete"] = False
+                state.show_only_incomplete = False
                 st.rerun()
         else:
             if st.button("未完了のみ表示", key="show_incomplete_only", type="secondary", use_container_width=True):
-                st.session_state["show_only_incomplete"] = True
+                state.show_only_incomplete = True
                 st.rerun()
 
 
@@ -1102,7 +1147,7 @@ MILESTONE_REWARDS = {
 @st.dialog("ミッションクリア！")
 def show_mission_clear_dialog():
     """ミッションクリアダイアログ表示"""
-    task_title = st.session_state.get("cleared_task_title", "ミッション")
+    task_title = get_dashboard_state().cleared_task_title or "ミッション"
     
     # ダイアログ内容
     st.markdown(f"""
@@ -1129,19 +1174,15 @@ def show_mission_clear_dialog():
     with col2:
         if st.button("ミッション一覧に戻る", type="primary", use_container_width=True):
             # ミッションクリアダイアログを閉じる
-            st.session_state["mission_cleared"] = False
-            
             # 報酬ダイアログがある場合はそちらを表示、ない場合はフィルタリングモードに切り替え
-            if not st.session_state.get("reward_earned", False):
-                st.session_state["show_only_incomplete"] = True
-            
+            get_dashboard_state().dismiss_clear_dialog()
             st.rerun()
 
 
 @st.dialog("🎁 報酬獲得！")
 def show_reward_dialog():
     """報酬獲得ダイアログ表示"""
-    completed_count = st.session_state.get("completed_count_for_reward", 0)
+    completed_count = get_dashboard_state().reward_milestone
     reward = MILESTONE_REWARDS.get(completed_count, {})
     
     if not reward:
@@ -1181,8 +1222,7 @@ def show_reward_dialog():
     with col2:
         if st.button("素晴らしい！", type="primary", use_container_width=True):
             # 報酬ダイアログを閉じる
-            st.session_state["reward_earned"] = False
-            st.session_state["show_only_incomplete"] = True
+            get_dashboard_state().dismiss_reward_dialog()
             st.rerun()
 
 
@@ -1203,25 +1243,23 @@ def check_milestone_reward(completed_count):
 def display_mission_clear_notification():
     """ミッションクリア通知の管理"""
     
+    state = get_dashboard_state()
     # ミッションクリア状態を優先して表示
-    if st.session_state.get("mission_cleared", False):
+    if state.cleared_task_title is not None:
         show_mission_clear_dialog()
     # 報酬獲得状態をチェック（ミッションクリア後に表示）
-    elif st.session_state.get("reward_earned", False):
+    elif state.reward_milestone:
         show_reward_dialog()
 
 
-def display_tasks():
+def display_tasks(snapshot, task_service):
     """タスクの表示と管理"""
-    from task_db import TaskService
-    
     # ユーザー情報を取得
     user_info = st.session_state.user_info
     user = user_info.get('user')
     user_id = user.id
     
-    task_service = TaskService()
-    tasks = task_service.get_tasks_with_progress(user_id)
+    tasks = snapshot["tasks"]
     
     if not tasks:
         return
@@ -1275,7 +1313,8 @@ def display_enhanced_swt_tasks(tasks, task_service, user_id):
     """SWTエンジョイミッションの表示"""
     
     # フィルタリング機能: 未完了のみ表示するかチェック
-    show_only_incomplete = st.session_state.get("show_only_incomplete", False)
+    state = get_dashboard_state()
+    show_only_incomplete = state.show_only_incomplete
     
     for task in tasks:
         task_id = task['id']
@@ -1322,11 +1361,11 @@ def display_enhanced_swt_tasks(tasks, task_service, user_id):
             _, col2 = st.columns([3, 1])
             with col2:
                 if st.button("参加", key=f"swt_btn_{task_id}", type="primary"):
-                    st.session_state[f"show_swt_{task_id}"] = True
+                    state.open_task(task_id)
                     st.rerun()
         
         # SWTコンテンツ表示
-        if not is_completed and st.session_state.get(f"show_swt_{task_id}", False):
+        if not is_completed and state.is_open(task_id):
             with st.expander(f"🎉 {task['title']} - SWTエンジョイ", expanded=True):
                 display_swt_content(task, task_service, user_id)
 
@@ -1335,7 +1374,8 @@ def display_enhanced_quiz_tasks(tasks, task_service, user_id):
     """改善されたクイズタスクの表示"""
     
     # フィルタリング機能: 未完了のみ表示するかチェック
-    show_only_incomplete = st.session_state.get("show_only_incomplete", False)
+    state = get_dashboard_state()
+    show_only_incomplete = state.show_only_incomplete
     
     for task in tasks:
         task_id = task['id']
@@ -1382,11 +1422,11 @@ def display_enhanced_quiz_tasks(tasks, task_service, user_id):
             _, col2 = st.columns([3, 1])
             with col2:
                 if st.button("挑戦", key=f"quiz_btn_{task_id}", type="primary"):
-                    st.session_state[f"show_quiz_{task_id}"] = True
+                    state.open_task(task_id)
                     st.rerun()
         
         # クイズコンテンツ表示
-        if not is_completed and st.session_state.get(f"show_quiz_{task_id}", False):
+        if not is_completed and state.is_open(task_id):
             with st.expander(f"📚 {task['title']} - クイズ", expanded=True):
                 display_quiz_content(task, task_service, user_id)
 
@@ -1395,7 +1435,8 @@ def display_enhanced_sns_tasks(tasks, task_service, user_id):
     """改善されたSNSタスクの表示"""
     
     # フィルタリング機能: 未完了のみ表示するかチェック
-    show_only_incomplete = st.session_state.get("show_only_incomplete", False)
+    state = get_dashboard_state()
+    show_only_incomplete = state.show_only_incomplete
     
     for task in tasks:
         task_id = task['id']
@@ -1442,11 +1483,11 @@ def display_enhanced_sns_tasks(tasks, task_service, user_id):
             _, col2 = st.columns([3, 1])
             with col2:
                 if st.button("投稿", key=f"sns_btn_{task_id}", type="primary"):
-                    st.session_state[f"show_sns_{task_id}"] = True
+                    state.open_task(task_id)
                     st.rerun()
         
         # SNSコンテンツ表示
-        if not is_completed and st.session_state.get(f"show_sns_{task_id}", False):
+        if not is_completed and state.is_open(task_id):
             with st.expander(f"📱 {task['title']} - SNS投稿", expanded=True):
                 display_sns_content(task, task_service, user_id)
 
@@ -1494,31 +1535,21 @@ def display_quiz_content(task, task_service, user_id):
             selected_index = options.index(selected_answer)
             if selected_index == correct_answer:
                 # ミッションクリア処理
-                task_service.mark_task_complete(task_id, user_id)
-                
-                # 完了数を再計算してマイルストーン報酬チェック
-                tasks = task_service.get_tasks_with_progress(user_id)
-                completed_count = len([task for task in tasks if task['completed']])
-                
-                # クリア状態とタスク情報をセッションに保存
-                st.session_state["mission_cleared"] = True
-                st.session_state["cleared_task_title"] = task['title']
-                st.session_state["cleared_task_id"] = task_id
+                # 完了登録と完了数の再計算を1回で行い、マイルストーン報酬チェック
+                completed_count = complete_mission(task_service, task_id, user_id)
+                if completed_count is None:
+                    return
                 
-                # マイルストーン報酬チェック
-                if check_milestone_reward(completed_count):
-                    st.session_state["reward_earned"] = True
-                    st.session_state["completed_count_for_reward"] = completed_count
-                
-                # クイズ表示を非表示にして画面更新
-                st.session_state[f"show_quiz_{task_id}"] = False
+                # クリア状態（マイルストーン達成なら報酬も）を保存し、クイズ表示を閉じて画面更新
+                milestone = completed_count if check_milestone_reward(completed_count) else 0
+                get_dashboard_state().mission_cleared(task_id, task['title'], milestone)
                 st.rerun()
             else:
                 st.error("不正解です。")
     
     with col2:
         if st.button("閉じる", key=f"close_quiz_content_{task_id}"):
-            st.session_state[f"show_quiz_{task_id}"] = False
+            get_dashboard_state().close_task(task_id)
             st.rerun()
 
 
@@ -1620,29 +1651,19 @@ def display_swt_content(task, task_service, user_id):
     with col1:
         if st.button("完了", key=f"complete_swt_{task_id}"):
             # ミッションクリア処理
-            task_service.mark_task_complete(task_id, user_id)
-            
-            # 完了数を再計算してマイルストーン報酬チェック
-            tasks = task_service.get_tasks_with_progress(user_id)
-            completed_count = len([task for task in tasks if task['completed']])
-            
-            # クリア状態とタスク情報をセッションに保存
-            st.session_state["mission_cleared"] = True
-            st.session_state["cleared_task_title"] = task['title']
-            st.session_state["cleared_task_id"] = task_id
-            
-            # マイルストーン報酬チェック
-            if check_milestone_reward(completed_count):
-                st.session_state["reward_earned"] = True
-                st.session_state["completed_count_for_reward"] = completed_count
+            # 完了登録と完了数の再計算を1回で行い、マイルストーン報酬チェック
+            completed_count = complete_mission(task_service, task_id, user_id)
+            if completed_count is None:
+                return
             
-            # SWT表示を非表示にして画面更新
-            st.session_state[f"show_swt_{task_id}"] = False
+            # クリア状態（マイルストーン達成なら報酬も）を保存し、SWT表示を閉じて画面更新
+            milestone = completed_count if check_milestone_reward(completed_count) else 0
+            get_dashboard_state().mission_cleared(task_id, task['title'], milestone)
             st.rerun()
     
     with col2:
         if st.button("閉じる", key=f"close_swt_content_{task_id}"):
-            st.session_state[f"show_swt_{task_id}"] = False
+            get_dashboard_state().close_task(task_id)
             st.rerun()
 
 
@@ -1696,33 +1717,24 @@ def display_sns_content(task, task_service, user_id):
     with col1:
         if st.button("完了", key=f"complete_sns_{task_id}"):
             # ミッションクリア処理
-            task_service.mark_task_complete(task_id, user_id)
-            
-            # 完了数を再計算してマイルストーン報酬チェック
-            tasks = task_service.get_tasks_with_progress(user_id)
-            completed_count = len([task for task in tasks if task['completed']])
-            
-            # クリア状態とタスク情報をセッションに保存
-            st.session_state["mission_cleared"] = True
-            st.session_state["cleared_task_title"] = task['title']
-            st.session_state["cleared_task_id"] = task_id
-            
-            # マイルストーン報酬チェック
-            if check_milestone_reward(completed_count):
-                st.session_state["reward_earned"] = True
-                st.session_state["completed_count_for_reward"] = completed_count
+            # 完了登録と完了数の再計算を1回で行い、マイルストーン報酬チェック
+            completed_count = complete_mission(task_service, task_id, user_id)
+            if completed_count is None:
+                return
             
-            # SNS表示を非表示にして画面更新
-            st.session_state[f"show_sns_{task_id}"] = False
+            # クリア状態（マイルストーン達成なら報酬も）を保存し、SNS表示を閉じて画面更新
+            milestone = completed_count if check_milestone_reward(completed_count) else 0
+            get_dashboard_state().mission_cleared(task_id, task['title'], milestone)
             st.rerun()
     
     with col2:
         if st.button("閉じる", key=f"close_sns_content_{task_id}"):
-            st.session_state[f"show_sns_{task_id}"] = False
+            get_dashboard_state().close_task(task_id)
             st.rerun()
 
 
 
 
 if __name__ == "__main__":
-    main()
+    with track_rerun("dashboard"):
+        main()
@@ -4,6 +4,8 @@
 import streamlit as st
 import os
 import base64
+from metrics import track_rerun
+from session_token import restore_session
 
 
 # ページ設定
@@ -26,8 +28,8 @@ def get_base64_img(path):
 
 def main():
     """メイン関数"""
-    # 認証チェック
-    if 'user_info' not in st.session_state or not st.session_state.user_info:
+    # 認証チェック（ブラウザのセッションが切れていても、署名付きトークンがあればDBに問い合わせずに復元）
+    if not restore_session():
         st.error("ログインが必要です")
         st.info("ログインページにリダイレクトしています...")
         st.switch_page("main.py")
@@ -232,9 +234,19 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
+    # モデレーターには保留投稿の確認ページへの入口を出す
+    from moderation import is_moderator
+    if is_moderator(user.username):
+        if st.button("保留中の投稿を確認", key="open_review", use_container_width=True):
+            st.switch_page("pages/review.py")
+    
     # 投稿フォーム表示
     display_post_form(user)
     
+    # 直近の投稿の送信状況
+    if st.session_state.get('last_post_id'):
+        display_post_status()
+    
     # 成功ダイアログの表示
     if st.session_state.get('show_success_dialog', False):
         show_success_dialog()
@@ -252,8 +264,11 @@ def show_success_dialog():
             💬
         </div>
         <h2 style="color: #10b981; font-weight: 700; margin-bottom: 1rem;">
-            質問を送信しました！
+            質問を受け付けました！
         </h2>
+        <p style="font-size: 1rem; color: #10b981; margin-bottom: 1rem;">
+            まもなくSlackに投稿されます。送信状況はこのページで確認できます。
+        </p>
         <p style="font-size: 1.2rem; line-height: 1.6; color: #10b981; font-weight: 600; margin-bottom: 1.5rem;">
             質問の回答が来ているか<br>
             SnowVillageのモヤモヤチャンネルを見に行こう！
@@ -310,10 +325,10 @@ def display_bottom_navigation():
 
 def display_post_form(user):
     """投稿フォームの表示"""
-    from slack_client import SlackClient
+    from slack_client import get_slack_client
     
-    # Slack設定確認
-    slack_client = SlackClient()
+    # Slack設定確認（クライアントはプロセスで共有）
+    slack_client = get_slack_client()
     
     if not slack_client.is_configured():
         st.markdown("""
@@ -369,10 +384,10 @@ def display_post_form(user):
     
     # フォーム送信処理
     if submitted:
-        handle_form_submission(message, slack_client, user)
+        handle_form_submission(message, user)
 
 
-def handle_form_submission(message: str, slack_client, user):
+def handle_form_submission(message: str, user):
     """フォーム送信処理"""
     
     # バリデーション
@@ -394,16 +409,53 @@ def handle_form_submission(message: str, slack_client, user):
         """, unsafe_allow_html=True)
         return
     
-    # 送信処理
-    with st.spinner("Slackに送信中..."):
-        success, result_message = slack_client.send_anonymous_message(
-            message=message,
-            username=user.username  # ログ用（Slackには表示されない）
-        )
+    # NGワードチェック（拒否はここで止め、保留はSlackに流さず確認待ちにする）
+    from moderation import moderate, ACTION_REJECT, ACTION_HOLD
+    from slack_outbox import get_slack_outbox, STATUS_QUEUED, STATUS_HELD
+    
+    moderation_result = moderate(message)
+    if moderation_result.action == ACTION_REJECT:
+        st.markdown("""
+        <div class="warning-box">
+            <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">block</span>送信できません</strong><br>
+            不適切な表現が含まれているため送信できません。内容を見直してください。
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    # 連投・重複投稿チェック
+    from moderation import get_flood_guard, REASON_DUPLICATE
+    
+    # 判定と記録を1つのロックの中で行い、同じユーザーの連続送信が両方通らないようにする
+    flood_guard = get_flood_guard()
+    flood_result = flood_guard.check_and_record(user.id, message)
+    if not flood_result.allowed:
+        if flood_result.reason == REASON_DUPLICATE:
+            detail = "同じ内容の質問が最近送信されています。"
+        else:
+            detail = f"投稿が集中しています。{max(1, int(flood_result.retry_after + 0.999))}秒ほど待ってから再度お試しください。"
+        st.markdown(f"""
+        <div class="warning-box">
+            <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">hourglass_empty</span>送信できません</strong><br>
+            {detail}
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    # アウトボックスに登録（Slackへの配信はバックグラウンドワーカーが行う）
+    status = STATUS_HELD if moderation_result.action == ACTION_HOLD else STATUS_QUEUED
+    try:
+        outbox_id = get_slack_outbox().enqueue(message.strip(), status=status)
+        success, result_message = True, "送信を受け付けました"
+    except Exception as e:
+        # 受け付けられなかった投稿は、再送が連投・重複扱いにならないよう記録から外す
+        flood_guard.cancel(flood_result.record)
+        success, result_message = False, f"送信の受付に失敗しました: {str(e)}"
     
     # 結果表示
     if success:
         # ダイアログ表示フラグを設定
+        st.session_state.last_post_id = outbox_id
         st.session_state.show_success_dialog = True
         st.rerun()
             
@@ -417,5 +469,61 @@ def handle_form_submission(message: str, slack_client, user):
         """, unsafe_allow_html=True)
 
 
+@st.fragment
+def display_post_status():
+    """直近の投稿の送信状況を表示（更新ボタンはこの部分だけ再実行）"""
+    from slack_outbox import get_slack_outbox, STATUS_SENT, STATUS_FAILED, STATUS_HELD
+    
+    try:
+        status = get_slack_outbox().get_status(st.session_state.last_post_id)
+    except Exception as e:
+        st.markdown(f"""
+        <div class="warning-box">
+            <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">warning</span>送信状況を取得できません</strong><br>
+            {str(e)}
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    if not status:
+        return
+    
+    if status['status'] == STATUS_SENT:
+        st.markdown("""
+        <div class="success-box">
+            <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">check_circle</span>送信済み</strong><br>
+            直近の投稿はSlackに届いています。
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    if status['status'] == STATUS_HELD:
+        st.markdown("""
+        <div class="info-box">
+            <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">hourglass_empty</span>確認待ち</strong><br>
+            直近の投稿は運営の確認後にSlackへ送信されます。
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    if status['status'] == STATUS_FAILED:
+        st.markdown("""
+        <div class="error-box">
+            <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">error</span>送信失敗</strong><br>
+            直近の投稿を送信できませんでした。お手数ですが再度投稿してください。
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    st.markdown(f"""
+    <div class="info-box">
+        <strong><span class="material-icons" style="vertical-align: middle; margin-right: 0.25rem;">schedule</span>送信待ち</strong><br>
+        直近の投稿はSlackへの送信を待っています（試行回数: {status['attempts']}）。
+    </div>
+    """, unsafe_allow_html=True)
+    st.button("送信状況を更新", key="refresh_post_status", use_container_width=True)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with track_rerun("post"):
+        main()
@@ -4,6 +4,8 @@
 import streamlit as st
 import os
 import base64
+from metrics import track_rerun
+from session_token import restore_session
 
 
 # ページ設定
@@ -26,8 +28,8 @@ def get_base64_img(path):
 
 def main():
     """メイン関数"""
-    # 認証チェック
-    if 'user_info' not in st.session_state or not st.session_state.user_info:
+    # 認証チェック（ブラウザのセッションが切れていても、署名付きトークンがあればDBに問い合わせずに復元）
+    if not restore_session():
         st.error("ログインが必要です")
         st.info("ログインページにリダイレクトしています...")
         st.switch_page("main.py")
@@ -246,11 +248,28 @@ def display_bottom_navigation():
 
 def display_ranking():
     """ランキング表示"""
-    from task_db import TaskService
-    
-    task_service = TaskService()
-    ranking_data = task_service.get_user_ranking()
-    
+    from task_db import get_task_service
+    from circuit_breaker import DB_BUSY_ERRORS, DB_UNAVAILABLE_ERRORS, get_read_only_cache
+
+    try:
+        task_service = get_task_service()
+        ranking_data = task_service.get_user_ranking()
+        get_read_only_cache().remember_ranking(ranking_data)
+    except DB_BUSY_ERRORS:
+        # 混雑は障害ではないので読み取り専用には切り替えない
+        from user import BUSY_MESSAGE
+        st.warning(BUSY_MESSAGE)
+        return
+    except DB_UNAVAILABLE_ERRORS:
+        # DB障害中は最後に取得できたランキングを表示
+        from metrics import READ_ONLY_RENDERS
+        READ_ONLY_RENDERS.inc(page="ranking")
+        ranking_data, as_of = get_read_only_cache().ranking()
+        if ranking_data is None:
+            st.warning("現在サーバーに接続できないため、ランキングを表示できません。しばらくしてから再度お試しください。")
+            return
+        st.warning(f"現在サーバーに接続できないため、{as_of:%H:%M}時点のランキングを表示しています（最終更新）。")
+
     if not ranking_data:
         st.info("まだランキングデータがありません。")
         return
@@ -303,4 +322,5 @@ def display_ranking():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with track_rerun("ranking"):
+        main()
@@ -0,0 +1,113 @@
+"""
+保留投稿の確認ページ（モデレーター用）
+NGワードの hold に当たって保留された匿名投稿を確認し、承認（Slackへ配信）または却下する
+
+ログインは名前の入力だけなので、モデレーターの名前に加えて合言葉（[moderation] passphrase
+または環境変数 MODERATOR_PASSPHRASE）を確認してから表示する。合言葉が未設定なら誰も使えない。
+"""
+import streamlit as st
+from metrics import track_rerun
+from moderation import check_moderator_passphrase, is_moderator
+from session_token import restore_session
+
+
+# ページ設定
+st.set_page_config(
+    page_title="Snow Village - 保留投稿の確認",
+    page_icon="fact_check",
+    layout="centered",
+    initial_sidebar_state="collapsed"
+)
+
+
+def main():
+    """メイン関数"""
+    # 認証チェック（ブラウザのセッションが切れていても、署名付きトークンがあればDBに問い合わせずに復元）
+    if not restore_session():
+        st.error("ログインが必要です")
+        st.info("ログインページにリダイレクトしています...")
+        st.switch_page("main.py")
+
+    user = st.session_state.user_info.get('user')
+    if not is_moderator(user.username):
+        st.error("このページはモデレーターのみ利用できます")
+        if st.button("匿名投稿に戻る", key="review_back_denied", use_container_width=True):
+            st.switch_page("pages/post.py")
+        return
+
+    st.markdown("""
+    <style>
+        header[data-testid="stHeader"] { display: none; }
+        .stSidebar { display: none !important; }
+    </style>
+    """, unsafe_allow_html=True)
+
+    # 合言葉を確認済みのユーザー名（別の名前で入り直したら確認し直す）
+    if st.session_state.get('moderator_verified') != user.username:
+        verify_passphrase(user.username)
+        return
+
+    st.title("保留投稿の確認")
+    st.caption("NGワードの確認対象に当たった匿名投稿です。承認するとSlackに送信され、却下すると送信されません。")
+
+    display_held_posts()
+
+    if st.button("匿名投稿に戻る", key="review_back", use_container_width=True):
+        st.switch_page("pages/post.py")
+
+
+def verify_passphrase(username: str):
+    """合言葉の入力欄（正しければ確認済みにして再表示）"""
+    st.title("保留投稿の確認")
+    st.caption("モデレーターの合言葉を入力してください。")
+    passphrase = st.text_input("合言葉", type="password", key="moderator_passphrase")
+    if st.button("確認", key="verify_moderator", type="primary", use_container_width=True):
+        if check_moderator_passphrase(passphrase):
+            st.session_state.moderator_verified = username
+            st.rerun()
+        st.error("合言葉が違います")
+    if st.button("匿名投稿に戻る", key="review_back_verify", use_container_width=True):
+        st.switch_page("pages/post.py")
+
+
+def display_held_posts():
+    """確認待ちの投稿を一覧表示"""
+    from slack_outbox import get_slack_outbox
+
+    outbox = get_slack_outbox()
+
+    # 直前の操作結果
+    notice = st.session_state.pop('review_notice', None)
+    if notice:
+        st.success(notice)
+
+    try:
+        held_posts = outbox.list_held()
+    except Exception as e:
+        st.error(f"保留中の投稿を取得できません: {str(e)}")
+        return
+
+    if not held_posts:
+        st.info("確認待ちの投稿はありません")
+        return
+
+    for post in held_posts:
+        with st.container(border=True):
+            st.caption(f"#{post['id']}  {post['created_at']:%Y-%m-%d %H:%M}")
+            st.text(post['message'])
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("承認して送信", key=f"release_post_{post['id']}", type="primary", use_container_width=True):
+                    if outbox.release_held(post['id']):
+                        st.session_state.review_notice = f"#{post['id']} を送信キューに戻しました"
+                    st.rerun()
+            with col2:
+                if st.button("却下", key=f"reject_post_{post['id']}", use_container_width=True):
+                    if outbox.reject_held(post['id']):
+                        st.session_state.review_notice = f"#{post['id']} を却下しました"
+                    st.rerun()
+
+
+if __name__ == "__main__":
+    with track_rerun("review"):
+        main()
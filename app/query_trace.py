@@ -0,0 +1,305 @@
+"""
+DBクエリのトレース（キャパシティ計画用）
+task_db.py / user.py が発行したクエリを、正規化したSQL・匿名化した引数・開始時刻・所要時間として
+コンパクトなバイナリファイルに記録する。tests/query_replay.py で、別のスキーマ・インデックス構成の
+Postgres に本番と同じアクセスパターンを何倍速かで再生できる。
+
+ファイル形式（リトルエンディアン、追記のみ）:
+- ヘッダー: "SVQT", バージョン, 記録開始時刻（UNIXマイクロ秒）
+- 文の定義: 種別 1, 文ID, クエリ種別, ラベル, 名前付き引数の名前, 正規化したSQL（初出時に1回だけ）
+- 実行:     種別 2, 文ID, 開始オフセット（マイクロ秒）, 所要時間（マイクロ秒）, エラー有無, 引数
+
+引数の匿名化: 整数・小数・真偽値はそのまま（ID は代理キー）、文字列は鍵付きハッシュの64ビット値、
+日時などそれ以外は型だけを残す。ハッシュの鍵は環境変数 QUERY_TRACE_SALT（未設定ならプロセスごとの乱数）。
+
+有効化: secrets.toml の [database] query_trace_dir または環境変数 QUERY_TRACE_DIR
+（プロセスごとに trace-<開始時刻>-<pid>.svqt を作る）
+"""
+import atexit
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import NamedTuple, Optional
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SVQT"
+VERSION = 1
+# magic, version, 記録開始時刻（UNIXマイクロ秒）
+HEADER = struct.Struct("<4sHq")
+# 種別, 文ID, クエリ種別, ラベル長, 引数名の長さ, SQL長
+STATEMENT = struct.Struct("<BHBHHI")
+# 種別, 文ID, 開始オフセット（マイクロ秒）, 所要時間（マイクロ秒）, エラー有無, 引数の数
+CALL = struct.Struct("<BHqIBH")
+KIND_STATEMENT = 1
+KIND_CALL = 2
+# 既存のトレースのインデックスを変えないよう、新しい種別は末尾に足す
+QUERY_CLASSES = ("read", "write", "admin", "aggregate")
+
+# 引数の型タグ
+TAG_NONE, TAG_INT, TAG_FLOAT, TAG_BOOL, TAG_TEXT, TAG_DATETIME, TAG_OTHER = range(7)
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_TOKEN = struct.Struct("<Q")
+
+
+class Redacted(NamedTuple):
+    """匿名化された引数（kind: "text" / "datetime" / "other"、text はハッシュ値を持つ）"""
+    kind: str
+    token: int = 0
+
+
+class TraceStatement(NamedTuple):
+    """トレース内の文"""
+    label: str
+    sql: str
+    query_class: str
+    names: tuple
+
+
+class TraceCall(NamedTuple):
+    """1回の実行"""
+    statement_id: int
+    offset_us: int
+    duration_us: int
+    error: bool
+    params: tuple
+
+
+class QueryTrace(NamedTuple):
+    """読み込んだトレースファイル"""
+    started_at_us: int
+    statements: dict
+    calls: list
+
+
+def normalize_sql(sql: str) -> str:
+    """空白・改行をまとめて1行にする"""
+    return " ".join(sql.split())
+
+
+class QueryTracer:
+    """クエリの実行をバイナリファイルに追記するトレーサー（スレッドセーフ）"""
+
+    def __init__(self, path: str, salt: Optional[bytes] = None):
+        """
+        Args:
+            path: 書き込むファイル（上書き）
+            salt: 文字列をハッシュする鍵（None ならプロセスごとの乱数）
+        """
+        self.path = path
+        self._salt = (salt or os.urandom(16))[:64]
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._started_ns = time.perf_counter_ns()
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time_ns() // 1000))
+
+    def _encode_value(self, value) -> bytes:
+        if value is None:
+            return bytes((TAG_NONE,))
+        if isinstance(value, bool):
+            return bytes((TAG_BOOL, value))
+        if isinstance(value, int):
+            return bytes((TAG_INT,)) + _INT.pack(value)
+        if isinstance(value, float):
+            return bytes((TAG_FLOAT,)) + _FLOAT.pack(value)
+        if isinstance(value, str):
+            digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8, key=self._salt).digest()
+            return bytes((TAG_TEXT,)) + digest
+        if isinstance(value, date):
+            return bytes((TAG_DATETIME,))
+        return bytes((TAG_OTHER,))
+
+    def _statement_id(self, label: str, sql: str, query_class: str, names: tuple) -> int:
+        """文のIDを返す（初出なら定義レコードを書く。ロック内で呼ぶ）"""
+        key = (label, sql, query_class, names)
+        statement_id = self._statements.get(key)
+        if statement_id is not None:
+            return statement_id
+        statement_id = len(self._statements)
+        label_bytes = label.encode("utf-8")
+        names_bytes = ",".join(names).encode("utf-8")
+        sql_bytes = normalize_sql(sql).encode("utf-8")
+        self._file.write(STATEMENT.pack(
+            KIND_STATEMENT, statement_id, QUERY_CLASSES.index(query_class),
+            len(label_bytes), len(names_bytes), len(sql_bytes),
+        ) + label_bytes + names_bytes + sql_bytes)
+        self._statements[key] = statement_id
+        return statement_id
+
+    def record(self, label: str, sql: str, params, query_class: str,
+               start_ns: int, duration_ns: int, error: bool = False):
+        """1回の実行を記録（start_ns は time.perf_counter_ns() の値）"""
+        if isinstance(params, dict):
+            names = tuple(params)
+            values = tuple(params.values())
+        else:
+            names = ()
+            values = tuple(params or ())
+        encoded = b"".join(self._encode_value(value) for value in values)
+        offset_us = (start_ns - self._started_ns) // 1000
+        duration_us = min(duration_ns // 1000, 0xFFFFFFFF)
+        with self._lock:
+            if self._file is None:
+                return
+            statement_id = self._statement_id(label, sql, query_class, names)
+            self._file.write(CALL.pack(KIND_CALL, statement_id, offset_us, duration_us, error, len(values)) + encoded)
+
+    def flush(self):
+        """バッファをファイルに書き出す"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """ファイルを閉じる"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _decode_params(data: bytes, offset: int, count: int) -> tuple[tuple, int]:
+    values = []
+    for _ in range(count):
+        tag = data[offset]
+        offset += 1
+        if tag == TAG_NONE:
+            values.append(None)
+        elif tag == TAG_BOOL:
+            values.append(bool(data[offset]))
+            offset += 1
+        elif tag == TAG_INT:
+            values.append(_INT.unpack_from(data, offset)[0])
+            offset += _INT.size
+        elif tag == TAG_FLOAT:
+            values.append(_FLOAT.unpack_from(data, offset)[0])
+            offset += _FLOAT.size
+        elif tag == TAG_TEXT:
+            values.append(Redacted("text", _TOKEN.unpack_from(data, offset)[0]))
+            offset += _TOKEN.size
+        elif tag == TAG_DATETIME:
+            values.append(Redacted("datetime"))
+        else:
+            values.append(Redacted("other"))
+    if offset > len(data):
+        raise struct.error("truncated parameters")
+    return tuple(values), offset
+
+
+def read_trace(path: str) -> QueryTrace:
+    """トレースファイルを読む（末尾の書きかけのレコードは無視）"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, started_at_us = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a query trace (version {VERSION})")
+    statements, calls = {}, []
+    offset = HEADER.size
+    try:
+        while offset < len(data):
+            kind = data[offset]
+            if kind == KIND_STATEMENT:
+                _, statement_id, class_index, label_len, names_len, sql_len = STATEMENT.unpack_from(data, offset)
+                offset += STATEMENT.size
+                if offset + label_len + names_len + sql_len > len(data):
+                    break
+                label = data[offset:offset + label_len].decode("utf-8")
+                offset += label_len
+                names = data[offset:offset + names_len].decode("utf-8")
+                offset += names_len
+                sql = data[offset:offset + sql_len].decode("utf-8")
+                offset += sql_len
+                statements[statement_id] = TraceStatement(
+                    label, sql, QUERY_CLASSES[class_index], tuple(names.split(",")) if names else (),
+                )
+            elif kind == KIND_CALL:
+                _, statement_id, offset_us, duration_us, error, count = CALL.unpack_from(data, offset)
+                params, offset = _decode_params(data, offset + CALL.size, count)
+                calls.append(TraceCall(statement_id, offset_us, duration_us, bool(error), params))
+            else:
+                raise ValueError(f"{path}: unknown record kind {kind} at {offset}")
+    except (struct.error, IndexError):
+        logger.warning(f"{path}: ignoring truncated record at {offset}")
+    calls.sort(key=lambda call: call.offset_us)
+    return QueryTrace(started_at_us, statements, calls)
+
+
+# プロセス共有のトレーサー（未設定なら None）
+_TRACER = None
+_TRACER_RESOLVED = False
+_TRACER_LOCK = threading.Lock()
+
+
+def get_query_trace_dir():
+    """トレースを書くディレクトリを取得（未設定なら None）"""
+    try:
+        directory = st.secrets.get("database", {}).get("query_trace_dir")
+    except Exception:
+        directory = None
+    return directory or os.getenv("QUERY_TRACE_DIR") or None
+
+
+def get_tracer() -> Optional[QueryTracer]:
+    """設定されていればプロセス共有のトレーサーを返す（初回に作成し、終了時に閉じる）"""
+    global _TRACER, _TRACER_RESOLVED
+
+    if _TRACER_RESOLVED:
+        return _TRACER
+    with _TRACER_LOCK:
+        if not _TRACER_RESOLVED:
+            directory = get_query_trace_dir()
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"trace-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}.svqt")
+                salt = os.getenv("QUERY_TRACE_SALT")
+                _TRACER = QueryTracer(path, salt.encode("utf-8") if salt else None)
+                atexit.register(_TRACER.close)
+                logger.info(f"Tracing queries to {path}")
+            _TRACER_RESOLVED = True
+    return _TRACER
+
+
+@contextmanager
+def trace_query(label: str, sql: str, params=(), query_class: str = "read"):
+    """トレースが有効なら、ブロック内で実行したクエリを記録する（sql はタイムアウト設定を付ける前の文）"""
+    tracer = get_tracer()
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        # 記録の失敗（ディスクフル・エンコードできない引数など）で本体のクエリを失敗させない
+        try:
+            tracer.record(label, sql, params, query_class, start, time.perf_counter_ns() - start, error)
+        except Exception as e:
+            _disable_tracer(tracer, e)
+
+
+def _disable_tracer(tracer: QueryTracer, error: Exception):
+    """記録に失敗したトレーサーを止める（以降のクエリはトレースしない）"""
+    global _TRACER
+
+    with _TRACER_LOCK:
+        if _TRACER is not tracer:
+            return
+        _TRACER = None
+    logger.error(f"Query tracing disabled after a write error: {error}")
+    try:
+        tracer.close()
+    except Exception:
+        pass
@@ -0,0 +1,139 @@
+"""
+署名付きセッショントークン
+ログインしたユーザーの ID・名前・有効期限を HMAC-SHA256 で署名したトークンを URL のクエリパラメータに置き、
+ブラウザのセッションが切れても（再読み込み・スマホのロック解除・Wi-Fi の再接続など）
+DBに問い合わせずにログイン状態を復元する。再接続が集中しても Postgres には負荷がかからない。
+
+トークン: v1.<ペイロード>.<署名>（どちらも base64url、ペイロードは "ユーザーID:有効期限(UNIX秒):ユーザー名"）
+署名の鍵が変わると、それまでのトークンはすべて無効になる。
+
+有効化: secrets.toml の [session] token_secret または環境変数 SESSION_TOKEN_SECRET
+有効期間: [session] token_ttl_hours または環境変数 SESSION_TOKEN_TTL_HOURS（既定48時間）
+"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import Optional
+
+import streamlit as st
+
+from metrics import USER_AUTH_TOTAL
+from user import User
+
+# トークンを置くクエリパラメータ
+TOKEN_PARAM = "session"
+TOKEN_VERSION = "v1"
+# URL を短く保つため HMAC-SHA256 の先頭128ビットを使う
+SIGNATURE_BYTES = 16
+DEFAULT_TTL_HOURS = 48
+
+
+class InvalidSessionToken(ValueError):
+    """トークンが使えない（reason: "malformed" / "signature" / "expired"）"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"invalid session token: {reason}")
+        self.reason = reason
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(secret: bytes, payload: str) -> str:
+    digest = hmac.new(secret, f"{TOKEN_VERSION}.{payload}".encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest[:SIGNATURE_BYTES])
+
+
+def issue_token(user: User, secret: bytes, ttl_seconds: float, now: Optional[float] = None) -> str:
+    """ユーザーのトークンを発行"""
+    expires = int((time.time() if now is None else now) + ttl_seconds)
+    payload = _b64encode(f"{user.id}:{expires}:{user.username}".encode("utf-8"))
+    return f"{TOKEN_VERSION}.{payload}.{_sign(secret, payload)}"
+
+
+def verify_token(token: str, secret: bytes, now: Optional[float] = None) -> User:
+    """トークンを検証してユーザーを返す（使えなければ InvalidSessionToken）"""
+    try:
+        version, payload, signature = token.split(".")
+    except (AttributeError, ValueError):
+        raise InvalidSessionToken("malformed")
+    # トークンは base64url だけでできている（ASCII 以外は署名の計算・比較の前に弾く）
+    if version != TOKEN_VERSION or not token.isascii():
+        raise InvalidSessionToken("malformed")
+    if not hmac.compare_digest(signature, _sign(secret, payload)):
+        raise InvalidSessionToken("signature")
+    try:
+        user_id, expires, username = _b64decode(payload).decode("utf-8").split(":", 2)
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        raise InvalidSessionToken("malformed")
+    if expires <= (time.time() if now is None else now):
+        raise InvalidSessionToken("expired")
+    return User(id=user_id, username=username)
+
+
+def get_token_secret() -> Optional[bytes]:
+    """署名の鍵を取得（未設定なら None でトークンを使わない）"""
+    try:
+        secret = st.secrets.get("session", {}).get("token_secret")
+    except Exception:
+        secret = None
+    secret = secret or os.getenv("SESSION_TOKEN_SECRET")
+    return secret.encode("utf-8") if secret else None
+
+
+def get_token_ttl() -> float:
+    """トークンの有効期間（秒）"""
+    try:
+        hours = st.secrets.get("session", {}).get("token_ttl_hours")
+    except Exception:
+        hours = None
+    return float(hours or os.getenv("SESSION_TOKEN_TTL_HOURS", DEFAULT_TTL_HOURS)) * 3600
+
+
+def remember_login(user: User):
+    """ログインしたユーザーのトークンを URL に置く（鍵が未設定なら何もしない）"""
+    secret = get_token_secret()
+    if secret:
+        st.query_params[TOKEN_PARAM] = issue_token(user, secret, get_token_ttl())
+
+
+def forget_login():
+    """ログアウト時に URL のトークンを消す"""
+    st.query_params.pop(TOKEN_PARAM, None)
+
+
+def restore_session() -> Optional[dict]:
+    """ログイン中のユーザー情報を返す（セッションが切れていればトークンから復元、どちらもなければ None）
+
+    ログイン中で URL にトークンが無ければ（ページ移動で消えた場合など）置き直す。
+    """
+    user_info = st.session_state.get("user_info")
+    if user_info:
+        if TOKEN_PARAM not in st.query_params:
+            remember_login(user_info["user"])
+        return user_info
+
+    secret = get_token_secret()
+    token = st.query_params.get(TOKEN_PARAM)
+    if not secret or not token:
+        return None
+    try:
+        user = verify_token(token, secret)
+    except InvalidSessionToken as e:
+        USER_AUTH_TOTAL.inc(action="token", result=e.reason)
+        forget_login()
+        return None
+    USER_AUTH_TOTAL.inc(action="token", result="restored")
+    user_info = {"name": user.username, "intent": "restored", "user": user}
+    st.session_state.user_info = user_info
+    # 使われ続けている間は有効期限を延ばす
+    remember_login(user)
+    return user_info
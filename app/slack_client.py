@@ -4,23 +4,136 @@ Slack Webhook クライアント
 """
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from datetime import datetime
 import logging
 import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from metrics import SLACK_SEND_SECONDS, SLACK_RATE_LIMITED
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# プロセス全体で共有するWebhook送信レート制限（全セッション共通）
+_RATE_LIMITER = None
+_RATE_LIMITER_LOCK = threading.Lock()
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限（スレッドセーフ）"""
+    
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            rate: 1秒あたりに補充するトークン数
+            capacity: バケット容量（バースト許容量）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def try_acquire(self, tokens: float = 1) -> float:
+        """トークンを取得。取得できた場合は0、できない場合は待つべき秒数を返す"""
+        with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+    
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """トークンが取得できるまで待機（timeout秒を超える場合はFalse）"""
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None and self._clock() + wait > deadline:
+                return False
+            self._sleep(wait)
+    
+    def pause(self, seconds: float):
+        """Retry-After などで指定された期間、トークンの払い出しを止める"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._tokens = 0.0
+            self._updated_at = max(self._updated_at, self._paused_until)
+    
+    def seconds_until_available(self) -> float:
+        """次にトークンを取得できるまでの秒数"""
+        with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+
+def get_rate_limiter(rate: float = 1.0, burst: float = 1.0) -> TokenBucket:
+    """プロセス共有のWebhookレート制限を取得（初回呼び出し時の設定で生成）"""
+    global _RATE_LIMITER
+    
+    with _RATE_LIMITER_LOCK:
+        if _RATE_LIMITER is None:
+            _RATE_LIMITER = TokenBucket(rate, burst)
+        return _RATE_LIMITER
+
+
+def parse_retry_after(value: Optional[str], default: float = 1.0) -> float:
+    """Retry-After ヘッダー（秒数またはHTTP日付）を秒数に変換"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+def create_http_session(pool_maxsize: int = 4) -> requests.Session:
+    """Keep-Alive 接続をプールして再利用するHTTPセッションを生成"""
+    session = requests.Session()
+    # 接続先は hooks.slack.com の1ホストのみ。リトライはアウトボックス側で行う
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+
 class SlackClient:
     """Slack Webhook クライアント"""
     
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
         """初期化"""
         self.webhook_url = None
         self.bot_name = None
+        self.rate_limiter = None
+        # TLSハンドシェイクを毎回払わないよう、接続を保持するセッションを使う
+        self.session = session or create_http_session()
         self._init_client()
     
     def _init_client(self):
@@ -28,14 +141,20 @@ class SlackClient:
         try:
             # Streamlit secrets から設定を取得（ローカル・本番共通）
             slack_config = st.secrets.get("slack", {})
-            self.webhook_url = slack_config.get("webhook_url")
+            # 環境変数はローカルのWebhookスタブを向ける場合などに使う
+            self.webhook_url = slack_config.get("webhook_url") or os.getenv("SLACK_WEBHOOK_URL")
             self.bot_name = slack_config.get("bot_name", "Snow Village Bot")
+            # Incoming Webhook はチャンネルあたり約1件/秒に制限される
+            self.rate_limiter = get_rate_limiter(
+                rate=float(slack_config.get("rate_per_second", 1.0)),
+                burst=float(slack_config.get("rate_burst", 1.0)),
+            )
             
             # Webhook URLが設定されていない場合の警告
             if not self.webhook_url:
                 logger.warning("Slack webhook URL not found in secrets. Please configure [slack] webhook_url in secrets.toml")
             else:
-                logger.info(f"Slack webhook URL loaded: {self.webhook_url[:50]}...")
+                logger.info(f"Slack webhook URL loaded for host: {urlparse(self.webhook_url).netloc}")
             
             if self.webhook_url:
                 logger.info("Slack webhook client initialized successfully")
@@ -44,71 +163,119 @@ class SlackClient:
                 
         except Exception as e:
             logger.error(f"Failed to initialize Slack client: {e}")
-            self.webhook_url = None
+            self.webhook_url = os.getenv("SLACK_WEBHOOK_URL")
+            self.bot_name = "Snow Village Bot"
+        
+        if self.rate_limiter is None:
+            self.rate_limiter = get_rate_limiter()
     
     def is_configured(self) -> bool:
         """Slack設定が正しく行われているかチェック"""
         return self.webhook_url is not None
     
-    def send_anonymous_message(self, message: str, username: str = None) -> tuple[bool, str]:
-        """
-        匿名メッセージをSlackに送信
+    def build_anonymous_payload(self, message: str) -> dict:
+        """匿名投稿用のWebhookペイロードを生成"""
+        # 匿名投稿フォーマット
+        formatted_message = f"""*Snow Village 匿名投稿* :snowflake:
+
+*メッセージ:*
+{message.strip()}
+"""
         
-        Args:
-            message: 送信するメッセージ
-            username: 投稿者のユーザー名（Slackには表示されない）
+        # Webhook用のペイロード
+        return {
+            "text": formatted_message,
+            "username": self.bot_name,
+            "icon_emoji": ":snowflake:"
+        }
+    
+    def build_digest_payload(self, messages: list[str]) -> dict:
+        """複数の匿名投稿を1件にまとめたダイジェストペイロードを生成"""
+        sections = "\n\n---\n\n".join(f"*メッセージ {i}:*\n{message.strip()}" for i, message in enumerate(messages, 1))
+        formatted_message = f"""*Snow Village 匿名投稿（{len(messages)}件まとめ）* :snowflake:
+
+{sections}
+"""
+        return {
+            "text": formatted_message,
+            "username": self.bot_name,
+            "icon_emoji": ":snowflake:"
+        }
+    
+    def post_payload(self, payload: dict) -> tuple[bool, str, Optional[int]]:
+        """
+        ペイロードをWebhookに送信
         
         Returns:
-            tuple[bool, str]: (成功フラグ, メッセージ)
+            tuple[bool, str, Optional[int]]: (成功フラグ, メッセージ, HTTPステータス。通信エラー時はNone)
         """
-        if not self.is_configured():
-            return False, "Slack設定が正しく行われていません"
-        
-        if not message or not message.strip():
-            return False, "メッセージが空です"
+        # 全セッション共通のレート制限（429受信後はRetry-Afterの間停止している）
+        if not self.rate_limiter.acquire(timeout=30):
+            SLACK_RATE_LIMITED.inc(source="local")
+            return False, "送信が混み合っています。しばらくしてから再度お試しください", 429
         
+        start = time.perf_counter()
         try:
-            # 送信時刻を取得
-            timestamp = datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-            
-            # 匿名投稿フォーマット
-            formatted_message = f"""*Snow Village 匿名投稿* :snowflake:
-
-*メッセージ:*
-{message.strip()}
-"""
-            
-            # Webhook用のペイロード
-            payload = {
-                "text": formatted_message,
-                "username": self.bot_name,
-                "icon_emoji": ":snowflake:"
-            }
-            
             # Slackに送信
-            response = requests.post(
+            response = self.session.post(
                 self.webhook_url,
                 json=payload,
-                headers={'Content-Type': 'application/json'},
                 timeout=30
             )
+            SLACK_SEND_SECONDS.observe(
+                time.perf_counter() - start,
+                outcome="success" if response.status_code == 200 else f"http_{response.status_code}"
+            )
             
             if response.status_code == 200:
                 logger.info("Message sent successfully via webhook")
-                return True, "メッセージが正常に送信されました"
+                return True, "メッセージが正常に送信されました", response.status_code
+            elif response.status_code == 429:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                self.rate_limiter.pause(retry_after)
+                SLACK_RATE_LIMITED.inc(source="slack")
+                logger.warning(f"Slack webhook rate limited. Retry after {retry_after:.1f}s")
+                return False, "送信が混み合っています。しばらくしてから再度お試しください", response.status_code
             else:
                 logger.error(f"Failed to send message. Status code: {response.status_code}, Response: {response.text}")
-                return False, f"メッセージの送信に失敗しました (Status: {response.status_code})"
+                return False, f"メッセージの送信に失敗しました (Status: {response.status_code})", response.status_code
                 
         except requests.exceptions.Timeout:
+            SLACK_SEND_SECONDS.observe(time.perf_counter() - start, outcome="error")
             logger.error("Request timeout")
-            return False, "送信がタイムアウトしました"
+            return False, "送信がタイムアウトしました", None
             
         except requests.exceptions.RequestException as e:
+            SLACK_SEND_SECONDS.observe(time.perf_counter() - start, outcome="error")
             logger.error(f"Request error: {e}")
-            return False, f"ネットワークエラーが発生しました: {str(e)}"
+            return False, f"ネットワークエラーが発生しました: {str(e)}", None
                 
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
-            return False, f"予期しないエラーが発生しました: {str(e)}"
+            return False, f"予期しないエラーが発生しました: {str(e)}", None
     
+    def send_anonymous_message(self, message: str, username: str = None) -> tuple[bool, str]:
+        """
+        匿名メッセージをSlackに送信
+        
+        Args:
+            message: 送信するメッセージ
+            username: 投稿者のユーザー名（Slackには表示されない）
+        
+        Returns:
+            tuple[bool, str]: (成功フラグ, メッセージ)
+        """
+        if not self.is_configured():
+            return False, "Slack設定が正しく行われていません"
+        
+        if not message or not message.strip():
+            return False, "メッセージが空です"
+        
+        success, result_message, _ = self.post_payload(self.build_anonymous_payload(message))
+        return success, result_message
+
+
+@st.cache_resource
+def get_slack_client() -> SlackClient:
+    """プロセス共有のSlackクライアントを取得（secretsの読み込みと接続プールは1回だけ）"""
+    return SlackClient()
@@ -0,0 +1,404 @@
+"""
+Slack 送信アウトボックス
+匿名投稿をPostgresのアウトボックステーブルに積み、バックグラウンドワーカーが再試行付きで配信する
+"""
+import logging
+import threading
+from typing import Optional
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import streamlit as st
+
+import circuit_breaker
+from task_db import load_connection_params
+from metrics import (
+    track_query, SLACK_OUTBOX_DELIVERIES, SLACK_OUTBOX_ENQUEUED, SLACK_DIGESTS
+)
+
+logger = logging.getLogger(__name__)
+
+# 投稿ステータス
+STATUS_QUEUED = "queued"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+# モデレーションで保留され、管理者の確認待ち（ワーカーは配信しない。pages/review.py で承認・却下する）
+STATUS_HELD = "held"
+# 保留後に管理者が却下した（配信しない）
+STATUS_REJECTED = "rejected"
+# 429で保留した（試行回数に数えない）配信結果
+RESULT_RATE_LIMITED = "rate_limited"
+
+
+def is_retryable(status_code: Optional[int]) -> bool:
+    """再試行すべき送信結果か判定（通信エラー・429・5xx）"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+# ワーカーが行を所有している条件（リース中で、取得したときの試行回数のまま）
+# リースが切れて他のワーカーが取り直すと attempts が増えるので、古いワーカーの更新は当たらない
+OWNED_ROWS_SQL = """
+    status = 'sending'
+    AND (id, attempts) IN (SELECT * FROM unnest(%s::bigint[], %s::int[]))
+"""
+
+
+def _owned(rows: list[dict]) -> tuple[list[int], list[int]]:
+    """OWNED_ROWS_SQL の引数（id と取得時の試行回数）"""
+    return [row['id'] for row in rows], [row['attempts'] for row in rows]
+
+
+def backoff_seconds(attempts: int, base: float = 2.0, cap: float = 300.0) -> float:
+    """試行回数に応じた指数バックオフ秒数"""
+    return min(cap, base * (2 ** max(0, attempts - 1)))
+
+
+class SlackOutbox:
+    """Slack送信アウトボックス"""
+
+    def __init__(self, slack_client, max_attempts: int = 6, batch_size: int = 10,
+                 poll_interval: float = 1.0, lease_seconds: int = 120,
+                 digest_threshold: Optional[int] = None, digest_interval: float = 10.0,
+                 digest_max_items: int = 10):
+        """
+        Args:
+            lease_seconds: 取得・送信直前の延長から、他のワーカーに取り直されるまでの秒数
+                （1件の送信のレート制限待ち30秒＋HTTPタイムアウト30秒より長くする）
+            digest_threshold: 取得した未送信件数がこの値以上ならダイジェスト1件にまとめて送る（Noneで無効）
+            digest_interval: ダイジェスト送信後、次の取得までに待つ秒数（その間に投稿を溜める）
+            digest_max_items: ダイジェスト1件にまとめる最大件数
+        """
+        self.connection_params = load_connection_params()
+        self.slack_client = slack_client
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.digest_threshold = digest_threshold
+        self.digest_interval = digest_interval
+        self.digest_max_items = digest_max_items
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._init_db()
+
+    def _init_db(self):
+        """アウトボックステーブル初期化"""
+        # ブレーカーが開いていれば接続を待たずに失敗させる
+        circuit_breaker.get_db_breaker().before_call()
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                with circuit_breaker.connect(self.connection_params) as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS slack_outbox (
+                            id BIGSERIAL PRIMARY KEY,
+                            message TEXT NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'queued',
+                            attempts INT NOT NULL DEFAULT 0,
+                            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                            last_error TEXT,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            sent_at TIMESTAMP
+                        )
+                        """)
+                        cursor.execute("""
+                        CREATE INDEX IF NOT EXISTS slack_outbox_pending_idx
+                            ON slack_outbox (next_attempt_at)
+                            WHERE status IN ('queued', 'sending')
+                        """)
+                    conn.commit()
+                    print(f"Slack outbox initialized successfully (attempt {attempt + 1})")
+                    return
+            except circuit_breaker.CircuitOpenError:
+                raise
+            except psycopg2.OperationalError as e:
+                print(f"Slack outbox connection attempt {attempt + 1} failed: {e}")
+                if attempt == max_retries - 1:
+                    raise circuit_breaker.DatabaseUnavailableError(f"Failed to connect to outbox database after {max_retries} attempts: {e}")
+            except Exception as e:
+                print(f"Slack outbox initialization error: {e}")
+                if attempt == max_retries - 1:
+                    raise
+
+    def get_connection(self):
+        """データベース接続を取得"""
+        return circuit_breaker.connect(self.connection_params)
+
+    @track_query("outbox_enqueue")
+    def enqueue(self, message: str, status: str = STATUS_QUEUED) -> int:
+        """メッセージをアウトボックスに追加してIDを返す（保留する場合は status=STATUS_HELD）"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO slack_outbox (message, status) VALUES (%s, %s) RETURNING id",
+                    (message, status)
+                )
+                outbox_id = cur.fetchone()[0]
+            conn.commit()
+        SLACK_OUTBOX_ENQUEUED.inc()
+        if status == STATUS_QUEUED:
+            self._wakeup.set()
+        return outbox_id
+
+    @track_query("outbox_release")
+    def release_held(self, outbox_id: int) -> bool:
+        """保留中の投稿を承認して配信キューに戻す"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE slack_outbox
+                    SET status = 'queued', next_attempt_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND status = 'held'
+                """, (outbox_id,))
+                released = cur.rowcount == 1
+            conn.commit()
+        if released:
+            self._wakeup.set()
+        return released
+
+    @track_query("outbox_release")
+    def reject_held(self, outbox_id: int) -> bool:
+        """保留中の投稿を却下する（配信しない）"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE slack_outbox SET status = 'rejected'
+                    WHERE id = %s AND status = 'held'
+                """, (outbox_id,))
+                rejected = cur.rowcount == 1
+            conn.commit()
+        return rejected
+
+    @track_query("outbox_held")
+    def list_held(self, limit: int = 50) -> list[dict]:
+        """確認待ちの投稿を古い順に取得"""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT id, message, created_at FROM slack_outbox
+                    WHERE status = 'held'
+                    ORDER BY id
+                    LIMIT %s
+                """, (limit,))
+                return cur.fetchall()
+
+    @track_query("outbox_status")
+    def get_status(self, outbox_id: int) -> Optional[dict]:
+        """送信状況を取得"""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT id, status, attempts, last_error, created_at, sent_at
+                    FROM slack_outbox WHERE id = %s
+                """, (outbox_id,))
+                return cur.fetchone()
+
+    @track_query("outbox_claim")
+    def claim_batch(self, limit: Optional[int] = None) -> list[dict]:
+        """配信対象を取得し、リース期間中は他ワーカーから見えないようにする"""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # 'sending' のままリースが切れた行（ワーカー停止など）も再取得する
+                cur.execute("""
+                    UPDATE slack_outbox
+                    SET status = 'sending',
+                        attempts = attempts + 1,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE id IN (
+                        SELECT id FROM slack_outbox
+                        WHERE status IN ('queued', 'sending')
+                          AND next_attempt_at <= CURRENT_TIMESTAMP
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, message, attempts
+                """, (self.lease_seconds, limit or self.batch_size))
+                rows = cur.fetchall()
+            conn.commit()
+        return sorted(rows, key=lambda row: row['id'])
+
+    @track_query("outbox_lease")
+    def _extend_lease(self, rows: list[dict]) -> list[dict]:
+        """送信直前にリースを延ばし、まだ自分が所有している行だけを返す"""
+        if not rows:
+            return []
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE slack_outbox
+                    SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE {OWNED_ROWS_SQL}
+                    RETURNING id
+                """, (self.lease_seconds, *_owned(rows)))
+                owned = {row[0] for row in cur.fetchall()}
+            conn.commit()
+        if len(owned) < len(rows):
+            logger.warning(f"Slack outbox lease lost for {len(rows) - len(owned)} rows; skipping them")
+        return [row for row in rows if row['id'] in owned]
+
+    @track_query("outbox_mark")
+    def _mark_sent(self, rows: list[dict]):
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE slack_outbox
+                    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE {OWNED_ROWS_SQL}
+                """, _owned(rows))
+            conn.commit()
+
+    @track_query("outbox_mark")
+    def _reschedule(self, rows: list[dict], delay: float, error: str):
+        """レート制限で送れなかった行を、試行回数を戻して再キューする"""
+        if not rows:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE slack_outbox
+                    SET status = 'queued',
+                        attempts = GREATEST(attempts - 1, 0),
+                        last_error = %s,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE {OWNED_ROWS_SQL}
+                """, (error, delay, *_owned(rows)))
+            conn.commit()
+
+    @track_query("outbox_mark")
+    def _mark_failed(self, row: dict, error: str, retryable: bool) -> str:
+        if retryable and row['attempts'] < self.max_attempts:
+            delay = backoff_seconds(row['attempts'])
+            status = STATUS_QUEUED
+        else:
+            delay = 0
+            status = STATUS_FAILED
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE slack_outbox
+                    SET status = %s,
+                        last_error = %s,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE {OWNED_ROWS_SQL}
+                """, (status, error, delay, *_owned([row])))
+            conn.commit()
+        return status
+
+    def deliver(self, row: dict) -> str:
+        """1件配信して結果ステータスを返す"""
+        payload = self.slack_client.build_anonymous_payload(row['message'])
+        success, result_message, status_code = self.slack_client.post_payload(payload)
+        if success:
+            self._mark_sent([row])
+            SLACK_OUTBOX_DELIVERIES.inc(result=STATUS_SENT)
+            return STATUS_SENT
+        if status_code == 429:
+            self._reschedule([row], self.slack_client.rate_limiter.seconds_until_available(), result_message)
+            SLACK_OUTBOX_DELIVERIES.inc(result=RESULT_RATE_LIMITED)
+            return RESULT_RATE_LIMITED
+        status = self._mark_failed(row, result_message, is_retryable(status_code))
+        SLACK_OUTBOX_DELIVERIES.inc(result="retry" if status == STATUS_QUEUED else STATUS_FAILED)
+        return status
+
+    def deliver_digest(self, rows: list[dict]) -> str:
+        """複数行をダイジェスト1件にまとめて配信"""
+        payload = self.slack_client.build_digest_payload([row['message'] for row in rows])
+        success, result_message, status_code = self.slack_client.post_payload(payload)
+        if success:
+            self._mark_sent(rows)
+            SLACK_DIGESTS.inc()
+            SLACK_OUTBOX_DELIVERIES.inc(len(rows), result=STATUS_SENT)
+            return STATUS_SENT
+        if status_code == 429:
+            self._reschedule(rows, self.slack_client.rate_limiter.seconds_until_available(), result_message)
+            SLACK_OUTBOX_DELIVERIES.inc(len(rows), result=RESULT_RATE_LIMITED)
+            return RESULT_RATE_LIMITED
+        for row in rows:
+            status = self._mark_failed(row, result_message, is_retryable(status_code))
+            SLACK_OUTBOX_DELIVERIES.inc(result="retry" if status == STATUS_QUEUED else STATUS_FAILED)
+        return STATUS_QUEUED
+
+    def digest_enabled(self) -> bool:
+        """ダイジェストモードが有効か"""
+        return bool(self.digest_threshold)
+
+    def process_once(self) -> tuple[int, bool]:
+        """配信可能な行を1バッチ処理し、(処理件数, ダイジェスト送信したか) を返す"""
+        limit = max(self.batch_size, self.digest_max_items) if self.digest_enabled() else self.batch_size
+        rows = self.claim_batch(limit)
+        
+        # 未送信が溜まっている場合は1件にまとめてレート制限内で流し切る
+        # 送信の前に毎回リースを延ばし、待っている間に他のワーカーへ移った行は送らない
+        if self.digest_enabled() and len(rows) >= self.digest_threshold:
+            for start in range(0, len(rows), self.digest_max_items):
+                chunk = self._extend_lease(rows[start:start + self.digest_max_items])
+                if chunk and self.deliver_digest(chunk) == RESULT_RATE_LIMITED:
+                    rest = rows[start + self.digest_max_items:]
+                    self._reschedule(rest, self.slack_client.rate_limiter.seconds_until_available(), "rate limited")
+                    break
+            return len(rows), True
+        
+        for i, row in enumerate(rows):
+            if not self._extend_lease([row]):
+                continue
+            if self.deliver(row) == RESULT_RATE_LIMITED:
+                # Retry-After の間は残りも送れないので、リースを解放して戻す
+                self._reschedule(rows[i + 1:], self.slack_client.rate_limiter.seconds_until_available(), "rate limited")
+                break
+        return len(rows), False
+
+    def _run(self):
+        """ワーカーループ"""
+        logger.info("Slack outbox worker started")
+        while not self._stop.is_set():
+            try:
+                processed, digested = self.process_once()
+            except Exception as e:
+                logger.error(f"Slack outbox worker error: {e}")
+                processed, digested = 0, False
+            if digested:
+                # ダイジェスト送信後はN秒間投稿を溜めてからまとめる
+                self._stop.wait(self.digest_interval)
+            elif processed == 0:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        logger.info("Slack outbox worker stopped")
+
+    def start(self):
+        """バックグラウンドワーカーを起動"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="slack-outbox-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """ワーカーを停止"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+@st.cache_resource
+def get_slack_outbox() -> SlackOutbox:
+    """プロセス共有のアウトボックス（ワーカー起動済み）を取得"""
+    from slack_client import get_slack_client
+
+    try:
+        slack_config = st.secrets.get("slack", {})
+    except Exception:
+        slack_config = {}
+    digest_threshold = slack_config.get("digest_threshold")
+    outbox = SlackOutbox(
+        get_slack_client(),
+        digest_threshold=int(digest_threshold) if digest_threshold else None,
+        digest_interval=float(slack_config.get("digest_interval", 10.0)),
+        digest_max_items=int(slack_config.get("digest_max_items", 10)),
+    )
+    outbox.start()
+    return outbox
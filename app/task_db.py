@@ -1,46 +1,374 @@
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 import streamlit as st
+import circuit_breaker
+from migrations import apply_migrations
+from metrics import track_query, DB_POOL_WAIT_SECONDS, DB_CONNECTIONS_OPENED
+from query_trace import trace_query
 
 # グローバル初期化フラグ（プロセス全体で共有）
 _DB_INITIALIZED = False
 _TASKS_SYNCED = False
-_CONNECTION_POOL = None
+# 接続先ごとの接続プール（接続パラメータ -> ConnectionPool）
+_CONNECTION_POOLS = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+CREATE_TASKS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        task_type TEXT,
+        description TEXT,
+        content JSONB
+    )
+"""
+
+# (user_id, task_id) の一意性は migrations で作る covering インデックスに置き換わる
+CREATE_PROGRESS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS progress (
+        id SERIAL PRIMARY KEY,
+        user_id INT NOT NULL,
+        task_id INT NOT NULL,
+        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (task_id) REFERENCES tasks(id),
+        UNIQUE(user_id, task_id)
+    )
+"""
+
+# 同期・非同期バックエンドで共有するクエリ
+TASKS_WITH_PROGRESS_SQL = """
+    SELECT t.id, t.title, t.task_type, t.description, t.content,
+        CASE WHEN p.task_id IS NOT NULL THEN TRUE ELSE FALSE END AS completed
+    FROM tasks t
+    LEFT JOIN progress p ON t.id = p.task_id AND p.user_id = %s
+    ORDER BY t.id
+"""
+
+TASK_EXISTS_SQL = "SELECT 1 FROM tasks WHERE id = %s"
+
+INSERT_TASK_SQL = """
+    INSERT INTO tasks (id, title, task_type, description, content)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# 完了済みなら最初の完了時刻を残す（write-behind の一括INSERTと同じ扱い）
+MARK_TASK_COMPLETE_SQL = """
+    INSERT INTO progress (user_id, task_id, completed_at)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (user_id, task_id) DO NOTHING
+"""
+
+COMPLETED_COUNT_SQL = """
+    SELECT COUNT(*) AS completed_count FROM progress WHERE user_id = %s
+"""
+
+USER_RANKING_SQL = """
+    SELECT u.username, 
+           COUNT(p.task_id) as completed_tasks,
+           MAX(p.completed_at) as last_completion
+    FROM users u
+    LEFT JOIN progress p ON u.id = p.user_id
+    GROUP BY u.id, u.username
+    ORDER BY completed_tasks DESC, last_completion ASC NULLS LAST
+    LIMIT 10
+"""
+
+# ランキングと同じ並び順でのユーザー自身の順位
+USER_RANK_SQL = """
+    SELECT rank, completed_tasks, total_users
+    FROM (
+        SELECT s.user_id, s.completed_tasks,
+               RANK() OVER (ORDER BY s.completed_tasks DESC, s.last_completion ASC NULLS LAST) AS rank,
+               COUNT(*) OVER () AS total_users
+        FROM (
+            SELECT u.id AS user_id,
+                   COUNT(p.task_id) AS completed_tasks,
+                   MAX(p.completed_at) AS last_completion
+            FROM users u
+            LEFT JOIN progress p ON u.id = p.user_id
+            GROUP BY u.id
+        ) s
+    ) r
+    WHERE r.user_id = %s
+"""
+
+TASK_COMPLETION_COUNTS_SQL = """
+    SELECT task_id, COUNT(*) AS completed_users
+    FROM progress
+    GROUP BY task_id
+"""
+
+# クエリ種別ごとの既定の (statement_timeout, lock_timeout) ミリ秒（0 で無制限）
+# read: ダッシュボード・ログイン、aggregate: 全ユーザーの集計（ランキング・順位・タスク別達成人数）、
+# write: 完了登録・ユーザー登録、admin: テーブル作成・タスク同期
+# aggregate は progress 全体を読むため参加者数に比例して遅くなる（10万人で約200ms）。read の予算とは分ける
+DEFAULT_QUERY_TIMEOUTS = {
+    "read": (200, 100),
+    "aggregate": (1000, 100),
+    "write": (1000, 500),
+    "admin": (2000, 1000),
+}
+
+_QUERY_TIMEOUTS = None
+
+
+def _timeout_setting(db_config, key: str, env_name: str, default: int) -> int:
+    """secrets → 環境変数 → 既定値の順に取得（0 は無制限として有効な値なので is None で判定）"""
+    value = db_config.get(key)
+    if value is None:
+        value = os.getenv(env_name)
+    if value is None:
+        value = default
+    return int(value)
+
+
+def get_query_timeouts() -> dict:
+    """クエリ種別ごとの (statement_timeout, lock_timeout) ミリ秒を取得
+
+    secrets.toml の [database] read_timeout_ms / read_lock_timeout_ms など、
+    または環境変数 DB_READ_TIMEOUT_MS / DB_READ_LOCK_TIMEOUT_MS などで上書きできる。
+    """
+    global _QUERY_TIMEOUTS
+
+    if _QUERY_TIMEOUTS is not None:
+        return _QUERY_TIMEOUTS
+    try:
+        db_config = st.secrets.get("database", {})
+    except Exception:
+        db_config = {}
+    timeouts = {}
+    for query_class, (statement_ms, lock_ms) in DEFAULT_QUERY_TIMEOUTS.items():
+        timeouts[query_class] = (
+            _timeout_setting(db_config, f"{query_class}_timeout_ms",
+                             f"DB_{query_class.upper()}_TIMEOUT_MS", statement_ms),
+            _timeout_setting(db_config, f"{query_class}_lock_timeout_ms",
+                             f"DB_{query_class.upper()}_LOCK_TIMEOUT_MS", lock_ms),
+        )
+    _QUERY_TIMEOUTS = timeouts
+    return timeouts
+
+
+def timeout_statements(query_class: str) -> str:
+    """トランザクション内だけに効くタイムアウト設定文（SET LOCAL）"""
+    statement_ms, lock_ms = get_query_timeouts()[query_class]
+    return f"SET LOCAL statement_timeout = {statement_ms}; SET LOCAL lock_timeout = {lock_ms}; "
+
+
+def with_timeouts(query_class: str, sql: str) -> str:
+    """SQLの前にタイムアウト設定を付ける（psycopg2 は1回の execute で複数文を送れるので往復は増えない）"""
+    return timeout_statements(query_class) + sql
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """サーバー側で PREPARE 済みの文の名前を覚えている接続"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class ConnectionPool:
+    """空きを待てるスレッドセーフな接続プール（ThreadedConnectionPool をブレーカー越しに使う）
+
+    psycopg2 のプールは返却時に minconn を超えた接続を閉じるため、PREPARE 済みの接続を
+    残せるよう maxconn 本を最初の利用時にまとめて開き、以後は閉じずに使い回す。
+    """
+
+    def __init__(self, maxconn: int, wait_timeout: float = 5.0, **connection_params):
+        self.maxconn = maxconn
+        self.wait_timeout = wait_timeout
+        self.connection_params = connection_params
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = circuit_breaker.get_db_breaker().call(
+                    psycopg2.pool.ThreadedConnectionPool,
+                    self.maxconn, self.maxconn,
+                    connection_factory=PreparingConnection, **self.connection_params,
+                )
+                DB_CONNECTIONS_OPENED.inc(self.maxconn)
+            return self._pool
+
+    def _getconn(self):
+        """ブレーカーを確認してから接続を借りる（捨てた接続の張り直しもここで起きる）"""
+        breaker = circuit_breaker.get_db_breaker()
+        breaker.before_call()
+        pool = self._get_pool()
+        try:
+            return pool.getconn()
+        except psycopg2.OperationalError as e:
+            breaker.record_failure(e)
+            raise
+
+    def closeall(self):
+        """開いている接続をすべて閉じる"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    @contextmanager
+    def connection(self):
+        """接続を借りて、抜けるときにコミット（例外時はロールバック）して返す
+
+        例外が起きた接続は、PREPARE 済みの状態が分からなくなるため閉じて捨てる。
+        """
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise circuit_breaker.PoolExhaustedError(
+                f"no database connection available within {self.wait_timeout}s"
+            )
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+        try:
+            conn = self._getconn()
+            healthy = False
+            try:
+                with conn:
+                    yield conn
+                healthy = True
+            finally:
+                self._pool.putconn(conn, close=not healthy or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+
+def get_connection_pool(connection_params: dict) -> ConnectionPool:
+    """接続パラメータに対応するプロセス共有の接続プールを取得
+
+    secrets.toml の [database] pool_max / pool_timeout
+    または環境変数 DB_POOL_MAX / DB_POOL_TIMEOUT で設定。
+    """
+    key = tuple(sorted(connection_params.items()))
+    pool = _CONNECTION_POOLS.get(key)
+    if pool is not None:
+        return pool
+    with _CONNECTION_POOLS_LOCK:
+        pool = _CONNECTION_POOLS.get(key)
+        if pool is None:
+            try:
+                db_config = st.secrets.get("database", {})
+            except Exception:
+                db_config = {}
+            pool = ConnectionPool(
+                int(db_config.get("pool_max") or os.getenv("DB_POOL_MAX", "10")),
+                wait_timeout=float(db_config.get("pool_timeout") or os.getenv("DB_POOL_TIMEOUT", "5")),
+                **connection_params,
+            )
+            _CONNECTION_POOLS[key] = pool
+        return pool
+
+
+# %s / %(name)s を PREPARE 用の $1, $2 ... に置き換える
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s")
+# 名前 -> (PREPARE する本文, 引数の並び)
+_PREPARED_SQL = {}
+
+
+def _to_prepared_sql(sql: str) -> tuple[str, list]:
+    """psycopg2 形式のSQLを PREPARE 用の本文と引数の並び（位置の番号または名前）に変換"""
+    keys = []
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            keys.append(len(keys))
+            return f"${len(keys)}"
+        if name not in keys:
+            keys.append(name)
+        return f"${keys.index(name) + 1}"
+
+    return _PARAM_RE.sub(replace, sql), keys
+
+
+def execute_prepared(cur, name: str, sql: str, params=(), query_class: str = "read"):
+    """ホットなクエリを接続ごとに1回だけ PREPARE し、以降は EXECUTE で実行（解析・計画を省く）
+
+    初回は PREPARE・タイムアウト設定・EXECUTE を1回の execute で送るので往復は増えない。
+    プール外の接続（PreparingConnection でない）では通常どおり実行する。
+    """
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None:
+        with trace_query(name, sql, params, query_class):
+            cur.execute(with_timeouts(query_class, sql), params or None)
+        return
+    if name not in _PREPARED_SQL:
+        _PREPARED_SQL[name] = _to_prepared_sql(sql)
+    prepared_sql, keys = _PREPARED_SQL[name]
+    if isinstance(params, dict):
+        args = [params[key] for key in keys]
+    else:
+        args = list(params or ())
+    statement = timeout_statements(query_class)
+    if name not in prepared:
+        statement = f"PREPARE {name} AS {prepared_sql}; " + statement
+    if args:
+        statement += f"EXECUTE {name}({', '.join(['%s'] * len(args))})"
+    else:
+        statement += f"EXECUTE {name}"
+    with trace_query(name, sql, params, query_class):
+        cur.execute(statement, args or None)
+    prepared.add(name)
+
+
+def load_connection_params() -> dict:
+    """DB接続パラメータを取得（Streamlit Secrets → 環境変数の順）
+
+    [database] schema または環境変数 DB_SCHEMA を指定すると、その schema を search_path にする
+    （ベンチマーク用のデータを別スキーマに置く場合など）。
+    """
+    # Streamlit Cloud環境での接続パラメータ
+    try:
+        # Streamlit Secretsから接続情報を取得
+
+        db_config = st.secrets.get("database", {})  # Streamlit secrets.toml または Cloud Secrets
+        params = {
+            "host": db_config.get("host") or os.getenv("DB_HOST", "localhost"),
+            "database": db_config.get("database") or os.getenv("DB_NAME", "snowvillage"),
+            "user": db_config.get("user") or os.getenv("DB_USER", "postgres"),
+            "password": db_config.get("password") or os.getenv("DB_PASSWORD", ""),
+            "port": int(db_config.get("port") or os.getenv("DB_PORT", "5432")),
+            "sslmode": db_config.get("sslmode", "prefer"),
+            "connect_timeout": int(db_config.get("connect_timeout") or os.getenv("DB_CONNECT_TIMEOUT", "10")),
+            "application_name": "snowvillage_go_app",
+        }
+        schema = db_config.get("schema") or os.getenv("DB_SCHEMA")
+
+    except Exception as e:
+        # Secretsが利用できない場合（ローカル開発環境）
+        print(f"Using fallback database configuration: {e}")
+        params = {
+            'host': os.getenv('DB_HOST', 'postgres-dev'),
+            'database': os.getenv('DB_NAME', 'snowvillage'),
+            'user': os.getenv('DB_USER', 'postgres'),
+            'password': os.getenv('DB_PASSWORD', 'devpassword'),
+            'port': int(os.getenv('DB_PORT', '5432')),
+            'sslmode': 'prefer',
+            'connect_timeout': 10,
+            'application_name': 'snowvillage_go_app'
+        }
+        schema = os.getenv('DB_SCHEMA')
+
+    if schema:
+        params["options"] = f"-c search_path={schema}"
+    return params
+
 
 class TaskService:
     """タスクサービス"""
     def __init__(self):
-        # Streamlit Cloud環境での接続パラメータ
-        try:
-            # Streamlit Secretsから接続情報を取得
-
-            db_config = st.secrets.get("database", {})  # Streamlit secrets.toml または Cloud Secrets
-            self.connection_params = {
-                "host": db_config.get("host") or os.getenv("DB_HOST", "localhost"),
-                "database": db_config.get("database") or os.getenv("DB_NAME", "snowvillage"),
-                "user": db_config.get("user") or os.getenv("DB_USER", "postgres"),
-                "password": db_config.get("password") or os.getenv("DB_PASSWORD", ""),
-                "port": int(db_config.get("port") or os.getenv("DB_PORT", "5432")),
-                "sslmode": db_config.get("sslmode", "prefer"),
-                "connect_timeout": int(db_config.get("connect_timeout") or os.getenv("DB_CONNECT_TIMEOUT", "10")),
-                "application_name": "snowvillage_go_app",
-            }
-
-        except Exception as e:
-            # Secretsが利用できない場合（ローカル開発環境）
-            print(f"Using fallback database configuration: {e}")
-            self.connection_params = {
-                'host': os.getenv('DB_HOST', 'postgres-dev'),
-                'database': os.getenv('DB_NAME', 'snowvillage'),
-                'user': os.getenv('DB_USER', 'postgres'),
-                'password': os.getenv('DB_PASSWORD', 'devpassword'),
-                'port': int(os.getenv('DB_PORT', '5432')),
-                'sslmode': 'prefer',
-                'connect_timeout': 10,
-                'application_name': 'snowvillage_go_app'
-            }
+        self.connection_params = load_connection_params()
         # 初期化を一度だけ実行
         self._ensure_db_initialized()
         self._setup_connection_pool()
@@ -63,65 +391,56 @@ class TaskService:
 
     def _init_db(self):
         """テーブル初期化（内部メソッド）"""
+        # ブレーカーが開いていれば接続を待たずに失敗させる
+        circuit_breaker.get_db_breaker().before_call()
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                with psycopg2.connect(**self.connection_params) as conn:
+                with circuit_breaker.connect(self.connection_params) as conn:
                     with conn.cursor() as cursor:
-                        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS tasks (
-                            id SERIAL PRIMARY KEY,
-                            title TEXT NOT NULL,
-                            task_type TEXT,
-                            description TEXT,
-                            content JSONB
-                        )
-                        """)
-                        cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS progress (
-                            id SERIAL PRIMARY KEY,
-                            user_id INT NOT NULL,
-                            task_id INT NOT NULL,
-                            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (task_id) REFERENCES tasks(id),
-                            UNIQUE(user_id, task_id)
-                        )
-                        """)
+                        cursor.execute(with_timeouts("admin", CREATE_TASKS_TABLE_SQL))
+                        cursor.execute(CREATE_PROGRESS_TABLE_SQL)
+                    applied = apply_migrations(conn, lock_timeout_ms=get_query_timeouts()["admin"][1])
+                    if applied:
+                        print(f"Applied schema migrations: {applied}")
                     conn.commit()
                     print(f"Task database initialized successfully (attempt {attempt + 1})")
                     return
+            except circuit_breaker.CircuitOpenError:
+                raise
             except psycopg2.OperationalError as e:
                 print(f"Task database connection attempt {attempt + 1} failed: {e}")
                 if attempt == max_retries - 1:
-                    raise Exception(f"Failed to connect to task database after {max_retries} attempts: {e}")
+                    raise circuit_breaker.DatabaseUnavailableError(f"Failed to connect to task database after {max_retries} attempts: {e}")
             except Exception as e:
                 print(f"Task database initialization error: {e}")
                 if attempt == max_retries - 1:
                     raise
 
     def _setup_connection_pool(self):
-        """接続プールの設定（シンプル版）"""
-        # Streamlit環境では複雑な接続プールは避け、接続の再利用を最小限に
-        pass
+        """接続プールを用意（プロセスで共有し、PREPARE 済みの文を接続ごとに再利用する）"""
+        get_connection_pool(self.connection_params)
 
     def get_connection(self):
-        """データベース接続を取得"""
-        return psycopg2.connect(**self.connection_params)
+        """プールから接続を借りる（with で使い、抜けるとプールに返る）"""
+        return get_connection_pool(self.connection_params).connection()
 
+    @track_query("insert_task_if_not_exists")
     def insert_task_if_not_exists(self, task_id: int, title: str, task_type: str = None, description: str = None, content: dict = None):
         """タスクがなければ追加（個別実行用）"""
         import json
-        with psycopg2.connect(**self.connection_params) as conn:
+        with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT 1 FROM tasks WHERE id = %s", (task_id,))
+                with trace_query("task_exists", TASK_EXISTS_SQL, (task_id,), "admin"):
+                    cur.execute(with_timeouts("admin", TASK_EXISTS_SQL), (task_id,))
                 if not cur.fetchone():
                     content_json = json.dumps(content) if content else None
-                    cur.execute("""
-                        INSERT INTO tasks (id, title, task_type, description, content) 
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (task_id, title, task_type, description, content_json))
+                    params = (task_id, title, task_type, description, content_json)
+                    with trace_query("insert_task", INSERT_TASK_SQL, params, "admin"):
+                        cur.execute(INSERT_TASK_SQL, params)
             conn.commit()
 
+    @track_query("bulk_insert_tasks_if_not_exists")
     def bulk_insert_tasks_if_not_exists(self, tasks_data):
         """複数タスクの効率的な一括挿入"""
         import json
@@ -129,12 +448,12 @@ class TaskService:
         if not tasks_data:
             return
             
-        with psycopg2.connect(**self.connection_params) as conn:
+        with self.get_connection() as conn:
             with conn.cursor() as cur:
                 # 既存タスクIDを一括取得
                 task_ids = [task['id'] for task in tasks_data]
                 format_strings = ','.join(['%s'] * len(task_ids))
-                cur.execute(f"SELECT id FROM tasks WHERE id IN ({format_strings})", task_ids)
+                cur.execute(with_timeouts("admin", f"SELECT id FROM tasks WHERE id IN ({format_strings})"), task_ids)
                 existing_ids = set(row[0] for row in cur.fetchall())
                 
                 # 新規タスクのみフィルタリング
@@ -153,11 +472,8 @@ class TaskService:
                             content_json
                         ))
                     
-                    # 一括挿入実行
-                    cur.executemany("""
-                        INSERT INTO tasks (id, title, task_type, description, content) 
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, insert_data)
+                    # 一括挿入実行（起動時のタスク同期なのでクエリトレースには記録しない）
+                    cur.executemany(INSERT_TASK_SQL, insert_data)
                     
                     print(f"Inserted {len(new_tasks)} new tasks")
                 else:
@@ -165,43 +481,112 @@ class TaskService:
                     
             conn.commit()
 
+    @track_query("mark_task_complete")
     def mark_task_complete(self, task_id: int, user_id: int):
         """タスクを完了にマーク"""
-        with psycopg2.connect(**self.connection_params) as conn:
+        with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO progress (user_id, task_id, completed_at)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id, task_id)
-                    DO UPDATE SET completed_at = EXCLUDED.completed_at
-                """, (user_id, task_id, datetime.now()))
+                execute_prepared(cur, "mark_task_complete", MARK_TASK_COMPLETE_SQL,
+                                 (user_id, task_id, datetime.now()), "write")
             conn.commit()
 
+    @track_query("mark_task_complete_and_count")
+    def mark_task_complete_and_count(self, task_id: int, user_id: int) -> int:
+        """タスクを完了にマークし、ユーザーの完了数を返す（同じ接続・トランザクションで実行）"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                execute_prepared(cur, "mark_task_complete", MARK_TASK_COMPLETE_SQL,
+                                 (user_id, task_id, datetime.now()), "write")
+                execute_prepared(cur, "completed_count", COMPLETED_COUNT_SQL, (user_id,), "write")
+                completed_count = cur.fetchone()[0]
+            conn.commit()
+        return completed_count
+
+    @track_query("get_tasks_with_progress")
     def get_tasks_with_progress(self, user_id: int):
         """タスクと進捗を取得"""
-        with psycopg2.connect(**self.connection_params) as conn:
+        with self.get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT t.id, t.title, t.task_type, t.description, t.content,
-                        CASE WHEN p.task_id IS NOT NULL THEN TRUE ELSE FALSE END AS completed
-                    FROM tasks t
-                    LEFT JOIN progress p ON t.id = p.task_id AND p.user_id = %s
-                    ORDER BY t.id
-                """, (user_id,))
+                execute_prepared(cur, "tasks_with_progress", TASKS_WITH_PROGRESS_SQL, (user_id,))
                 return cur.fetchall()
 
+    @track_query("get_user_ranking")
     def get_user_ranking(self):
         """ユーザーのタスク完了数ランキングを取得（上位10位）"""
-        with psycopg2.connect(**self.connection_params) as conn:
+        with self.get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT u.username, 
-                           COUNT(p.task_id) as completed_tasks,
-                           MAX(p.completed_at) as last_completion
-                    FROM users u
-                    LEFT JOIN progress p ON u.id = p.user_id
-                    GROUP BY u.id, u.username
-                    ORDER BY completed_tasks DESC, last_completion ASC NULLS LAST
-                    LIMIT 10
-                """)
+                execute_prepared(cur, "user_ranking", USER_RANKING_SQL, (), "aggregate")
                 return cur.fetchall()
+
+    @track_query("get_user_rank")
+    def get_user_rank(self, user_id: int):
+        """ユーザー自身の順位を取得（rank, completed_tasks, total_users。未登録ならNone）"""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                execute_prepared(cur, "user_rank", USER_RANK_SQL, (user_id,), "aggregate")
+                return cur.fetchone()
+
+    @track_query("get_task_completion_counts")
+    def get_task_completion_counts(self) -> dict:
+        """タスクごとの達成人数を取得（task_id -> 人数）"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                execute_prepared(cur, "task_completion_counts", TASK_COMPLETION_COUNTS_SQL, (), "aggregate")
+                return dict(cur.fetchall())
+
+    def get_dashboard_snapshot(self, user_id: int, aggregates: bool = False) -> dict:
+        """ダッシュボード1回の描画に必要なデータを取得
+
+        既定ではユーザー自身の進捗だけを取得する。aggregates=True なら全ユーザーを集計する順位と
+        タスク別達成人数も取得する（同期版は順番に実行。再実行ごとに呼ぶ用途には重い）。
+        """
+        if not aggregates:
+            return {"tasks": self.get_tasks_with_progress(user_id), "rank": None, "task_stats": {}}
+        return {
+            "tasks": self.get_tasks_with_progress(user_id),
+            "rank": self.get_user_rank(user_id),
+            "task_stats": self.get_task_completion_counts(),
+        }
+
+
+def get_db_backend() -> str:
+    """DBバックエンドの種類を取得（"sync" / "async" / "pipeline"）"""
+    try:
+        backend = st.secrets.get("database", {}).get("backend")
+    except Exception:
+        backend = None
+    return (backend or os.getenv("DB_BACKEND", "sync")).lower()
+
+
+def get_completion_journal_dir():
+    """完了ジャーナルのディレクトリを取得（未設定なら None）"""
+    try:
+        directory = st.secrets.get("database", {}).get("completion_journal_dir")
+    except Exception:
+        directory = None
+    return directory or os.getenv("COMPLETION_JOURNAL_DIR") or None
+
+
+def is_write_behind_enabled() -> bool:
+    """完了書き込みの write-behind モードが有効か（ジャーナル設定時は常に有効）"""
+    if get_completion_journal_dir():
+        return True
+    try:
+        enabled = st.secrets.get("database", {}).get("write_behind")
+    except Exception:
+        enabled = None
+    if enabled is None:
+        enabled = os.getenv("DB_WRITE_BEHIND", "0") not in ("", "0", "false", "False")
+    return bool(enabled)
+
+
+def get_task_service():
+    """設定されたバックエンドのタスクサービスを取得"""
+    if is_write_behind_enabled():
+        from completion_writer import get_write_behind_task_service
+        return get_write_behind_task_service()
+    if get_db_backend() in ("async", "pipeline"):
+        # psycopg 3 は async バックエンドを使う場合のみ必要
+        from task_db_async import get_async_task_service
+        return get_async_task_service()
+    return TaskService()
@@ -0,0 +1,410 @@
+"""
+psycopg 3 による非同期DBバックエンド
+TaskService / UserService と同じメソッドを持ち、1回の再実行で必要な複数クエリを
+非同期接続プールで並行に実行する。
+
+Streamlit のスクリプトは同期関数なので、専用スレッドで動くイベントループに
+コルーチンを投げて結果を待つ（BlockingService）。
+有効化: secrets.toml の [database] backend = "async" または環境変数 DB_BACKEND=async
+
+backend = "pipeline" では、依存する複数の文を psycopg 3 のパイプラインモードで
+1往復にまとめて送る（PipelinedTaskService / PipelinedUserService）。
+
+どちらのバックエンドでも、各操作はクエリ種別ごとの statement_timeout / lock_timeout を
+SET LOCAL 相当で掛けたトランザクション内で実行する（deadline）。
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+import psycopg
+import streamlit as st
+from psycopg.conninfo import make_conninfo
+from psycopg.errors import UniqueViolation
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from circuit_breaker import DatabaseUnavailableError, PoolExhaustedError, QueryTimeoutError, get_db_breaker
+from metrics import track_query, query_timeout_kind, DB_CONNECTIONS_OPENED, USER_AUTH_TOTAL
+from task_db import (
+    load_connection_params,
+    get_db_backend,
+    get_query_timeouts,
+    TASKS_WITH_PROGRESS_SQL,
+    MARK_TASK_COMPLETE_SQL,
+    COMPLETED_COUNT_SQL,
+    USER_RANKING_SQL,
+    USER_RANK_SQL,
+    TASK_COMPLETION_COUNTS_SQL,
+)
+from user import (
+    User, BUSY_MESSAGE, RETRY_MESSAGE, GET_OR_CREATE_USER_SQL, LOGIN_USER_SQL, SELECT_USER_SQL,
+    LOGIN_SUCCESS, LOGIN_INVALID, LOGIN_NOT_FOUND, LOGIN_TIMEOUT, LOGIN_ERROR,
+)
+
+# SET LOCAL と同じ（トランザクション終了で元に戻る）。パラメータを使えるよう set_config で書く
+SET_TIMEOUTS_SQL = "SELECT set_config('statement_timeout', %s, true), set_config('lock_timeout', %s, true)"
+
+
+class EventLoopThread:
+    """専用スレッドでイベントループを動かし、同期コードからコルーチンを実行する"""
+
+    def __init__(self, name: str = "db-async-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """コルーチンをループ上で実行して結果を返す（呼び出し元スレッドはブロック）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        """ループを停止"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def create_async_pool(connection_params: dict = None, min_size: int = 1, max_size: int = 10) -> AsyncConnectionPool:
+    """非同期接続プールを作成（open() は呼び出し側で行う）"""
+    params = dict(connection_params or load_connection_params())
+    # psycopg 3 の接続文字列では database ではなく dbname
+    params["dbname"] = params.pop("database", None)
+
+    async def on_connect(conn):
+        DB_CONNECTIONS_OPENED.inc()
+
+    # 単文はautocommitで1往復、複数文はトランザクションを明示する
+    return AsyncConnectionPool(
+        conninfo=make_conninfo(**{k: v for k, v in params.items() if v is not None}),
+        kwargs={"row_factory": dict_row, "autocommit": True},
+        min_size=min_size,
+        max_size=max_size,
+        configure=on_connect,
+        open=False,
+    )
+
+
+@asynccontextmanager
+async def deadline(conn, query_class: str):
+    """クエリ種別のタイムアウトを掛けたトランザクション
+
+    autocommit 接続で SET LOCAL を効かせるには BEGIN が要るため、BEGIN・タイムアウト設定・本体・
+    COMMIT をパイプラインで流して1往復に収める。結果の読み出しはブロックを抜けてから行う。
+    ホットなクエリは prepare=True で接続ごとに名前付きで準備し、2回目以降は解析・計画を省く。
+    """
+    statement_ms, lock_ms = get_query_timeouts()[query_class]
+    try:
+        async with conn.pipeline():
+            await conn.execute("BEGIN")
+            await conn.execute(SET_TIMEOUTS_SQL, (str(statement_ms), str(lock_ms)), prepare=True)
+            yield
+            await conn.execute("COMMIT")
+    except Exception:
+        await conn.rollback()
+        raise
+
+
+class AsyncTaskService:
+    """タスクサービス（非同期版）"""
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+
+    async def _fetch(self, name: str, sql: str, params=None, one: bool = False, query_class: str = "read"):
+        with track_query(name):
+            async with self.pool.connection() as conn:
+                async with deadline(conn, query_class):
+                    cur = await conn.execute(sql, params, prepare=True)
+                return await (cur.fetchone() if one else cur.fetchall())
+
+    async def mark_task_complete(self, task_id: int, user_id: int):
+        """タスクを完了にマーク"""
+        with track_query("mark_task_complete"):
+            async with self.pool.connection() as conn:
+                async with deadline(conn, "write"):
+                    await conn.execute(MARK_TASK_COMPLETE_SQL, (user_id, task_id, datetime.now()), prepare=True)
+
+    async def mark_task_complete_and_count(self, task_id: int, user_id: int) -> int:
+        """タスクを完了にマークし、ユーザーの完了数を返す（同じトランザクション・1往復）"""
+        with track_query("mark_task_complete_and_count"):
+            async with self.pool.connection() as conn:
+                async with deadline(conn, "write"):
+                    await conn.execute(MARK_TASK_COMPLETE_SQL, (user_id, task_id, datetime.now()), prepare=True)
+                    cur = await conn.execute(COMPLETED_COUNT_SQL, (user_id,), prepare=True)
+                row = await cur.fetchone()
+        return row["completed_count"]
+
+    async def get_tasks_with_progress(self, user_id: int):
+        """タスクと進捗を取得"""
+        return await self._fetch("get_tasks_with_progress", TASKS_WITH_PROGRESS_SQL, (user_id,))
+
+    async def get_user_ranking(self):
+        """ユーザーのタスク完了数ランキングを取得（上位10位）"""
+        return await self._fetch("get_user_ranking", USER_RANKING_SQL, query_class="aggregate")
+
+    async def get_user_rank(self, user_id: int):
+        """ユーザー自身の順位を取得"""
+        return await self._fetch("get_user_rank", USER_RANK_SQL, (user_id,), one=True, query_class="aggregate")
+
+    async def get_task_completion_counts(self) -> dict:
+        """タスクごとの達成人数を取得（task_id -> 人数）"""
+        rows = await self._fetch("get_task_completion_counts", TASK_COMPLETION_COUNTS_SQL,
+                                 query_class="aggregate")
+        return {row["task_id"]: row["completed_users"] for row in rows}
+
+    async def get_dashboard_snapshot(self, user_id: int, aggregates: bool = False) -> dict:
+        """進捗を取得（aggregates=True なら順位・タスク別達成人数も別々の接続で並行に取得）"""
+        if not aggregates:
+            return {"tasks": await self.get_tasks_with_progress(user_id), "rank": None, "task_stats": {}}
+        tasks, rank, task_stats = await asyncio.gather(
+            self.get_tasks_with_progress(user_id),
+            self.get_user_rank(user_id),
+            self.get_task_completion_counts(),
+        )
+        return {"tasks": tasks, "rank": rank, "task_stats": task_stats}
+
+
+class AsyncUserService:
+    """ユーザーサービス（非同期版）"""
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+
+    async def register_user(self, username: str) -> tuple[bool, str, Optional[User]]:
+        """新規ユーザー登録"""
+        if not username or not username.strip():
+            return False, "名前を入力してください", None
+
+        username = username.strip()
+
+        try:
+            with track_query("register_user"):
+                async with self.pool.connection() as conn:
+                    async with deadline(conn, "write"):
+                        cur = await conn.execute(
+                            "INSERT INTO users (username) VALUES (%s) RETURNING *",
+                            (username,)
+                        )
+                    user_data = await cur.fetchone()
+        except UniqueViolation:
+            USER_AUTH_TOTAL.inc(action="register", result="duplicate")
+            return False, "同じ名前のユーザーが既に存在します", None
+        except Exception as e:
+            if query_timeout_kind(e) or isinstance(e, PoolTimeout):
+                USER_AUTH_TOTAL.inc(action="register", result="timeout")
+                return False, BUSY_MESSAGE, None
+            USER_AUTH_TOTAL.inc(action="register", result="error")
+            return False, f"登録に失敗しました: {str(e)}", None
+
+        USER_AUTH_TOTAL.inc(action="register", result="success")
+        return True, "登録が完了しました！", User(
+            id=user_data['id'],
+            username=user_data['username'],
+            created_at=user_data['created_at']
+        )
+
+    async def get_or_create_user(self, username: str) -> tuple[bool, str, Optional[User], bool]:
+        """ユーザーを取得、いなければ登録（戻り値の最後は新規作成したかどうか）"""
+        if not username or not username.strip():
+            return False, "名前を入力してください", None, False
+
+        username = username.strip()
+
+        try:
+            with track_query("get_or_create_user"):
+                async with self.pool.connection() as conn:
+                    async with deadline(conn, "write"):
+                        cur = await conn.execute(GET_OR_CREATE_USER_SQL, {"username": username}, prepare=True)
+                    user_data = await cur.fetchone()
+                    if not user_data:
+                        async with deadline(conn, "read"):
+                            cur = await conn.execute(SELECT_USER_SQL, {"username": username})
+                        user_data = await cur.fetchone()
+        except Exception as e:
+            if query_timeout_kind(e) or isinstance(e, PoolTimeout):
+                USER_AUTH_TOTAL.inc(action="get_or_create", result="timeout")
+                return False, BUSY_MESSAGE, None, False
+            USER_AUTH_TOTAL.inc(action="get_or_create", result="error")
+            return False, f"ユーザー情報の取得に失敗しました: {str(e)}", None, False
+
+        if not user_data:
+            # 競合した相手の行が読み直す前に消された場合
+            USER_AUTH_TOTAL.inc(action="get_or_create", result="error")
+            return False, RETRY_MESSAGE, None, False
+
+        created = user_data['created']
+        USER_AUTH_TOTAL.inc(action="get_or_create", result="created" if created else "existing")
+        return True, "登録が完了しました！" if created else "ログインしました！", User(
+            id=user_data['id'],
+            username=user_data['username'],
+            created_at=user_data['created_at']
+        ), created
+
+    async def login_user(self, username: str) -> tuple[bool, str, Optional[User], str]:
+        """ユーザーログイン（戻り値の最後は LOGIN_* の状態）"""
+        if not username or not username.strip():
+            return False, "名前を入力してください", None, LOGIN_INVALID
+
+        username = username.strip()
+
+        try:
+            with track_query("login_user"):
+                async with self.pool.connection() as conn:
+                    async with deadline(conn, "read"):
+                        cur = await conn.execute(LOGIN_USER_SQL, (username,), prepare=True)
+                    user_data = await cur.fetchone()
+        except Exception as e:
+            if query_timeout_kind(e) or isinstance(e, PoolTimeout):
+                USER_AUTH_TOTAL.inc(action="login", result=LOGIN_TIMEOUT)
+                return False, BUSY_MESSAGE, None, LOGIN_TIMEOUT
+            USER_AUTH_TOTAL.inc(action="login", result=LOGIN_ERROR)
+            return False, f"ログインに失敗しました: {str(e)}", None, LOGIN_ERROR
+
+        if not user_data:
+            USER_AUTH_TOTAL.inc(action="login", result=LOGIN_NOT_FOUND)
+            return False, "ユーザーが見つかりません", None, LOGIN_NOT_FOUND
+
+        USER_AUTH_TOTAL.inc(action="login", result=LOGIN_SUCCESS)
+        return True, "ログインしました！", User(
+            id=user_data['id'],
+            username=user_data['username'],
+            created_at=user_data['created_at']
+        ), LOGIN_SUCCESS
+
+
+class PipelinedTaskService(AsyncTaskService):
+    """ダッシュボードの複数クエリも1接続・1往復にまとめるタスクサービス"""
+
+    async def get_dashboard_snapshot(self, user_id: int, aggregates: bool = False) -> dict:
+        """進捗を取得（aggregates=True なら順位・タスク別達成人数と合わせた3クエリを1接続・1往復で取得）"""
+        if not aggregates:
+            return await super().get_dashboard_snapshot(user_id)
+        with track_query("get_dashboard_snapshot"):
+            async with self.pool.connection() as conn:
+                # 集計を含むので集計の予算で1トランザクションにまとめる
+                async with deadline(conn, "aggregate"):
+                    tasks_cur = await conn.execute(TASKS_WITH_PROGRESS_SQL, (user_id,), prepare=True)
+                    rank_cur = await conn.execute(USER_RANK_SQL, (user_id,), prepare=True)
+                    stats_cur = await conn.execute(TASK_COMPLETION_COUNTS_SQL, prepare=True)
+                tasks = await tasks_cur.fetchall()
+                rank = await rank_cur.fetchone()
+                stats = await stats_cur.fetchall()
+        return {
+            "tasks": tasks,
+            "rank": rank,
+            "task_stats": {row["task_id"]: row["completed_users"] for row in stats},
+        }
+
+
+class PipelinedUserService(AsyncUserService):
+    """重複チェックと登録を1文・1往復にまとめるユーザーサービス"""
+
+    async def register_user(self, username: str) -> tuple[bool, str, Optional[User]]:
+        """新規ユーザー登録（ON CONFLICT DO NOTHING で重複時は行が返らない）"""
+        if not username or not username.strip():
+            return False, "名前を入力してください", None
+
+        username = username.strip()
+
+        try:
+            with track_query("register_user"):
+                async with self.pool.connection() as conn:
+                    async with deadline(conn, "write"):
+                        cur = await conn.execute(
+                            "INSERT INTO users (username) VALUES (%s) "
+                            "ON CONFLICT (username) DO NOTHING RETURNING *",
+                            (username,)
+                        )
+                    user_data = await cur.fetchone()
+        except Exception as e:
+            if query_timeout_kind(e) or isinstance(e, PoolTimeout):
+                USER_AUTH_TOTAL.inc(action="register", result="timeout")
+                return False, BUSY_MESSAGE, None
+            USER_AUTH_TOTAL.inc(action="register", result="error")
+            return False, f"登録に失敗しました: {str(e)}", None
+
+        if not user_data:
+            USER_AUTH_TOTAL.inc(action="register", result="duplicate")
+            return False, "同じ名前のユーザーが既に存在します", None
+
+        USER_AUTH_TOTAL.inc(action="register", result="success")
+        return True, "登録が完了しました！", User(
+            id=user_data['id'],
+            username=user_data['username'],
+            created_at=user_data['created_at']
+        )
+
+
+class BlockingService:
+    """非同期サービスを同期メソッドとして呼べるようにするラッパー（ページからは従来と同じ使い方）"""
+
+    def __init__(self, service, runner: EventLoopThread, timeout: float = 30.0, breaker=None):
+        self._service = service
+        self._runner = runner
+        self._timeout = timeout
+        self._breaker = breaker or get_db_breaker()
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            # 接続できない場合はブレーカーに失敗として数え、ページ共通の例外にする
+            self._breaker.before_call()
+            try:
+                result = self._runner.run(attr(*args, **kwargs), self._timeout)
+            except PoolTimeout as e:
+                # プールが空かないのは混雑で、DBの障害ではないのでブレーカーには数えない
+                # （PoolTimeout は OperationalError のサブクラスなので先に捕まえる）
+                raise PoolExhaustedError(str(e)) from e
+            except psycopg.OperationalError as e:
+                if query_timeout_kind(e):
+                    # タイムアウトはDB自体は生きているのでブレーカーには数えない
+                    raise QueryTimeoutError(str(e)) from e
+                self._breaker.record_failure(e)
+                raise DatabaseUnavailableError(str(e)) from e
+            self._breaker.record_success()
+            return result
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+
+@st.cache_resource
+def get_async_backend() -> tuple[EventLoopThread, AsyncConnectionPool]:
+    """プロセス共有のイベントループと非同期接続プールを取得"""
+    try:
+        db_config = st.secrets.get("database", {})
+    except Exception:
+        db_config = {}
+    runner = EventLoopThread()
+    pool = create_async_pool(
+        min_size=int(db_config.get("async_pool_min", 1)),
+        max_size=int(db_config.get("async_pool_max", 10)),
+    )
+    runner.run(pool.open(wait=True))
+    return runner, pool
+
+
+@st.cache_resource
+def get_async_task_service() -> BlockingService:
+    """非同期バックエンドのタスクサービスを取得（テーブル作成は同期版に任せる）"""
+    from task_db import TaskService
+    TaskService()
+    runner, pool = get_async_backend()
+    service_class = PipelinedTaskService if get_db_backend() == "pipeline" else AsyncTaskService
+    return BlockingService(service_class(pool), runner)
+
+
+@st.cache_resource
+def get_async_user_service() -> BlockingService:
+    """非同期バックエンドのユーザーサービスを取得（テーブル作成は同期版に任せる）"""
+    from user import UserService
+    UserService()
+    runner, pool = get_async_backend()
+    service_class = PipelinedUserService if get_db_backend() == "pipeline" else AsyncUserService
+    return BlockingService(service_class(pool), runner)
@@ -6,5 +6,9 @@ Test and Debug Files
 ファイル一覧:
 - db_connection_test_prod.py: データベース接続テスト
 - network_debug_test.py: ネットワーク接続デバッグ
-- performance_test.py: パフォーマンステスト
+- benchmark.py: サービス層のベンチマーク（p50/p95/p99、ベースライン比較）
+- load_simulator.py: 参加者の同時アクセス負荷シミュレーター
+- apptest_load.py: Streamlit AppTest による複数セッションの負荷試験
+- query_replay.py: クエリトレース（query_trace.py）の再生
+- session_memory.py: セッションあたりのメモリ（tracemalloc）とセッション状態のキー別の内訳
 """
\ No newline at end of file
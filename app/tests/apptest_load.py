@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Streamlit AppTest による複数セッションの負荷試験
+サービス層の負荷試験（load_simulator.py）では見えない Streamlit 自体のコスト
+（スクリプトの再実行・セッション状態・要素のシリアライズ）を含めて測る。
+
+プロセスプールの各ワーカーが main.py の AppTest セッションを複数開いたまま、
+ログイン → ダッシュボード → ミッションを開く → 完了 → ランキング を
+セッションを順番に切り替えながら繰り返し、操作ごとの再実行時間と、
+セッションを開いたことによるワーカーのメモリ増加（RSS）を記録する。
+ワーカー数 × セッション数を段階的に増やして比較する。
+
+ダッシュボードへの移動はブラウザ側のタイマーで行われるので、ログインの計測には含まれない（dashboard で明示的に移動する）。
+メモリ増加は、各ワーカーで捨てるセッションを一巡させてモジュール読み込みなどを済ませてから測る。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/apptest_load.py --workers 4 --sessions 1,5,10 --rounds 3
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_DIR)
+
+from benchmark import prepare_schema, summarize
+from synthetic_attendees import username_for
+
+ACTIONS = ("login", "dashboard", "open_mission", "complete_mission", "ranking")
+MAIN_SCRIPT = os.path.join(APP_DIR, "main.py")
+
+
+def current_rss_bytes() -> int:
+    """このプロセスの現在の常駐メモリ（Linux 以外は最大値で代用）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Session:
+    """1つのブラウザセッションに相当する AppTest"""
+
+    def __init__(self, username: str, timeout: float):
+        from streamlit.testing.v1 import AppTest
+
+        self.username = username
+        self.app = AppTest.from_file(MAIN_SCRIPT, default_timeout=timeout)
+        self.open_task_id = None
+
+    def _button(self, key: str):
+        for button in self.app.button:
+            if button.key == key:
+                return button
+        return None
+
+    def login(self):
+        self.app.run()
+        self.app.text_input(key="user_name_input").input(self.username)
+        # 「遊びに行く！」（既存ユーザーのログイン）
+        next(b for b in self.app.button if b.label == "遊びに行く！").click().run()
+
+    def dashboard(self):
+        self.app.switch_page("pages/dashboard.py").run()
+
+    def open_mission(self) -> bool:
+        """未完了のSWTミッションを1つ開く（無ければ False）"""
+        for button in self.app.button:
+            if button.key and button.key.startswith("swt_btn_"):
+                self.open_task_id = button.key.rsplit("_", 1)[1]
+                button.click().run()
+                return True
+        return False
+
+    def complete_mission(self) -> bool:
+        button = self._button(f"complete_swt_{self.open_task_id}")
+        if button is None:
+            return False
+        button.click().run()
+        return True
+
+    def ranking(self):
+        self._button("top_nav_ranking").click().run()
+
+    @property
+    def exceptions(self) -> list[str]:
+        return [exception.message for exception in self.app.exception]
+
+
+def _timed(samples: dict, errors: dict, action: str, function):
+    start = time.perf_counter_ns()
+    try:
+        performed = function()
+    except Exception as e:
+        errors[action] = errors.get(action, 0) + 1
+        errors.setdefault("messages", []).append(f"{action}: {type(e).__name__}: {e}")
+        return False
+    if performed is not False:
+        samples.setdefault(action, []).append(time.perf_counter_ns() - start)
+    return performed is not False
+
+
+def run_worker(worker: int, sessions: int, rounds: int, attendees: int, timeout: float) -> dict:
+    """1ワーカー（1プロセス）分: sessions 個のセッションを開いたまま rounds 周する"""
+    # 各ワーカーがメトリクスサーバーのポートを取り合わないようにする
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    samples, errors = {}, {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        # モジュールの読み込みや初回の初期化をメモリ増加に含めないよう、捨てるセッションで一巡しておく
+        warmup = Session(username_for(1 + worker % attendees), timeout)
+        warmup.login()
+        warmup.dashboard()
+        warmup.ranking()
+        del warmup
+        gc.collect()
+        rss_start = current_rss_bytes()
+
+        opened = []
+        login_start = time.perf_counter()
+        for index in range(sessions):
+            session = Session(username_for(1 + (worker * 7919 + index * 104_729) % attendees), timeout)
+            if _timed(samples, errors, "login", session.login):
+                opened.append(session)
+        login_seconds = time.perf_counter() - login_start
+        rss_sessions = current_rss_bytes()
+
+        for _ in range(rounds):
+            for session in opened:
+                _timed(samples, errors, "dashboard", session.dashboard)
+                if _timed(samples, errors, "open_mission", session.open_mission):
+                    _timed(samples, errors, "complete_mission", session.complete_mission)
+                _timed(samples, errors, "ranking", session.ranking)
+                for message in session.exceptions:
+                    errors["script"] = errors.get("script", 0) + 1
+                    errors.setdefault("messages", []).append(message)
+    return {
+        "samples": samples,
+        "errors": errors,
+        "sessions": len(opened),
+        "login_seconds": login_seconds,
+        "rss_start": rss_start,
+        "rss_sessions": rss_sessions,
+        "rss_end": current_rss_bytes(),
+    }
+
+
+def run_level(workers: int, sessions: int, rounds: int, attendees: int, timeout: float = 60.0) -> dict:
+    """workers プロセス × sessions セッションで実行して集計する"""
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(run_worker, worker, sessions, rounds, attendees, timeout)
+            for worker in range(workers)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    actions = {}
+    for action in ACTIONS:
+        samples = [sample for result in results for sample in result["samples"].get(action, [])]
+        summary = summarize(samples) if len(samples) >= 2 else {"n": len(samples)}
+        summary["errors"] = sum(result["errors"].get(action, 0) for result in results)
+        actions[action] = summary
+    opened = sum(result["sessions"] for result in results)
+    session_growth = [
+        (result["rss_sessions"] - result["rss_start"]) / result["sessions"]
+        for result in results if result["sessions"]
+    ]
+    # 全ワーカーが並行してログインし終えるまでの時間あたりのログイン数
+    login_seconds = max(result["login_seconds"] for result in results)
+    reruns = sum(len(result["samples"].get(action, [])) for result in results for action in ACTIONS)
+    return {
+        "workers": workers,
+        "sessions_per_worker": sessions,
+        "sessions": opened,
+        "seconds": round(elapsed, 2),
+        "reruns_per_second": round(reruns / elapsed, 2),
+        "logins_per_second": round(opened / login_seconds, 2) if login_seconds else None,
+        "actions": actions,
+        "memory": {
+            "per_session_mb": round(sum(session_growth) / len(session_growth) / 2 ** 20, 2) if session_growth else None,
+            "worker_peak_mb": round(max(result["rss_end"] for result in results) / 2 ** 20, 1),
+        },
+        "script_errors": sum(result["errors"].get("script", 0) for result in results),
+        "error_messages": [m for result in results for m in result["errors"].get("messages", [])][:10],
+    }
+
+
+def format_level(level: dict) -> str:
+    memory = level["memory"]
+    lines = [
+        f"--- {level['workers']}プロセス × {level['sessions_per_worker']}セッション"
+        f"（計{level['sessions']}）: {level['seconds']}秒, {level['reruns_per_second']} 再実行/秒, "
+        f"{level['logins_per_second']} ログイン/秒, "
+        f"1セッションあたり {memory['per_session_mb']}MB, ワーカー最大 {memory['worker_peak_mb']}MB"
+    ]
+    for action, summary in level["actions"].items():
+        if "p50_ms" in summary:
+            lines.append(
+                f"  {action:<17} n={summary['n']:<5} p50={summary['p50_ms']:8.1f}ms "
+                f"p95={summary['p95_ms']:8.1f}ms p99={summary['p99_ms']:8.1f}ms errors={summary['errors']}"
+            )
+        else:
+            lines.append(f"  {action:<17} n={summary['n']} errors={summary['errors']}")
+    for message in level["error_messages"]:
+        lines.append(f"  ! {message}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-session AppTest load test")
+    parser.add_argument("--workers", type=int, default=2, help="プロセス数")
+    parser.add_argument("--sessions", default="1,5", help="ワーカーごとのセッション数（カンマ区切りで段階）")
+    parser.add_argument("--rounds", type=int, default=2, help="各セッションで操作を繰り返す周回数")
+    parser.add_argument("--attendees", type=int, default=10_000, help="登録済みの合成参加者数")
+    parser.add_argument("--schema", default="apptest", help="負荷試験用のスキーマ")
+    parser.add_argument("--timeout", type=float, default=60.0, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--json", help="結果を保存するJSONのパス")
+    args = parser.parse_args()
+
+    # spawn したワーカーにも引き継がれる
+    os.environ["DB_SCHEMA"] = args.schema
+    prepare_schema(args.schema, args.attendees)
+    levels = []
+    for sessions in (int(value) for value in args.sessions.split(",")):
+        level = run_level(args.workers, sessions, args.rounds, args.attendees, args.timeout)
+        levels.append(level)
+        print(format_level(level))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"attendees": args.attendees, "levels": levels}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+サービス層のベンチマーク
+合成参加者（synthetic_attendees.py）を入れた専用スキーマに対して、
+サービス生成・カタログ同期・ダッシュボード読み込み・完了登録・ランキング・ログインを
+ウォームアップ後に繰り返し実行し、perf_counter_ns で測った p50 / p95 / p99 を JSON に保存する。
+保存済みのベースラインと比べ、閾値を超えて遅くなったシナリオがあれば終了コード1で終わる。
+
+各シナリオの初回（ウォームアップの1回目）の時間も first_call_ms として記録する。
+サービス生成はプロセスで最初に実行するので、その初回がテーブル作成を含むコールドスタートになる。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/benchmark.py --attendees 100000 -n 500
+    DB_HOST=127.0.0.1 python tests/benchmark.py --save-baseline tests/benchmark_results/baseline.json
+    DB_HOST=127.0.0.1 python tests/benchmark.py --baseline tests/benchmark_results/baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_DIR)
+
+from synthetic_attendees import create_schema, load_attendees, username_for
+from task_db import TaskService, load_connection_params
+from tasks import load_tasks_from_yaml
+from user import UserService
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+
+# ベースラインより遅いとみなす割合と、ノイズとして無視する差（ミリ秒）
+DEFAULT_THRESHOLD = 0.20
+MIN_DELTA_MS = 0.05
+# 比較に使う統計量（p99 は揺れが大きいので記録のみ）
+COMPARED_STATS = ("p50_ms", "p95_ms")
+
+
+def summarize(samples_ns: list[int]) -> dict:
+    """ナノ秒のサンプルからミリ秒の統計量を作る（2件以上）"""
+    samples = sorted(sample / 1e6 for sample in samples_ns)
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "min_ms": round(samples[0], 4),
+        "p50_ms": round(cuts[49], 4),
+        "p95_ms": round(cuts[94], 4),
+        "p99_ms": round(cuts[98], 4),
+        "max_ms": round(samples[-1], 4),
+    }
+
+
+def measure(function, n: int, warmup: int) -> dict:
+    """warmup 回捨ててから n 回測る。例外は errors として数え、サンプルに含めない"""
+    samples = []
+    errors = 0
+    first_call_ns = None
+    for i in range(warmup + n):
+        start = time.perf_counter_ns()
+        try:
+            function(i)
+        except Exception:
+            errors += 1
+            continue
+        elapsed = time.perf_counter_ns() - start
+        if first_call_ns is None:
+            first_call_ns = elapsed
+        if i >= warmup:
+            samples.append(elapsed)
+    result = summarize(samples) if len(samples) >= 2 else {"n": len(samples)}
+    result["errors"] = errors
+    result["first_call_ms"] = round(first_call_ns / 1e6, 4) if first_call_ns is not None else None
+    return result
+
+
+def build_scenarios(attendees: int) -> list:
+    """(シナリオ名, 測る関数を返すファクトリー) のリスト。実行順に並べる
+
+    ファクトリーは測定の直前に呼ぶので、サービス生成だけはプロセス最初の生成を含む。
+    """
+    tasks = load_tasks_from_yaml(os.path.join(APP_DIR, "tasks.yml"))
+    task_ids = [task["id"] for task in tasks]
+
+    def user_id(i: int) -> int:
+        # 連番だとキャッシュに乗りやすいので散らす
+        return 1 + (i * 7919) % attendees
+
+    def service_construction():
+        return lambda i: (TaskService(), UserService())
+
+    def catalog_sync():
+        service = TaskService()
+        return lambda i: service.bulk_insert_tasks_if_not_exists(tasks)
+
+    def dashboard_load():
+        service = TaskService()
+        return lambda i: service.get_dashboard_snapshot(user_id(i))
+
+    def completion():
+        service = TaskService()
+        return lambda i: service.mark_task_complete_and_count(task_ids[i % len(task_ids)], user_id(i))
+
+    def ranking():
+        service = TaskService()
+        return lambda i: service.get_user_ranking()
+
+    def login():
+        service = UserService()
+        return lambda i: service.login_user(username_for(user_id(i)))
+
+    return [
+        ("service_construction", service_construction),
+        ("catalog_sync", catalog_sync),
+        ("dashboard_load", dashboard_load),
+        ("ranking", ranking),
+        ("login", login),
+        # 書き込みは読み取りの測定に影響しないよう最後
+        ("completion", completion),
+    ]
+
+
+def prepare_schema(schema: str, attendees: int, reseed: bool = False):
+    """schema に合成参加者を用意する（人数が違うか reseed のときだけ入れ直す）
+
+    前回の完了登録で更新された行が Index Only Scan を遅くしないよう、毎回 VACUUM ANALYZE する。
+    """
+    conn = psycopg2.connect(**load_connection_params())
+    try:
+        create_schema(conn, schema)
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM users")
+            existing = cur.fetchone()[0]
+        if reseed or existing != attendees:
+            load_attendees(conn, attendees, replace=True)
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE users, tasks, progress")
+    finally:
+        conn.close()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _server_version():
+    conn = psycopg2.connect(**load_connection_params())
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SHOW server_version")
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_benchmarks(attendees: int, n: int = 200, warmup: int = 20, only=None, log=print) -> dict:
+    """全シナリオを測って結果（meta と results）を返す。DB_SCHEMA のスキーマを使う"""
+    results = {}
+    for name, factory in build_scenarios(attendees):
+        if only and name not in only:
+            continue
+        # サービスやDB初期化のログで出力が埋もれないよう、測定中の print は捨てる
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = measure(factory(), n, warmup)
+        log(format_result(name, results[name]))
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "postgres": _server_version(),
+            "schema": os.getenv("DB_SCHEMA"),
+            "attendees": attendees,
+            "n": n,
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    if "p50_ms" not in result:
+        return f"{name:<22} 測定できませんでした（errors={result['errors']}）"
+    line = (f"{name:<22} p50={result['p50_ms']:8.3f}ms  p95={result['p95_ms']:8.3f}ms  "
+            f"p99={result['p99_ms']:8.3f}ms  first={result['first_call_ms']:8.3f}ms")
+    if result["errors"]:
+        line += f"  errors={result['errors']}"
+    return line
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD,
+                    min_delta_ms: float = MIN_DELTA_MS) -> list[str]:
+    """ベースラインから回帰したシナリオの説明を返す（空なら問題なし）"""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if result["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: errors {base.get('errors', 0)} -> {result['errors']}")
+        for stat in COMPARED_STATS:
+            if stat not in base or stat not in result:
+                continue
+            before, after = base[stat], result[stat]
+            if after > before * (1 + threshold) and after - before > min_delta_ms:
+                regressions.append(
+                    f"{name}: {stat} {before:.3f}ms -> {after:.3f}ms (+{after / before - 1:.0%})"
+                )
+    return regressions
+
+
+def write_results(results: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="service benchmark")
+    parser.add_argument("-n", type=int, default=200, help="シナリオごとの測定回数")
+    parser.add_argument("--warmup", type=int, default=20, help="捨てるウォームアップの回数")
+    parser.add_argument("--attendees", type=int, default=10_000, help="合成参加者の人数")
+    parser.add_argument("--schema", default="bench", help="ベンチマーク用のスキーマ")
+    parser.add_argument("--reseed", action="store_true", help="参加者データを入れ直す")
+    parser.add_argument("--scenario", action="append", help="対象のシナリオ（複数可）")
+    parser.add_argument("--output", help="結果のJSON（既定は benchmark_results/ に日時付きで保存）")
+    parser.add_argument("--baseline", help="比較するベースラインのJSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="回帰とみなす増加率")
+    parser.add_argument("--save-baseline", help="結果をベースラインとしても保存するパス")
+    args = parser.parse_args()
+
+    os.environ["DB_SCHEMA"] = args.schema
+    prepare_schema(args.schema, args.attendees, args.reseed)
+    print(f"=== ベンチマーク（schema={args.schema}、参加者{args.attendees:,}人、{args.n}回） ===")
+    results = run_benchmarks(args.attendees, args.n, args.warmup, args.scenario)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    write_results(results, output)
+    print(f"結果: {output}")
+    if args.save_baseline:
+        write_results(results, args.save_baseline)
+        print(f"ベースライン: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.threshold)
+        if regressions:
+            print(f"ベースラインから {args.threshold:.0%} 以上遅くなったシナリオ:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("ベースラインからの回帰はありません")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+ミッション完了 write-behind のベンチマーク
+キーノート直後のように多数の参加者が一斉に完了する状況を、スレッドで模擬して
+従来の mark_task_complete（1件ごとに接続・トランザクション）と
+CompletionWriter（キューに積み、まとめて複数行INSERT）のスループットを比較する。
+
+ローカルのPostgreSQLが必要（DB_HOST などの環境変数で指定）。
+書き込んだ行はベンチマーク用のユーザーID範囲で作り、終了時に削除する。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/completion_writer_benchmark.py --threads 32 --completions 2000
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from completion_writer import CompletionWriter
+from task_db import TaskService, load_connection_params
+from tasks import load_tasks_from_yaml
+
+BASE_USER_ID = 800_000_000
+
+
+def cleanup(params: dict):
+    with psycopg2.connect(**params) as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM progress WHERE user_id >= %s AND user_id < %s",
+                        (BASE_USER_ID, BASE_USER_ID + 100_000_000))
+        conn.commit()
+
+
+def run(label: str, complete, completions: list, threads: int, finish=None):
+    """completions を threads 並列で完了させ、スループットを表示"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(lambda args: timed(complete, *args), completions))
+    if finish:
+        finish()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{label}: {len(completions) / elapsed:,.0f}件/秒 "
+          f"(合計 {elapsed:.2f}秒, 応答 p50={latencies[len(latencies) // 2]:.2f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)]:.2f}ms)")
+
+
+def timed(complete, task_id: int, user_id: int) -> float:
+    start = time.perf_counter()
+    complete(task_id, user_id)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_benchmark(threads: int, n: int):
+    params = load_connection_params()
+    tasks = load_tasks_from_yaml(os.path.join(os.path.dirname(os.path.dirname(__file__)), "tasks.yml"))
+    TaskService().bulk_insert_tasks_if_not_exists(tasks)
+    task_ids = [task["id"] for task in tasks]
+    print(f"=== 完了書き込みベンチマーク（{n}件、{threads}並列） ===")
+    cleanup(params)
+
+    try:
+        # 参加者ごとに1件ずつ、同じタスク（キーノート）を一斉に完了する
+        sync_completions = [(task_ids[0], BASE_USER_ID + i) for i in range(n)]
+        run("同期（1件ずつ接続）", TaskService().mark_task_complete, sync_completions, threads)
+
+        writer = CompletionWriter(params)
+        writer.start()
+        wb_completions = [(task_ids[1], BASE_USER_ID + i) for i in range(n)]
+        run("write-behind       ", writer.submit, wb_completions, threads,
+            finish=lambda: writer.flush(timeout=60))
+        writer.close()
+
+        with psycopg2.connect(**params) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT task_id, COUNT(*) FROM progress WHERE user_id >= %s GROUP BY task_id",
+                            (BASE_USER_ID,))
+                print(f"書き込み済み行数: {dict(cur.fetchall())}")
+    finally:
+        cleanup(params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write-behind completion benchmark")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--completions", type=int, default=2000)
+    args = parser.parse_args()
+    run_benchmark(args.threads, args.completions)
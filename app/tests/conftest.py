@@ -0,0 +1,95 @@
+"""
+pytest 共通フィクスチャ
+"""
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (APP_DIR, TESTS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from slack_stub_server import SlackStubServer
+
+
+@pytest.fixture(autouse=True)
+def reset_db_breaker(monkeypatch):
+    """プロセス共有のDBサーキットブレーカーをテストごとに作り直す（他のテストの接続失敗を持ち越さない）"""
+    import circuit_breaker
+    monkeypatch.setattr(circuit_breaker, "_DB_BREAKER", None)
+
+
+@pytest.fixture
+def make_slack_stub():
+    """設定付きでWebhookスタブを起動するファクトリー（テスト終了時に停止）"""
+    servers = []
+
+    def factory(**options) -> SlackStubServer:
+        stub = SlackStubServer(**options).start()
+        servers.append(stub)
+        return stub
+
+    yield factory
+    for stub in servers:
+        stub.stop()
+
+
+@pytest.fixture
+def slack_stub(make_slack_stub):
+    """常に200を返すWebhookスタブ"""
+    return make_slack_stub()
+
+
+@pytest.fixture
+def make_slack_client(monkeypatch):
+    """スタブを向いたSlackClientを作るファクトリー（ローカルのレート制限は緩める）"""
+    from slack_client import SlackClient, TokenBucket
+
+    clients = []
+
+    def factory(stub: SlackStubServer, rate: float = 1000.0, burst: float = 1000.0):
+        monkeypatch.setenv("SLACK_WEBHOOK_URL", stub.url)
+        client = SlackClient()
+        client.webhook_url = stub.url
+        client.rate_limiter = TokenBucket(rate=rate, capacity=burst)
+        clients.append(client)
+        return client
+
+    yield factory
+    for client in clients:
+        client.session.close()
+
+
+@pytest.fixture
+def slack_client(slack_stub, make_slack_client):
+    """slack_stub を向いたSlackClient"""
+    return make_slack_client(slack_stub)
+
+
+@pytest.fixture(scope="session")
+def pg_params():
+    """ローカルPostgreSQLの接続パラメータ（接続できなければDBを使うテストはスキップ）"""
+    import psycopg2
+    from task_db import load_connection_params
+
+    params = load_connection_params()
+    params["connect_timeout"] = 2
+    try:
+        psycopg2.connect(**params).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL に接続できません: {e}")
+    return params
+
+
+@pytest.fixture(scope="session")
+def pg_task_ids(pg_params):
+    """tasks.yml をDBに同期し、タスクIDの一覧を返す"""
+    from task_db import TaskService
+    from tasks import load_tasks_from_yaml
+
+    tasks = load_tasks_from_yaml(os.path.join(APP_DIR, "tasks.yml"))
+    TaskService().bulk_insert_tasks_if_not_exists(tasks)
+    return [task["id"] for task in tasks]
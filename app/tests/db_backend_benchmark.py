@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+DBバックエンドのベンチマーク（sync / async）
+ダッシュボード1回の再実行で行う取得（進捗・順位・タスク別達成人数）の所要時間を比較する
+
+同期版は3クエリを1本ずつ新規接続で実行、非同期版はプール済み接続で並行に実行する。
+ローカルのPostgreSQLが必要（DB_HOST などの環境変数で指定）。
+
+実行例:
+    DB_HOST=localhost python tests/db_backend_benchmark.py 200
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from task_db import TaskService, load_connection_params
+from task_db_async import AsyncTaskService, BlockingService, EventLoopThread, create_async_pool
+from user import UserService
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def measure(fetch, user_id: int, n: int) -> list[float]:
+    """n回スナップショットを取得して各回の所要時間（ミリ秒）を返す"""
+    for _ in range(5):
+        fetch(user_id)  # ウォームアップ
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fetch(user_id)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label: str, samples: list[float]):
+    print(f"{label}: p50={statistics.median(samples):.2f}ms "
+          f"p95={percentile(samples, 0.95):.2f}ms p99={percentile(samples, 0.99):.2f}ms")
+
+
+def run_benchmark(n: int = 200):
+    params = load_connection_params()
+    print(f"=== DBバックエンド ベンチマーク（{params['host']}:{params['port']}、{n}回） ===")
+
+    TaskService()
+    user_service = UserService()
+    username = "benchmark_user"
+    ok, _, user, _ = user_service.login_user(username)
+    if not ok:
+        ok, message, user = user_service.register_user(username)
+        if not ok:
+            raise RuntimeError(message)
+
+    sync_service = TaskService()
+    report("sync  (逐次・接続ごと)", measure(lambda user_id: sync_service.get_dashboard_snapshot(user_id, aggregates=True), user.id, n))
+
+    runner = EventLoopThread()
+    pool = create_async_pool(params, min_size=3, max_size=3)
+    runner.run(pool.open(wait=True))
+    try:
+        service = BlockingService(AsyncTaskService(pool), runner)
+        report("async (並行・プール)  ", measure(lambda user_id: service.get_dashboard_snapshot(user_id, aggregates=True), user.id, n))
+    finally:
+        runner.run(pool.close())
+        runner.stop()
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+遅延注入TCPプロキシ
+PostgreSQLとの間に挟み、片道ごとに一定の遅延を加えて会場Wi-Fiやリモートの
+DBを模擬する（tc を使えない環境向け）。往復回数も数える。
+
+往復回数は「サーバーからの応答を受け取った後、クライアントが次に送信した回数」
+として数える（パイプラインでまとめて送った文は1往復になる）。
+
+起動例:
+    python tests/latency_proxy.py --target-port 5432 --port 6543 --delay 0.01
+    DB_HOST=127.0.0.1 DB_PORT=6543 python -m streamlit run main.py
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+
+class LatencyProxy:
+    """別スレッドで動く遅延プロキシ（with文で起動・停止）"""
+
+    def __init__(self, target_host: str = "127.0.0.1", target_port: int = 5432,
+                 host: str = "127.0.0.1", port: int = 0, delay: float = 0.01):
+        """
+        Args:
+            delay: 片道あたりの遅延（秒）。往復遅延はこの2倍になる
+        """
+        self.target_host = target_host
+        self.target_port = target_port
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.round_trips = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._writers = set()
+
+    def reset(self):
+        """往復回数・接続数をリセット"""
+        with self._lock:
+            self.round_trips = 0
+            self.connections = 0
+
+    async def _pipe(self, reader, writer, state: dict, upstream: bool):
+        """一方向の転送（受信時刻+遅延で順番に書き出す）"""
+        queue = asyncio.Queue()
+
+        async def forward():
+            while True:
+                due, data = await queue.get()
+                if data is None:
+                    break
+                wait = due - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+            writer.close()
+
+        forwarder = asyncio.ensure_future(forward())
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if upstream:
+                    # 応答を受け取った後の最初の送信を1往復と数える
+                    if state["awaiting_request"]:
+                        state["awaiting_request"] = False
+                        with self._lock:
+                            self.round_trips += 1
+                else:
+                    state["awaiting_request"] = True
+                queue.put_nowait((time.monotonic() + self.delay, data))
+        except ConnectionError:
+            pass
+        finally:
+            queue.put_nowait((0, None))
+            await forwarder
+
+    async def _handle(self, client_reader, client_writer):
+        with self._lock:
+            self.connections += 1
+        try:
+            server_reader, server_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+        state = {"awaiting_request": True}
+        self._writers.update((client_writer, server_writer))
+        try:
+            await asyncio.gather(
+                self._pipe(client_reader, server_writer, state, upstream=True),
+                self._pipe(server_reader, client_writer, state, upstream=False),
+                return_exceptions=True,
+            )
+        finally:
+            self._writers.difference_update((client_writer, server_writer))
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        # 残っている転送を打ち切ってから閉じる（接続が開いたままでも止まるように）
+        self._server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+        pending = asyncio.all_tasks(self._loop)
+        self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self._loop.close()
+
+    def start(self):
+        """プロキシを起動"""
+        self._thread = threading.Thread(target=self._run, name="latency-proxy", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        """プロキシを停止"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP latency injection proxy")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6543)
+    parser.add_argument("--target-host", default="127.0.0.1")
+    parser.add_argument("--target-port", type=int, default=5432)
+    parser.add_argument("--delay", type=float, default=0.01, help="片道の遅延（秒）")
+    args = parser.parse_args()
+
+    proxy = LatencyProxy(args.target_host, args.target_port, args.host, args.port, args.delay)
+    with proxy:
+        print(f"latency proxy {args.host}:{proxy.port} -> {args.target_host}:{args.target_port} "
+              f"(RTT +{args.delay * 2000:.0f}ms)")
+        try:
+            while True:
+                time.sleep(5)
+                print(f"connections={proxy.connections} round_trips={proxy.round_trips}")
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
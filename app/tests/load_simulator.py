@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+参加者の同時アクセス負荷シミュレーター
+仮想参加者をスレッドで同時に動かし、ページと同じサービス関数を
+ログイン → ダッシュボード → ミッション完了 → ランキング → 投稿 の順に呼ぶ。
+同時接続数を段階的に増やし、段階ごとにスループット・操作別のレイテンシ（p50/p95/p99）・
+接続プールの待ち時間・エラー率を報告する。
+
+DBは合成参加者（synthetic_attendees.py）を入れた専用スキーマ、Slackはローカルのスタブを使う。
+DBバックエンド（sync / async / pipeline）や write-behind は通常どおり secrets / 環境変数で切り替わる。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/load_simulator.py --ramp 10,50,100,300 --step-seconds 20
+    DB_HOST=127.0.0.1 DB_POOL_MAX=30 python tests/load_simulator.py --ramp 300 --json result.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_DIR)
+
+from benchmark import prepare_schema, summarize
+from metrics import DB_POOL_WAIT_SECONDS, DB_QUERY_TIMEOUTS
+from slack_stub_server import SlackStubServer
+from synthetic_attendees import username_for
+
+OPERATIONS = ("login", "dashboard", "complete", "ranking", "post")
+
+# 投稿本文の材料（同じ文面ばかりだと重複投稿として弾かれるので組み合わせる）
+POST_SUBJECTS = ("キーノート", "スポンサーブース", "ハンズオン", "Snowpark", "Cortex", "Iceberg", "懇親会", "Expo")
+POST_QUESTIONS = (
+    "{}の資料はどこで見られますか？",
+    "{}で紹介されていた機能はもう使えますか？",
+    "{}の会場はどこですか？混んでいますか？",
+    "{}についてもっと詳しく聞きたいです。",
+)
+
+
+class StepStats:
+    """1段階分の集計（スレッドセーフ）"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, elapsed_ns: int):
+        with self._lock:
+            self.latencies[operation].append(elapsed_ns)
+
+    def record_error(self, operation: str, error: BaseException):
+        with self._lock:
+            self.errors[operation][type(error).__name__] += 1
+
+    def count(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+
+class Attendee:
+    """1人の仮想参加者（ページと同じサービス関数を順に呼ぶ）"""
+
+    def __init__(self, rng: random.Random, attendees: int, walk_in_rate: float, post_rate: float,
+                 think_time: float):
+        self.rng = rng
+        self.attendees = attendees
+        self.walk_in_rate = walk_in_rate
+        self.post_rate = post_rate
+        self.think_time = think_time
+
+    def _timed(self, stats: StepStats, operation: str, function, *args):
+        start = time.perf_counter_ns()
+        try:
+            result = function(*args)
+        except Exception as e:
+            stats.record_error(operation, e)
+            raise
+        stats.record(operation, time.perf_counter_ns() - start)
+        return result
+
+    def _think(self, stop: threading.Event):
+        if self.think_time:
+            stop.wait(self.rng.uniform(0.5, 1.5) * self.think_time)
+
+    def run_session(self, stats: StepStats, stop: threading.Event):
+        """1セッション分の操作（途中で失敗したらそのセッションは打ち切り）"""
+        from circuit_breaker import get_read_only_cache
+        from moderation import ACTION_HOLD, ACTION_REJECT, get_flood_guard, moderate
+        from slack_outbox import STATUS_HELD, STATUS_QUEUED, get_slack_outbox
+        from task_db import get_task_service
+        from user import get_user_service
+
+        # ログイン（launch_screen.handle_submit）: 一部は当日登録の新規参加者
+        if self.rng.random() < self.walk_in_rate:
+            name = f"walkin-{threading.get_ident()}-{self.rng.randrange(10 ** 9)}"
+            success, _, user, _ = self._timed(
+                stats, "login", lambda: get_user_service().get_or_create_user(name))
+        else:
+            name = username_for(self.rng.randrange(1, self.attendees + 1))
+            success, _, user, _ = self._timed(stats, "login", lambda: get_user_service().login_user(name))
+        if not success:
+            stats.count("login_failed")
+            return
+        self._think(stop)
+
+        # ダッシュボード（pages/dashboard.main）
+        def load_dashboard():
+            task_service = get_task_service()
+            snapshot = task_service.get_dashboard_snapshot(user.id)
+            get_read_only_cache().remember_snapshot(user.id, snapshot)
+            return task_service, snapshot
+
+        task_service, snapshot = self._timed(stats, "dashboard", load_dashboard)
+        self._think(stop)
+
+        # ミッション完了（complete_mission）→ 完了後の再実行でダッシュボードを読み直す
+        remaining = [task["id"] for task in snapshot["tasks"] if not task["completed"]]
+        for task_id in self.rng.sample(remaining, min(len(remaining), self.rng.randint(1, 3))):
+            self._timed(stats, "complete", task_service.mark_task_complete_and_count, task_id, user.id)
+            snapshot = self._timed(stats, "dashboard", lambda: load_dashboard()[1])
+            self._think(stop)
+
+        # ランキング（pages/ranking.display_ranking）
+        ranking = self._timed(stats, "ranking", lambda: get_task_service().get_user_ranking())
+        get_read_only_cache().remember_ranking(ranking)
+        self._think(stop)
+
+        # 投稿（pages/post.handle_form_submission）
+        if self.rng.random() < self.post_rate:
+            message = self.rng.choice(POST_QUESTIONS).format(self.rng.choice(POST_SUBJECTS))
+            message += f"（{self.rng.randrange(1, 10_000)}）"
+
+            def post():
+                result = moderate(message)
+                if result.action == ACTION_REJECT:
+                    return "post_rejected"
+                flood_guard = get_flood_guard()
+                flood_result = flood_guard.check_and_record(user.id, message)
+                if not flood_result.allowed:
+                    return "post_flood_limited"
+                status = STATUS_HELD if result.action == ACTION_HOLD else STATUS_QUEUED
+                try:
+                    get_slack_outbox().enqueue(message, status=status)
+                except Exception:
+                    flood_guard.cancel(flood_result.record)
+                    raise
+                return "post_accepted"
+
+            stats.count(self._timed(stats, "post", post))
+        stats.count("session_completed")
+
+
+def _pool_wait_state():
+    state = DB_POOL_WAIT_SECONDS._values.get(())
+    if state is None:
+        return [0] * len(DB_POOL_WAIT_SECONDS.buckets), 0.0, 0
+    return list(state["counts"]), state["sum"], state["count"]
+
+
+def pool_wait_summary(before, after) -> dict:
+    """DB_POOL_WAIT_SECONDS の差分から、待ち回数・平均・p95（バケットの上限）を出す"""
+    counts = [b - a for a, b in zip(before[0], after[0])]
+    total = after[2] - before[2]
+    if total == 0:
+        return {"count": 0, "mean_ms": 0.0, "p95_le_ms": 0.0}
+    cumulative = 0
+    p95_bound = DB_POOL_WAIT_SECONDS.buckets[-1]
+    for bound, count in zip(DB_POOL_WAIT_SECONDS.buckets, counts):
+        cumulative += count
+        if cumulative >= total * 0.95:
+            p95_bound = bound
+            break
+    return {
+        "count": total,
+        "mean_ms": round((after[1] - before[1]) / total * 1000, 3),
+        "p95_le_ms": p95_bound * 1000,
+    }
+
+
+def _timeouts_total() -> float:
+    return sum(DB_QUERY_TIMEOUTS._values.values())
+
+
+def run_step(concurrency: int, seconds: float, attendees: int, seed: int = 0, walk_in_rate: float = 0.1,
+             post_rate: float = 0.3, think_time: float = 0.0) -> dict:
+    """concurrency 人を seconds 秒間動かして集計を返す"""
+    stats = StepStats()
+    stop = threading.Event()
+    pool_before = _pool_wait_state()
+    timeouts_before = _timeouts_total()
+
+    def worker(index: int):
+        attendee = Attendee(random.Random(seed * 100_003 + index), attendees, walk_in_rate,
+                            post_rate, think_time)
+        while not stop.is_set():
+            try:
+                attendee.run_session(stats, stop)
+            except Exception:
+                stats.count("session_failed")
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    operations = {}
+    for operation in OPERATIONS:
+        samples = stats.latencies.get(operation, [])
+        failed = sum(stats.errors[operation].values())
+        summary = summarize(samples) if len(samples) >= 2 else {"n": len(samples)}
+        summary["errors"] = dict(stats.errors[operation])
+        summary["error_rate"] = round(failed / (len(samples) + failed), 4) if samples or failed else 0.0
+        operations[operation] = summary
+    total_ops = sum(len(samples) for samples in stats.latencies.values())
+    sessions = stats.outcomes.pop("session_completed", 0)
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "sessions": sessions,
+        "sessions_per_second": round(sessions / elapsed, 2),
+        "operations_per_second": round(total_ops / elapsed, 2),
+        "outcomes": dict(stats.outcomes),
+        "operations": operations,
+        "pool_wait": pool_wait_summary(pool_before, _pool_wait_state()),
+        "query_timeouts": int(_timeouts_total() - timeouts_before),
+    }
+
+
+def format_step(step: dict) -> str:
+    lines = [
+        f"--- 同時 {step['concurrency']}人 / {step['seconds']}秒: "
+        f"{step['sessions_per_second']} セッション/秒, {step['operations_per_second']} 操作/秒, "
+        f"プール待ち 平均{step['pool_wait']['mean_ms']}ms (p95≤{step['pool_wait']['p95_le_ms']:g}ms), "
+        f"タイムアウト {step['query_timeouts']}件"
+    ]
+    for operation, summary in step["operations"].items():
+        if "p50_ms" in summary:
+            lines.append(
+                f"  {operation:<10} n={summary['n']:<6} p50={summary['p50_ms']:8.2f}ms "
+                f"p95={summary['p95_ms']:8.2f}ms p99={summary['p99_ms']:8.2f}ms "
+                f"errors={summary['error_rate']:.1%}"
+            )
+        else:
+            lines.append(f"  {operation:<10} n={summary['n']}")
+        if summary["errors"]:
+            lines.append(f"             {summary['errors']}")
+    if step["outcomes"]:
+        lines.append(f"  outcomes: {step['outcomes']}")
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def slack_stub(latency: float = 0.05):
+    """Slackスタブを起動し、アプリの送信先をそこに向ける"""
+    with SlackStubServer(latency=latency) as stub:
+        previous = os.environ.get("SLACK_WEBHOOK_URL")
+        os.environ["SLACK_WEBHOOK_URL"] = stub.url
+        try:
+            yield stub
+        finally:
+            if previous is None:
+                os.environ.pop("SLACK_WEBHOOK_URL", None)
+            else:
+                os.environ["SLACK_WEBHOOK_URL"] = previous
+
+
+def run_ramp(ramp: list[int], seconds: float, attendees: int, log=print, **options) -> dict:
+    """段階ごとに run_step を実行し、Slackスタブが受け取った件数も含めて返す"""
+    steps = []
+    with slack_stub() as stub:
+        for index, concurrency in enumerate(ramp):
+            # サービス初期化やDB接続のログで集計が埋もれないよう print は捨てる
+            with contextlib.redirect_stdout(io.StringIO()):
+                step = run_step(concurrency, seconds, attendees, seed=index, **options)
+            steps.append(step)
+            log(format_step(step))
+        delivered = len(stub.messages)
+    return {"attendees": attendees, "steps": steps, "slack_messages_received": delivered}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="attendee load simulator")
+    parser.add_argument("--ramp", default="10,50,100", help="段階ごとの同時参加者数（カンマ区切り）")
+    parser.add_argument("--step-seconds", type=float, default=15.0, help="1段階の秒数")
+    parser.add_argument("--attendees", type=int, default=10_000, help="登録済みの合成参加者数")
+    parser.add_argument("--schema", default="loadtest", help="負荷試験用のスキーマ")
+    parser.add_argument("--reseed", action="store_true", help="参加者データを入れ直す")
+    parser.add_argument("--think-time", type=float, default=0.2, help="操作間の平均待ち（秒）")
+    parser.add_argument("--walk-in-rate", type=float, default=0.1, help="新規登録する参加者の割合")
+    parser.add_argument("--post-rate", type=float, default=0.3, help="投稿する参加者の割合")
+    parser.add_argument("--json", help="結果を保存するJSONのパス")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ["DB_SCHEMA"] = args.schema
+    prepare_schema(args.schema, args.attendees, args.reseed)
+    ramp = [int(value) for value in args.ramp.split(",")]
+    print(f"=== 負荷シミュレーション（schema={args.schema}、参加者{args.attendees:,}人、段階 {ramp}） ===")
+    result = run_ramp(
+        ramp, args.step_seconds, args.attendees,
+        think_time=args.think_time, walk_in_rate=args.walk_in_rate, post_rate=args.post_rate,
+    )
+    print(f"Slackスタブが受け取った投稿: {result['slack_messages_received']}件")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+NGワードフィルターのベンチマーク
+10,000語のワードリストでオートマトンを構築し、2000文字の投稿1件の判定時間を計測する
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from moderation import NgWordFilter, normalize_text
+
+HIRAGANA = [chr(code) for code in range(ord("ぁ"), ord("ゖ") + 1)]
+KATAKANA = [chr(code) for code in range(ord("ァ"), ord("ヶ") + 1)]
+KANJI = list("雪村技術質問会場登壇資料分析基盤移行性能検証運用設計事例参加展示")
+ASCII = list("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
+
+
+def random_words(rng: random.Random, n: int) -> list[str]:
+    """3〜7文字のランダムな語をn個生成"""
+    alphabet = HIRAGANA + KATAKANA + KANJI
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 7))) for _ in range(n)]
+
+
+def random_post(rng: random.Random, length: int = 2000) -> str:
+    """日本語主体の投稿本文を生成"""
+    alphabet = HIRAGANA * 4 + KATAKANA + KANJI * 2 + ASCII + [" ", "、", "。", "\n"]
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def run_benchmark(words: int = 10_000, posts: int = 200, repeat: int = 5):
+    rng = random.Random(42)
+    word_list = random_words(rng, words)
+    reject, hold = word_list[: words // 2], word_list[words // 2:]
+
+    print(f"=== NGワードフィルター ベンチマーク（{words}語） ===")
+    start = time.perf_counter()
+    ng_filter = NgWordFilter(reject_words=reject, hold_words=hold)
+    print(f"オートマトン構築: {(time.perf_counter() - start) * 1000:.1f}ms（状態数 {len(ng_filter._matcher)}）")
+
+    bodies = [random_post(rng) for _ in range(posts)]
+    # 一部の投稿にはNGワードを混ぜる
+    for i in range(0, posts, 10):
+        position = rng.randrange(len(bodies[i]))
+        bodies[i] = bodies[i][:position] + rng.choice(reject) + bodies[i][position:]
+
+    for body in bodies[:10]:
+        ng_filter.scan(body)  # ウォームアップ
+
+    normalize_samples = []
+    scan_samples = []
+    decisions = {}
+    for _ in range(repeat):
+        for body in bodies:
+            start = time.perf_counter_ns()
+            normalize_text(body, fold_kana=False)
+            normalize_samples.append((time.perf_counter_ns() - start) / 1000)
+
+            start = time.perf_counter_ns()
+            result = ng_filter.scan(body)
+            scan_samples.append((time.perf_counter_ns() - start) / 1000)
+            decisions[result.action] = decisions.get(result.action, 0) + 1
+
+    print(f"正規化のみ（2000文字）: p50={statistics.median(normalize_samples):.1f}µs "
+          f"p95={percentile(normalize_samples, 0.95):.1f}µs")
+    print(f"判定（正規化+照合）  : p50={statistics.median(scan_samples):.1f}µs "
+          f"p95={percentile(scan_samples, 0.95):.1f}µs p99={percentile(scan_samples, 0.99):.1f}µs")
+    print(f"判定結果: {decisions}")
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+パイプラインモードのベンチマーク
+遅延注入プロキシ（既定: 片道10ms = RTT 20ms）越しに、登録・完了登録+完了数・
+ダッシュボード取得の所要時間と往復回数を sync / async / pipeline で比較する。
+
+sync は従来どおり操作ごとに新規接続するため、接続確立の往復も含む。
+ローカルのPostgreSQLが必要（DB_HOST などの環境変数で指定）。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/pipeline_benchmark.py --delay 0.01 -n 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.dirname(__file__))
+
+from latency_proxy import LatencyProxy
+from task_db import TaskService, load_connection_params
+from tasks import load_tasks_from_yaml
+from task_db_async import (
+    AsyncTaskService, AsyncUserService, BlockingService, EventLoopThread,
+    PipelinedTaskService, PipelinedUserService, create_async_pool,
+)
+from user import UserService
+
+
+def measure(proxy: LatencyProxy, operation, n: int) -> tuple[float, float]:
+    """n回実行して (p50ミリ秒, 1回あたりの往復回数) を返す"""
+    operation(0)  # ウォームアップ
+    samples = []
+    proxy.reset()
+    for i in range(1, n + 1):
+        start = time.perf_counter()
+        operation(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), proxy.round_trips / n
+
+
+def run_benchmark(delay: float, n: int):
+    params = load_connection_params()
+    UserService()
+    tasks = load_tasks_from_yaml(os.path.join(os.path.dirname(os.path.dirname(__file__)), "tasks.yml"))
+    TaskService().bulk_insert_tasks_if_not_exists(tasks)
+    task_id = tasks[0]["id"]
+
+    with LatencyProxy(params["host"], params["port"], delay=delay) as proxy:
+        proxied = dict(params, host="127.0.0.1", port=proxy.port, sslmode="disable")
+        runner = EventLoopThread()
+        pool = create_async_pool(proxied, min_size=3, max_size=3)
+        runner.run(pool.open(wait=True))
+
+        backends = {
+            "sync": (TaskService(), UserService()),
+            "async": (BlockingService(AsyncTaskService(pool), runner),
+                      BlockingService(AsyncUserService(pool), runner)),
+            "pipeline": (BlockingService(PipelinedTaskService(pool), runner),
+                         BlockingService(PipelinedUserService(pool), runner)),
+        }
+        for task_service, user_service in backends.values():
+            if isinstance(task_service, TaskService):
+                task_service.connection_params = proxied
+                user_service.connection_params = proxied
+
+        run_id = time.time_ns()
+        print(f"=== パイプライン ベンチマーク（RTT +{delay * 2000:.0f}ms、各{n}回、p50 / 往復回数） ===")
+        print(f"{'backend':<10}{'register':>22}{'complete+count':>22}{'dashboard':>22}")
+        try:
+            for name, (task_service, user_service) in backends.items():
+                ok, message, user = user_service.register_user(f"pipeline_{name}_{run_id}")
+                if not ok:
+                    raise RuntimeError(message)
+                results = [
+                    measure(proxy, lambda i: user_service.register_user(f"pipeline_{name}_{run_id}_{i}"), n),
+                    measure(proxy, lambda i: task_service.mark_task_complete_and_count(task_id, user.id), n),
+                    measure(proxy, lambda i: task_service.get_dashboard_snapshot(user.id, aggregates=True), n),
+                ]
+                print(f"{name:<10}" + "".join(f"{f'{ms:.1f}ms / {rt:.1f}':>22}" for ms, rt in results))
+        finally:
+            runner.run(pool.close())
+            runner.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--delay", type=float, default=0.01, help="片道の遅延（秒）")
+    parser.add_argument("-n", type=int, default=20, help="操作ごとの試行回数")
+    args = parser.parse_args()
+    run_benchmark(args.delay, args.n)
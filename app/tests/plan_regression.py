@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+クエリプランの回帰チェック
+合成参加者データ（synthetic_attendees.py）を複数の規模で専用スキーマに作り、task_db.py / user.py のクエリ定数について
+EXPLAIN (FORMAT JSON) を取り、チェックイン済みのスナップショット
+（tests/plan_snapshots/<規模>.json）とプランの形・推定コストを比べる。
+
+プランはプール接続で PREPARE して使い続けたときと同じ汎用プラン
+（plan_cache_mode = force_generic_plan）で取る。
+データは固定のシードで作るので、同じ Postgres のメジャーバージョンなら
+形は一致し、推定コストの揺れは ANALYZE のサンプリング分だけになる。
+
+スナップショットの更新（プランの変更が意図どおりのとき）:
+    DB_HOST=127.0.0.1 python tests/plan_regression.py --update
+差分の確認だけ:
+    DB_HOST=127.0.0.1 python tests/plan_regression.py
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_db import (
+    _to_prepared_sql, load_connection_params,
+    TASKS_WITH_PROGRESS_SQL, MARK_TASK_COMPLETE_SQL, COMPLETED_COUNT_SQL,
+    USER_RANKING_SQL, USER_RANK_SQL, TASK_COMPLETION_COUNTS_SQL,
+)
+from user import GET_OR_CREATE_USER_SQL, LOGIN_USER_SQL, SELECT_USER_SQL
+from synthetic_attendees import create_schema, load_attendees, username_for
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_snapshots")
+
+# 規模名 -> 参加者数（ミッションは tasks.yml）
+SCALES = {
+    "small": 1_000,
+    "medium": 10_000,
+    "large": 100_000,
+}
+SEED = 42
+
+# 推定コストがスナップショットよりこの割合を超えて増えたら回帰とみなす
+COST_TOLERANCE = 0.25
+
+# クエリ名 -> (SQL, 引数)。引数はユーザー数を受け取って作る
+PLAN_QUERIES = {
+    "tasks_with_progress": (TASKS_WITH_PROGRESS_SQL, lambda users: (users // 2,)),
+    "mark_task_complete": (MARK_TASK_COMPLETE_SQL, lambda users: (users // 2, 1, "2025-09-11 10:00")),
+    "completed_count": (COMPLETED_COUNT_SQL, lambda users: (users // 2,)),
+    "user_ranking": (USER_RANKING_SQL, lambda users: ()),
+    "user_rank": (USER_RANK_SQL, lambda users: (users // 2,)),
+    "task_completion_counts": (TASK_COMPLETION_COUNTS_SQL, lambda users: ()),
+    "get_or_create_user": (GET_OR_CREATE_USER_SQL, lambda users: {"username": username_for(users // 2)}),
+    "login_user": (LOGIN_USER_SQL, lambda users: (username_for(users // 2),)),
+    "select_user": (SELECT_USER_SQL, lambda users: {"username": username_for(users // 2)}),
+}
+
+# 形の比較に使うノードの属性（行数・コスト・ワーカー数などは含めない）
+SHAPE_KEYS = ("Node Type", "Relation Name", "Index Name", "Join Type", "Strategy", "Parent Relationship")
+
+
+def seed_schema(conn, schema: str, users: int):
+    """schema を作り直し、テーブルとマイグレーションを適用して合成参加者を入れる
+
+    conn は autocommit でない接続。終わると search_path が schema になる。
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    create_schema(conn, schema)
+    load_attendees(conn, users, seed=SEED)
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE users, tasks, progress")
+    finally:
+        conn.autocommit = autocommit
+
+
+def drop_schema(conn, schema: str):
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.commit()
+
+
+def explain_generic(conn, name: str, sql: str, params) -> dict:
+    """PREPARE した文の汎用プランを EXPLAIN (FORMAT JSON) で取る（実行はしない）"""
+    prepared_sql, keys = _to_prepared_sql(sql)
+    if isinstance(params, dict):
+        args = [params[key] for key in keys]
+    else:
+        args = list(params)
+    statement = f"EXPLAIN (FORMAT JSON) EXECUTE plan_{name}"
+    if args:
+        statement += f"({', '.join(['%s'] * len(args))})"
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+        cur.execute(f"PREPARE plan_{name} AS {prepared_sql}")
+        try:
+            cur.execute(statement, args or None)
+            plan = cur.fetchone()[0]
+        finally:
+            conn.rollback()
+            # PREPARE はトランザクションに含まれないので明示的に消す
+            cur.execute(f"DEALLOCATE plan_{name}")
+            conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def plan_shape(node: dict) -> dict:
+    """プランの木から形だけを取り出す"""
+    shape = {key: node[key] for key in SHAPE_KEYS if key in node}
+    children = [plan_shape(child) for child in node.get("Plans", [])]
+    if children:
+        shape["Plans"] = children
+    return shape
+
+
+def iter_nodes(shape: dict):
+    yield shape
+    for child in shape.get("Plans", []):
+        yield from iter_nodes(child)
+
+
+def seq_scans(shape: dict) -> set:
+    return {node.get("Relation Name") for node in iter_nodes(shape) if node["Node Type"] == "Seq Scan"}
+
+
+def capture_plans(conn, users: int) -> dict:
+    """規模に対する全クエリのプラン（形と推定コスト）"""
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version_num")
+        server_version = int(cur.fetchone()[0]) // 10000
+    conn.rollback()
+    queries = {}
+    for name, (sql, make_params) in PLAN_QUERIES.items():
+        plan = explain_generic(conn, name, sql, make_params(users))
+        queries[name] = {"total_cost": plan["Total Cost"], "plan": plan_shape(plan)}
+    return {"postgres": server_version, "users": users, "queries": queries}
+
+
+def compare_plans(expected: dict, actual: dict, tolerance: float = COST_TOLERANCE) -> list[str]:
+    """スナップショットとの差分のうち回帰とみなすものを返す（空なら問題なし）
+
+    形の変化（特に新しい Seq Scan）は常に回帰。推定コストは同じメジャーバージョンの
+    Postgres で取ったスナップショットのときだけ比べる。
+    """
+    problems = []
+    same_server = expected.get("postgres") == actual.get("postgres")
+    for name, current in actual["queries"].items():
+        snapshot = expected["queries"].get(name)
+        if snapshot is None:
+            problems.append(f"{name}: スナップショットがありません（--update で追加）")
+            continue
+        new_scans = seq_scans(current["plan"]) - seq_scans(snapshot["plan"])
+        for relation in sorted(new_scans, key=str):
+            problems.append(f"{name}: {relation} に新しい Seq Scan")
+        if not new_scans and current["plan"] != snapshot["plan"]:
+            problems.append(
+                f"{name}: プランの形が変わりました\n"
+                f"  snapshot: {json.dumps(snapshot['plan'], ensure_ascii=False)}\n"
+                f"  current:  {json.dumps(current['plan'], ensure_ascii=False)}"
+            )
+        # ごく小さいコスト（INSERT など）の揺れで落ちないよう絶対値の余裕も持たせる
+        limit = snapshot["total_cost"] * (1 + tolerance) + 1.0
+        if same_server and current["total_cost"] > limit:
+            problems.append(
+                f"{name}: 推定コストが {snapshot['total_cost']:.2f} -> {current['total_cost']:.2f}"
+                f"（+{current['total_cost'] / snapshot['total_cost'] - 1:.0%}）"
+            )
+    return problems
+
+
+def snapshot_path(scale: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{scale}.json")
+
+
+def load_snapshot(scale: str):
+    try:
+        with open(snapshot_path(scale), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_snapshot(scale: str, plans: dict):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(snapshot_path(scale), "w", encoding="utf-8") as f:
+        json.dump(plans, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="query plan regression check")
+    parser.add_argument("--update", action="store_true", help="スナップショットを書き換える")
+    parser.add_argument("--scale", choices=sorted(SCALES), action="append", help="対象の規模（複数可）")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**load_connection_params())
+    failed = False
+    try:
+        for scale in args.scale or SCALES:
+            schema = f"plan_{scale}"
+            seed_schema(conn, schema, SCALES[scale])
+            try:
+                plans = capture_plans(conn, SCALES[scale])
+            finally:
+                drop_schema(conn, schema)
+            if args.update:
+                save_snapshot(scale, plans)
+                print(f"{scale}: {snapshot_path(scale)} を更新しました")
+                continue
+            snapshot = load_snapshot(scale)
+            problems = compare_plans(snapshot, plans) if snapshot else ["スナップショットがありません"]
+            failed = failed or bool(problems)
+            print(f"{scale}: {'OK' if not problems else ''}")
+            for problem in problems:
+                print(f"  {problem}")
+    finally:
+        conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
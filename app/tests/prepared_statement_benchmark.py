@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+プリペアドステートメントのベンチマーク
+ホットなクエリについて、毎回SQL文を送る場合と、接続ごとに PREPARE して EXECUTE する場合の
+Postgres 側の計画時間（EXPLAIN ANALYZE の Planning Time）と応答時間を比較する。
+あわせて、従来の「呼び出しごとに新規接続」とプール＋プリペアドのエンドツーエンドも測る。
+
+ローカルのPostgreSQLが必要（DB_HOST などの環境変数で指定）。
+完了登録はトランザクションをロールバックするのでデータは残らない。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/prepared_statement_benchmark.py -n 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from task_db import (
+    ConnectionPool, PreparingConnection, TaskService, load_connection_params, execute_prepared,
+    TASKS_WITH_PROGRESS_SQL, MARK_TASK_COMPLETE_SQL, USER_RANKING_SQL, USER_RANK_SQL,
+)
+from tasks import load_tasks_from_yaml
+from user import UserService, LOGIN_USER_SQL
+
+
+def planning_ms(cur, sql: str, params) -> float:
+    """EXPLAIN ANALYZE の計画時間（ミリ秒）"""
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params or None)
+    return cur.fetchone()[0][0]["Planning Time"]
+
+
+def p50_ms(function, n: int) -> float:
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run_benchmark(n: int):
+    params = load_connection_params()
+    UserService()
+    tasks = load_tasks_from_yaml(os.path.join(os.path.dirname(os.path.dirname(__file__)), "tasks.yml"))
+    TaskService().bulk_insert_tasks_if_not_exists(tasks)
+    ok, message, user = UserService().get_or_create_user("prepared_benchmark")[:3]
+    if not ok:
+        raise RuntimeError(message)
+
+    queries = {
+        "tasks_with_progress": (TASKS_WITH_PROGRESS_SQL, (user.id,)),
+        "login_user": (LOGIN_USER_SQL, (user.username,)),
+        "mark_task_complete": (MARK_TASK_COMPLETE_SQL, (user.id, tasks[0]["id"], datetime.now())),
+        "user_ranking": (USER_RANKING_SQL, ()),
+        "user_rank": (USER_RANK_SQL, (user.id,)),
+    }
+
+    print(f"=== プリペアドステートメント ベンチマーク（各{n}回、p50） ===")
+    print(f"{'query':<22}{'plan (text)':>14}{'plan (prepared)':>18}{'exec (text)':>14}{'exec (prepared)':>18}")
+    conn = psycopg2.connect(connection_factory=PreparingConnection, **params)
+    try:
+        with conn.cursor() as cur:
+            for name, (sql, args) in queries.items():
+                # 計画時間: 通常の文と、PREPARE 済みの EXECUTE（ウォームアップ後）
+                text_plan = statistics.median(planning_ms(cur, sql, args) for _ in range(n))
+                for _ in range(10):
+                    execute_prepared(cur, name, sql, args)
+                placeholders = ", ".join(["%s"] * len(args))
+                execute_sql = f"EXECUTE {name}({placeholders})" if args else f"EXECUTE {name}"
+                prepared_plan = statistics.median(planning_ms(cur, execute_sql, args) for _ in range(n))
+
+                text_exec = p50_ms(lambda: cur.execute(sql, args or None), n)
+                prepared_exec = p50_ms(lambda: execute_prepared(cur, name, sql, args), n)
+                conn.rollback()
+                print(f"{name:<22}{text_plan:>12.3f}ms{prepared_plan:>16.3f}ms"
+                      f"{text_exec:>12.3f}ms{prepared_exec:>16.3f}ms")
+    finally:
+        conn.rollback()
+        conn.close()
+
+    # エンドツーエンド: 従来の新規接続＋SQL文 と、プール＋プリペアド
+    def fresh_connection():
+        with psycopg2.connect(**params) as fresh:
+            with fresh.cursor() as cur:
+                cur.execute(TASKS_WITH_PROGRESS_SQL, (user.id,))
+                cur.fetchall()
+        fresh.close()
+
+    pool = ConnectionPool(1, **params)
+    try:
+        def pooled():
+            with pool.connection() as pooled_conn:
+                with pooled_conn.cursor() as cur:
+                    execute_prepared(cur, "tasks_with_progress", TASKS_WITH_PROGRESS_SQL, (user.id,))
+                    cur.fetchall()
+
+        print(f"\nget_tasks_with_progress: 新規接続 {p50_ms(fresh_connection, n):.3f}ms"
+              f" / プール＋プリペアド {p50_ms(pooled, n):.3f}ms")
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="prepared statement benchmark")
+    parser.add_argument("-n", type=int, default=200, help="クエリごとの試行回数")
+    args = parser.parse_args()
+    run_benchmark(args.n)
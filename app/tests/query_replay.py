@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+クエリトレースの再生（キャパシティ計画用）
+query_trace.py が記録したトレースを、ローカルの Postgres に記録時と同じ間隔で（1倍・5倍・10倍速などに縮めて）
+発行し直し、文ごとのレイテンシ分布と、予定時刻からの遅れ（接続が足りずに待った時間）を報告する。
+スキーマやインデックスを変えた構成に同じアクセスパターンを当てて比べるためのもの。
+
+- 複数のトレースファイル（プロセスごと）は記録開始時刻を合わせて1本の時系列にまとめる
+- 再生は開ループ（前のクエリの完了を待たずに予定時刻で投げる）。同時実行はワーカー数（接続数）まで
+- 匿名化された文字列は合成参加者のユーザー名（synthetic_attendees.username_for）に、日時は再生時の現在時刻に置き換える
+- アプリと同じく PREPARE 済みの文として、同じクエリ種別のタイムアウトを付けて実行する
+
+実行例:
+    # 記録（負荷シミュレーターやアプリを QUERY_TRACE_DIR 付きで動かす）
+    DB_HOST=127.0.0.1 QUERY_TRACE_DIR=/tmp/traces python tests/load_simulator.py --ramp 50 --step-seconds 30
+    # 再生
+    DB_HOST=127.0.0.1 python tests/query_replay.py /tmp/traces --speeds 1,5,10
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+import psycopg2
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_DIR)
+
+from benchmark import prepare_schema, summarize
+from query_trace import Redacted, read_trace
+from synthetic_attendees import username_for
+from task_db import PreparingConnection, execute_prepared, load_connection_params
+
+
+class ReplayStatement(NamedTuple):
+    """再生する文（トレースファイルをまたいで同じ文は1つにまとめる）"""
+    name: str
+    label: str
+    sql: str
+    query_class: str
+    names: tuple
+
+
+class ReplayEvent(NamedTuple):
+    """再生する1回の実行"""
+    offset_us: int
+    statement: int
+    params: tuple
+    traced_us: int
+
+
+def trace_files(paths: list[str]) -> list[str]:
+    """ファイルとディレクトリ（中の *.svqt）の一覧をファイルの一覧にする"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(".svqt")
+            ))
+        else:
+            files.append(path)
+    return files
+
+
+def load_events(paths: list[str], max_seconds: float = None) -> tuple[list[ReplayStatement], list[ReplayEvent]]:
+    """トレースを読み、文の一覧と記録開始からの時刻順の実行の一覧を返す"""
+    traces = [read_trace(path) for path in trace_files(paths)]
+    if not traces:
+        return [], []
+    first_started_us = min(trace.started_at_us for trace in traces)
+    statements, statement_index, events = [], {}, []
+    for trace in traces:
+        local_index = {}
+        for statement_id, statement in trace.statements.items():
+            key = (statement.label, statement.sql, statement.query_class, statement.names)
+            if key not in statement_index:
+                statement_index[key] = len(statements)
+                # PREPARE 名は execute_prepared がプロセス内で覚えるので、文の内容から決める
+                statements.append(ReplayStatement(f"replay_{zlib.crc32(repr(key).encode('utf-8')):08x}", *key))
+            local_index[statement_id] = statement_index[key]
+        shift_us = trace.started_at_us - first_started_us
+        for call in trace.calls:
+            offset_us = call.offset_us + shift_us
+            if max_seconds is not None and offset_us > max_seconds * 1_000_000:
+                continue
+            events.append(ReplayEvent(offset_us, local_index[call.statement_id], call.params, call.duration_us))
+    events.sort(key=lambda event: event.offset_us)
+    return statements, events
+
+
+def resolve_value(value, attendees: int):
+    """匿名化された引数を再生用の値に置き換える"""
+    if not isinstance(value, Redacted):
+        return value
+    if value.kind == "text":
+        return username_for(1 + value.token % attendees)
+    if value.kind == "datetime":
+        return datetime.now()
+    return None
+
+
+def resolve_params(statement: ReplayStatement, params: tuple, attendees: int):
+    values = [resolve_value(value, attendees) for value in params]
+    if statement.names:
+        return dict(zip(statement.names, values))
+    return tuple(values)
+
+
+class _Connections(threading.local):
+    """再生ワーカー（スレッド）ごとの接続"""
+    conn = None
+
+
+def replay(statements: list[ReplayStatement], events: list[ReplayEvent], speed: float,
+           workers: int, attendees: int) -> dict:
+    """events を speed 倍速で再生して集計を返す"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        params = load_connection_params()
+    connections = _Connections()
+    opened = []
+    opened_lock = threading.Lock()
+    latencies = defaultdict(list)
+    lags = []
+    errors = defaultdict(int)
+    error_messages = []
+    record_lock = threading.Lock()
+
+    def execute(event: ReplayEvent, scheduled: float):
+        started = time.perf_counter()
+        statement = statements[event.statement]
+        if connections.conn is None:
+            connections.conn = psycopg2.connect(connection_factory=PreparingConnection, **params)
+            with opened_lock:
+                opened.append(connections.conn)
+        conn = connections.conn
+        start_ns = time.perf_counter_ns()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    execute_prepared(cur, statement.name, statement.sql,
+                                     resolve_params(statement, event.params, attendees), statement.query_class)
+        except Exception as e:
+            with record_lock:
+                errors[statement.label] += 1
+                if len(error_messages) < 10:
+                    error_messages.append(f"{statement.label}: {type(e).__name__}: {str(e).strip()}")
+            # PREPARE の状態が分からなくなるので、アプリの接続プールと同じく接続を作り直す
+            conn.close()
+            connections.conn = None
+            return
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        with record_lock:
+            latencies[statement.label].append(elapsed_ns)
+            lags.append(int((started - scheduled) * 1e9))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="replay") as pool:
+        for event in events:
+            scheduled = start + event.offset_us / 1e6 / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(execute, event, scheduled)
+    elapsed = time.perf_counter() - start
+    for conn in opened:
+        conn.close()
+
+    traced = defaultdict(list)
+    for event in events:
+        traced[statements[event.statement].label].append(event.traced_us * 1000)
+    labels = sorted(set(traced), key=lambda label: -len(traced[label]))
+    queries = {}
+    for label in labels:
+        samples = latencies.get(label, [])
+        summary = summarize(samples) if len(samples) >= 2 else {"n": len(samples)}
+        summary["errors"] = errors.get(label, 0)
+        if len(traced[label]) >= 2:
+            summary["traced_p95_ms"] = summarize(traced[label])["p95_ms"]
+        queries[label] = summary
+    completed = sum(len(samples) for samples in latencies.values())
+    return {
+        "speed": speed,
+        "events": len(events),
+        "trace_seconds": round(events[-1].offset_us / 1e6, 2) if events else 0.0,
+        "seconds": round(elapsed, 2),
+        "queries_per_second": round(completed / elapsed, 2) if elapsed else 0.0,
+        "lag": summarize(lags) if len(lags) >= 2 else {"n": len(lags)},
+        "queries": queries,
+        "errors": sum(errors.values()),
+        "error_messages": error_messages,
+    }
+
+
+def format_result(result: dict) -> str:
+    lag = result["lag"]
+    lines = [
+        f"--- {result['speed']:g}倍速: {result['events']}件 / {result['seconds']}秒 "
+        f"（記録 {result['trace_seconds']}秒）, {result['queries_per_second']} クエリ/秒, "
+        f"予定からの遅れ p50={lag.get('p50_ms', 0):.2f}ms p99={lag.get('p99_ms', 0):.2f}ms, "
+        f"エラー {result['errors']}件"
+    ]
+    for label, summary in result["queries"].items():
+        if "p50_ms" in summary:
+            traced = summary.get("traced_p95_ms")
+            traced = f"{traced:.2f}ms" if traced is not None else "-"
+            lines.append(
+                f"  {label:<28} n={summary['n']:<6} p50={summary['p50_ms']:8.2f}ms "
+                f"p95={summary['p95_ms']:8.2f}ms p99={summary['p99_ms']:8.2f}ms "
+                f"（記録時 p95={traced}） errors={summary['errors']}"
+            )
+        else:
+            lines.append(f"  {label:<28} n={summary['n']} errors={summary['errors']}")
+    for message in result["error_messages"]:
+        lines.append(f"  ! {message}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="query trace replay")
+    parser.add_argument("traces", nargs="+", help="トレースファイルまたはそれを含むディレクトリ")
+    parser.add_argument("--speeds", default="1,5,10", help="再生速度の倍率（カンマ区切り）")
+    parser.add_argument("--workers", type=int, default=20, help="同時に使う接続数")
+    parser.add_argument("--attendees", type=int, default=10_000, help="登録済みの合成参加者数")
+    parser.add_argument("--schema", default="replay", help="再生先のスキーマ")
+    parser.add_argument("--reseed", action="store_true", help="参加者データを入れ直す")
+    parser.add_argument("--max-seconds", type=float, help="記録の先頭から再生する秒数")
+    parser.add_argument("--json", help="結果を保存するJSONのパス")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    statements, events = load_events(args.traces, args.max_seconds)
+    if not events:
+        sys.exit("再生するクエリがありません")
+    os.environ["DB_SCHEMA"] = args.schema
+    prepare_schema(args.schema, args.attendees, args.reseed)
+    print(f"=== クエリ再生（schema={args.schema}、{len(events):,}件、文{len(statements)}種類、"
+          f"接続{args.workers}） ===")
+    results = []
+    for speed in (float(value) for value in args.speeds.split(",")):
+        result = replay(statements, events, speed, args.workers, args.attendees)
+        results.append(result)
+        print(format_result(result))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"attendees": args.attendees, "results": results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+セッションあたりのメモリ使用量の計測（tracemalloc）
+main.py の AppTest セッションを複数開き、ログイン → ダッシュボード → ミッションをいくつか開いて閉じる
+操作をしたあと、次の2つを報告する。
+
+- セッションを開いたことによる Python ヒープの増加（tracemalloc のスナップショット差分、ファイル別の上位）
+- セッション状態のキーの種類ごと（数字を {id} にまとめたもの）のキー数と、値をたどった大きさ
+
+ヒープの増加には AppTest 自身が持つ要素ツリーも含まれるので、サーバーのセッションの重さを比べるときは
+キーの種類ごとの大きさを見る。ウィジェットの状態は "widget:" を付けて集計する。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/session_memory.py --sessions 20 --missions 6
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import gc
+import io
+import json
+import os
+import re
+import sys
+import tracemalloc
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_DIR)
+
+from apptest_load import Session
+from benchmark import prepare_schema
+from synthetic_attendees import username_for
+
+# ミッションを開くボタンの接頭辞と、開いたミッションを閉じるボタンの接頭辞
+MISSION_BUTTONS = {"swt_btn_": "close_swt_content_", "sns_btn_": "close_sns_content_", "quiz_btn_": "close_quiz_content_"}
+_WIDGET_ID_RE = re.compile(r"^\$\$ID-[0-9a-f]+-(.+)$")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def deep_sizeof(value, seen=None) -> int:
+    """値からたどれるオブジェクトの大きさの合計（同じオブジェクトは1回だけ数える）"""
+    if seen is None:
+        seen = set()
+    if id(value) in seen or isinstance(value, type):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    elif dataclasses.is_dataclass(value):
+        size += sum(deep_sizeof(getattr(value, field.name), seen) for field in dataclasses.fields(value))
+        if hasattr(value, "__dict__"):
+            size += sys.getsizeof(value.__dict__)
+    return size
+
+
+def key_type(key: str) -> str:
+    """セッション状態のキーを種類にまとめる（show_quiz_12 → show_quiz_{id}）"""
+    match = _WIDGET_ID_RE.match(key)
+    if match:
+        return "widget:" + _DIGITS_RE.sub("{id}", match.group(1))
+    if key.startswith("$$"):
+        return "internal"
+    return _DIGITS_RE.sub("{id}", key)
+
+
+def session_keys(session: Session) -> dict:
+    """キーの種類ごとの (キー数, 大きさ)"""
+    state = session.app._session_state._state
+    values = state.filtered_state
+    result = defaultdict(lambda: [0, 0])
+    for key in state._keys():
+        match = _WIDGET_ID_RE.match(key)
+        user_key = match.group(1) if match else key
+        kind = key_type(key)
+        result[kind][0] += 1
+        if user_key in values:
+            result[kind][1] += deep_sizeof(user_key) + deep_sizeof(values[user_key])
+    return result
+
+
+def browse_missions(session: Session, missions: int):
+    """ミッションを種類を混ぜて missions 個開いて閉じる"""
+    keys = [
+        (button.key, close_prefix + button.key[len(prefix):])
+        for button in session.app.button
+        for prefix, close_prefix in MISSION_BUTTONS.items()
+        if button.key and button.key.startswith(prefix)
+    ]
+    # 種類が偏らないよう、種類ごとの先頭から順に取る
+    by_kind = defaultdict(list)
+    for open_key, close_key in keys:
+        by_kind[open_key.split("_", 1)[0]].append((open_key, close_key))
+    ordered = [pair for group in zip(*by_kind.values()) for pair in group]
+    for open_key, close_key in ordered[:missions]:
+        session.app.button(key=open_key).click().run()
+        session.app.button(key=close_key).click().run()
+
+
+def open_session(username: str, missions: int, timeout: float) -> Session:
+    session = Session(username, timeout)
+    session.login()
+    session.dashboard()
+    browse_missions(session, missions)
+    return session
+
+
+def measure(sessions: int, missions: int, attendees: int, timeout: float = 60.0, top: int = 8) -> dict:
+    """sessions 個のセッションを開き、1セッションあたりのメモリとキーの種類ごとの内訳を返す"""
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            # モジュールの読み込みや初回の初期化を差分に含めない
+            warmup = open_session(username_for(attendees), missions, timeout)
+            del warmup
+            gc.collect()
+            before = tracemalloc.take_snapshot()
+            opened = [
+                open_session(username_for(1 + index * 7919 % attendees), missions, timeout)
+                for index in range(sessions)
+            ]
+            gc.collect()
+            after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    differences = after.compare_to(before, "filename")
+    growth = sum(stat.size_diff for stat in differences)
+    files = [
+        {"file": os.path.relpath(stat.traceback[0].filename, os.path.dirname(APP_DIR)),
+         "kb_per_session": round(stat.size_diff / sessions / 1024, 1)}
+        for stat in differences[:top] if stat.size_diff > 0
+    ]
+    keys = defaultdict(lambda: [0, 0])
+    for session in opened:
+        for kind, (count, size) in session_keys(session).items():
+            keys[kind][0] += count
+            keys[kind][1] += size
+    key_types = {
+        kind: {"keys_per_session": round(count / sessions, 1), "bytes_per_session": round(size / sessions)}
+        for kind, (count, size) in sorted(keys.items(), key=lambda item: -item[1][1])
+    }
+    return {
+        "sessions": sessions,
+        "missions": missions,
+        "kb_per_session": round(growth / sessions / 1024, 1),
+        "state_bytes_per_session": sum(entry["bytes_per_session"] for entry in key_types.values()),
+        "state_keys_per_session": round(sum(entry["keys_per_session"] for entry in key_types.values()), 1),
+        "top_files": files,
+        "key_types": key_types,
+    }
+
+
+def format_result(result: dict) -> str:
+    lines = [
+        f"=== {result['sessions']}セッション（ミッション{result['missions']}件を開閉）: "
+        f"1セッションあたり ヒープ {result['kb_per_session']}KB, "
+        f"セッション状態 {result['state_keys_per_session']}キー / {result['state_bytes_per_session']:,}バイト ===",
+        "ヒープの増加（ファイル別）:",
+    ]
+    for entry in result["top_files"]:
+        lines.append(f"  {entry['kb_per_session']:8.1f}KB  {entry['file']}")
+    lines.append("セッション状態（キーの種類別）:")
+    for kind, entry in result["key_types"].items():
+        lines.append(f"  {entry['bytes_per_session']:8,}バイト  {entry['keys_per_session']:5.1f}キー  {kind}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-session memory footprint")
+    parser.add_argument("--sessions", type=int, default=10, help="開くセッション数")
+    parser.add_argument("--missions", type=int, default=6, help="セッションごとに開いて閉じるミッション数")
+    parser.add_argument("--attendees", type=int, default=10_000, help="登録済みの合成参加者数")
+    parser.add_argument("--schema", default="apptest", help="計測用のスキーマ")
+    parser.add_argument("--timeout", type=float, default=60.0, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--json", help="結果を保存するJSONのパス")
+    args = parser.parse_args()
+
+    os.environ["DB_SCHEMA"] = args.schema
+    prepare_schema(args.schema, args.attendees)
+    result = measure(args.sessions, args.missions, args.attendees, args.timeout)
+    print(format_result(result))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
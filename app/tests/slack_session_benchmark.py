@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Slack送信のコネクション再利用ベンチマーク
+ローカルのWebhookスタブに対し、投稿ごとに新規接続する場合と
+プロセス共有セッション（Keep-Alive）を使う場合の1投稿あたりのレイテンシを比較する
+
+注意: スタブはHTTPのため、差分はTCPハンドシェイク分のみ。
+実際の hooks.slack.com ではTLSハンドシェイク分がさらに上乗せされる。
+"""
+
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.dirname(__file__))
+
+from slack_client import SlackClient, TokenBucket
+from slack_stub_server import SlackStubServer
+
+
+def make_client(url: str, session: requests.Session = None) -> SlackClient:
+    """スタブ向けのクライアント（レート制限なし）を作成"""
+    client = SlackClient(session=session)
+    client.webhook_url = url
+    client.rate_limiter = TokenBucket(rate=1e9, capacity=1e9)
+    return client
+
+
+def measure(post, n: int) -> list[float]:
+    """n回投稿して各回の所要時間（ミリ秒）を返す"""
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        success, message = post(f"benchmark message {i}")
+        samples.append((time.perf_counter() - start) * 1000)
+        if not success:
+            raise RuntimeError(message)
+    return samples
+
+
+def report(label: str, samples: list[float], connections: int):
+    """結果を表示"""
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label}: mean={statistics.mean(samples):.3f}ms "
+          f"p50={statistics.median(samples):.3f}ms p95={p95:.3f}ms "
+          f"connections={connections}")
+
+
+def run_benchmark(n: int = 500):
+    print(f"=== Slack送信ベンチマーク（{n}投稿） ===")
+    with SlackStubServer() as stub:
+        # ウォームアップ
+        make_client(stub.url).send_anonymous_message("warmup")
+
+        # 従来: 投稿ごとにクライアントと接続を作り直す
+        before = stub.connections
+        samples = measure(
+            lambda message: make_client(stub.url, session=requests.Session()).send_anonymous_message(message), n
+        )
+        report("接続再利用なし", samples, stub.connections - before)
+
+        # 改善後: プロセス共有クライアントのKeep-Alive接続を再利用
+        shared = make_client(stub.url)
+        before = stub.connections
+        samples = measure(shared.send_anonymous_message, n)
+        report("接続再利用あり", samples, stub.connections - before)
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
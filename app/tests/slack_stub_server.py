@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Slack Incoming Webhook のローカル代替サーバー
+実際のWebhook URLなしで slack_client.py / pages/post.py の送信経路をテスト・負荷試験するために使う
+
+Slack Webhook と同じ応答を返す:
+- 200 "ok"                     正常
+- 400 "invalid_payload"        JSONでない / text がない
+- 429 "rate_limited"           レート超過（Retry-After ヘッダー付き）
+- 500 "internal_error"         error_rate の確率で発生
+
+起動例:
+    python tests/slack_stub_server.py --port 8765 --latency 0.2 --error-rate 0.05 --rate-limit 1
+    SLACK_WEBHOOK_URL=http://127.0.0.1:8765/services/T000/B000/stub python -m streamlit run main.py
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Webhook POST を受け付けるハンドラー"""
+    # Keep-Alive を有効にするため HTTP/1.1 で応答する
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文の分割送信で遅延ACK待ちが起きないようにする
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # ハンドラーは接続ごとに生成されるので、ここで接続数を数える
+        self.server.stub.record_connection()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        status, text, headers = self.server.stub.handle(body)
+        self._respond(status, text, headers)
+
+    def _respond(self, status: int, text: str, headers: dict = None):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SlackStubServer:
+    """別スレッドで動くWebhookスタブ（with文で起動・停止）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: float = None, retry_after: int = None, seed: int = None):
+        """
+        Args:
+            latency: 応答までの遅延（秒）
+            latency_jitter: 遅延に加える一様乱数の幅（秒）
+            error_rate: 500を返す確率（0.0〜1.0）
+            rate_limit: 1秒あたりの受付上限（超過分は429。Noneで無制限）
+            retry_after: 429の Retry-After 秒数（Noneなら次の受付可能時刻から算出）
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = []
+        self.messages = []
+        self.status_counts = {}
+        self.connections = 0
+        self._scripted = []
+        self._next_allowed_at = 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Webhook URL"""
+        return f"http://{self.host}:{self._server.server_address[1]}/services/T000/B000/stub"
+
+    def script_responses(self, *statuses: int):
+        """次のリクエストから順に返すステータスを指定（テストで429などを再現する）"""
+        with self._lock:
+            self._scripted.extend(statuses)
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _decide(self, payload) -> tuple[int, str, dict]:
+        """レスポンスを決定（ロック取得済みで呼ぶ）"""
+        if self._scripted:
+            status = self._scripted.pop(0)
+            if status == 429:
+                return 429, "rate_limited", {"Retry-After": str(self.retry_after or 1)}
+            return status, "ok" if status == 200 else "stub_error", {}
+
+        if not isinstance(payload, dict) or not payload.get("text"):
+            return 400, "invalid_payload", {}
+
+        now = time.monotonic()
+        if self.rate_limit:
+            if now < self._next_allowed_at:
+                wait = self.retry_after or math.ceil(self._next_allowed_at - now)
+                return 429, "rate_limited", {"Retry-After": str(wait)}
+            self._next_allowed_at = now + 1.0 / self.rate_limit
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 500, "internal_error", {}
+        return 200, "ok", {}
+
+    def handle(self, body: bytes) -> tuple[int, str, dict]:
+        """リクエスト本文を処理して (ステータス, 本文, ヘッダー) を返す"""
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = None
+
+        delay = self.latency
+        if self.latency_jitter:
+            delay += self._random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            status, text, headers = self._decide(payload)
+            self.requests.append(payload)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status == 200:
+                self.messages.append(payload["text"] if isinstance(payload, dict) else None)
+        return status, text, headers
+
+    def start(self):
+        """サーバーを起動"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _WebhookHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="slack-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """サーバーを停止"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slack Incoming Webhook stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延のゆらぎ幅（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500を返す確率")
+    parser.add_argument("--rate-limit", type=float, default=None, help="1秒あたりの受付上限")
+    parser.add_argument("--retry-after", type=int, default=None, help="429のRetry-After秒数")
+    args = parser.parse_args()
+
+    stub = SlackStubServer(
+        host=args.host, port=args.port, latency=args.latency, latency_jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit=args.rate_limit, retry_after=args.retry_after,
+    )
+    with stub:
+        print(f"Slack webhook stub listening: {stub.url}")
+        try:
+            while True:
+                time.sleep(5)
+                print(f"requests={len(stub.requests)} statuses={stub.status_counts}")
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+合成参加者データの生成
+tasks.yml のミッションに対して、イベント2日間（2025-09-11 / 2025-09-12）の
+来場・完了パターンを持つ N 人分の users / progress を COPY で一括投入する。
+ベンチマークやプランのテストでイベント規模のデータを使うためのもの。
+
+- 参加日: 1日目のみ・2日目のみ・両日
+- 登録（created_at）: キーノート後の午前にピークがあり、昼と夕方は少ない
+- 完了数: 参加者ごとの熱心さをベータ分布で引くので、数件だけの人が多く全制覇は少数
+- ミッションの人気: 種別（quiz > swt > sns）と、同じ種別内では番号の若い順に偏る
+- 完了時刻: 参加日の登録以降、同じ時間帯の偏りで分布
+
+同じ seed なら同じデータになる。
+
+実行例:
+    DB_HOST=127.0.0.1 python tests/synthetic_attendees.py --users 100000 --schema bench --replace
+    DB_HOST=127.0.0.1 python tests/synthetic_attendees.py --users 10000 --schema bench
+
+--replace は users / progress を TRUNCATE するので、アプリ本体のテーブルがある public には使えない
+（専用の --schema を指定する）。
+"""
+
+import argparse
+import bisect
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(APP_DIR)
+
+from migrations import apply_migrations
+from task_db import CREATE_TASKS_TABLE_SQL, CREATE_PROGRESS_TABLE_SQL, load_connection_params
+from tasks import load_tasks_from_yaml
+from user import CREATE_USERS_TABLE_SQL
+
+EVENT_DAYS = (datetime(2025, 9, 11), datetime(2025, 9, 12))
+# (1日目のみ, 2日目のみ, 両日) の割合
+ATTENDANCE_WEIGHTS = (0.45, 0.35, 0.20)
+# 時刻 -> 重み（9時台〜17時台）。登録と完了の両方に使う
+HOUR_WEIGHTS = {9: 0.8, 10: 1.6, 11: 1.2, 12: 0.6, 13: 1.0, 14: 1.1, 15: 0.9, 16: 0.6, 17: 0.2}
+# 熱心さ（ミッションを完了する割合の基準）のベータ分布。平均は約0.19
+ENGAGEMENT_ALPHA = 0.7
+ENGAGEMENT_BETA = 3.0
+TYPE_POPULARITY = {"quiz": 1.3, "swt": 1.0, "sns": 0.6}
+
+# COPY でまとめて送るユーザー数
+COPY_CHUNK_USERS = 20_000
+
+
+def username_for(user_id: int) -> str:
+    """合成参加者のユーザー名"""
+    return f"attendee{user_id:06d}"
+
+
+def task_weights(tasks: list[dict]) -> list[tuple[int, float]]:
+    """ミッションごとの (ID, 人気の重み)。重みの平均は1"""
+    raw = []
+    position = {}
+    for task in tasks:
+        task_type = task.get("type")
+        position[task_type] = position.get(task_type, 0) + 1
+        # 同じ種別の中では後ろのミッションほど完了されにくい
+        raw.append((task["id"], TYPE_POPULARITY.get(task_type, 1.0) / position[task_type] ** 0.35))
+    mean = sum(weight for _, weight in raw) / len(raw)
+    return [(task_id, weight / mean) for task_id, weight in raw]
+
+
+# 開始時刻（時）-> (その時刻以降の時刻のリスト, 累積重み)
+_HOUR_TABLES = {
+    start: (
+        [hour for hour in HOUR_WEIGHTS if hour >= start],
+        list(itertools.accumulate(HOUR_WEIGHTS[hour] for hour in HOUR_WEIGHTS if hour >= start)),
+    )
+    for start in HOUR_WEIGHTS
+}
+
+
+def _random_seconds(rng: random.Random, after: int = None) -> int:
+    """開催時間内で HOUR_WEIGHTS に沿った時刻（0時からの秒）。after を渡すとそれより後"""
+    hours, cum_weights = _HOUR_TABLES[min(HOUR_WEIGHTS) if after is None else after // 3600]
+    hour = hours[bisect.bisect(cum_weights, rng.random() * cum_weights[-1])]
+    seconds = hour * 3600 + int(rng.random() * 3600)
+    if after is not None and seconds <= after:
+        seconds = after + 1 + int(rng.random() * 600)
+    return seconds
+
+
+def _timestamp(day: str, seconds: int) -> str:
+    """COPY 用のタイムスタンプ文字列（datetime の計算を避けて速く作る）"""
+    return f"{day} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def generate_attendees(users: int, tasks: list[dict], seed: int = 42, first_id: int = 1):
+    """(ユーザー行, 完了行のリスト) を1人ずつ返すジェネレーター
+
+    ユーザー行は (id, username, created_at)、完了行は (user_id, task_id, completed_at)。
+    時刻は COPY にそのまま渡せる文字列。
+    """
+    rng = random.Random(seed)
+    weights = task_weights(tasks)
+    attendance_choices = ((0,), (1,), (0, 1))
+    day_labels = [f"{day:%Y-%m-%d}" for day in EVENT_DAYS]
+    for user_id in range(first_id, first_id + users):
+        attendance = rng.choices(attendance_choices, weights=ATTENDANCE_WEIGHTS)[0]
+        first_day = day_labels[attendance[0]]
+        registered = _random_seconds(rng)
+        created_at = _timestamp(first_day, registered)
+
+        engagement = rng.betavariate(ENGAGEMENT_ALPHA, ENGAGEMENT_BETA)
+        progress = []
+        for task_id, weight in weights:
+            if rng.random() < engagement * weight:
+                day = day_labels[attendance[int(rng.random() * len(attendance))]]
+                # 登録した日は登録より後、もう一方の日はその日の開催時間内
+                seconds = _random_seconds(rng, after=registered if day is first_day else None)
+                progress.append((user_id, task_id, _timestamp(day, seconds)))
+        yield (user_id, username_for(user_id), created_at), progress
+
+
+def _copy_rows(cur, table: str, columns: str, rows: list[tuple]):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+
+
+def load_attendees(conn, users: int, seed: int = 42, tasks: list[dict] = None,
+                   replace: bool = False) -> tuple[int, int]:
+    """合成参加者を COPY で投入し、(ユーザー数, 完了数) を返す（コミットは呼び出し側）
+
+    tasks を省略すると tasks.yml のミッションを使い、DBに無ければ追加する。
+    replace=True なら既存の users / progress を空にしてから入れる。
+    そうでなければ既存ユーザーの最大IDの続きから追加する。
+    """
+    if tasks is None:
+        tasks = load_tasks_from_yaml(os.path.join(APP_DIR, "tasks.yml"))
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO tasks (id, title, task_type, description, content)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO NOTHING
+            """,
+            [
+                (task["id"], task["title"], task.get("type"), task.get("description"),
+                 json.dumps(task["content"]) if task.get("content") else None)
+                for task in tasks
+            ]
+        )
+        if replace:
+            cur.execute("TRUNCATE progress, users RESTART IDENTITY")
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+        first_id = cur.fetchone()[0] + 1
+
+        user_rows, progress_rows = [], []
+        progress_count = 0
+        for user_row, progress in generate_attendees(users, tasks, seed, first_id):
+            user_rows.append(user_row)
+            progress_rows.extend(progress)
+            if len(user_rows) >= COPY_CHUNK_USERS:
+                _copy_rows(cur, "users", "id, username, created_at", user_rows)
+                _copy_rows(cur, "progress", "user_id, task_id, completed_at", progress_rows)
+                progress_count += len(progress_rows)
+                user_rows, progress_rows = [], []
+        if user_rows:
+            _copy_rows(cur, "users", "id, username, created_at", user_rows)
+            _copy_rows(cur, "progress", "user_id, task_id, completed_at", progress_rows)
+            progress_count += len(progress_rows)
+        # ID を明示して入れたので、アプリからの登録が重複しないようシーケンスを進める
+        cur.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), GREATEST(MAX(id), 1)) FROM users")
+    return users, progress_count
+
+
+def create_schema(conn, schema: str):
+    """schema（無ければ作成）にテーブルとマイグレーションを用意し、search_path をそこに向ける"""
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        cur.execute(f"SET search_path = {schema}")
+        cur.execute(CREATE_USERS_TABLE_SQL)
+        cur.execute(CREATE_TASKS_TABLE_SQL)
+        cur.execute(CREATE_PROGRESS_TABLE_SQL)
+    apply_migrations(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="synthetic attendee generator")
+    parser.add_argument("--users", type=int, default=100_000, help="生成する参加者数")
+    parser.add_argument("--seed", type=int, default=42, help="乱数のシード")
+    parser.add_argument("--schema", default="public", help="投入先のスキーマ（無ければ作成）")
+    parser.add_argument("--replace", action="store_true",
+                        help="既存の users / progress を空にしてから入れる（public 以外の --schema が必要）")
+    args = parser.parse_args()
+    if args.replace and args.schema.lower() == "public":
+        parser.error("--replace は public の users / progress を消すため使えません。専用の --schema を指定してください")
+
+    conn = psycopg2.connect(**load_connection_params())
+    try:
+        create_schema(conn, args.schema)
+        start = time.perf_counter()
+        users, progress = load_attendees(conn, args.users, seed=args.seed, replace=args.replace)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE users, tasks, progress")
+    finally:
+        conn.close()
+    print(f"{args.schema}: users {users:,} / progress {progress:,} を {elapsed:.1f}秒で投入"
+          f"（{(users + progress) / elapsed:,.0f} 行/秒）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+AppTest 負荷試験のテスト
+"""
+import psycopg2
+
+from apptest_load import ACTIONS, run_level
+from benchmark import prepare_schema
+
+
+def test_single_session_runs_every_action(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "apptest_test")
+    try:
+        prepare_schema("apptest_test", 200)
+        level = run_level(1, 1, 1, 200)
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS apptest_test CASCADE")
+        conn.commit()
+        conn.close()
+
+    assert level["sessions"] == 1
+    assert set(level["actions"]) == set(ACTIONS)
+    for action in ACTIONS:
+        assert level["actions"][action]["n"] == 1, level["error_messages"]
+        assert level["actions"][action]["errors"] == 0
+    assert level["script_errors"] == 0
+    assert level["memory"]["per_session_mb"] is not None
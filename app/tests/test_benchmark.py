@@ -0,0 +1,72 @@
+"""
+ベンチマークハーネスのテスト
+"""
+import psycopg2
+import pytest
+
+from benchmark import compare_results, measure, prepare_schema, run_benchmarks, summarize
+
+SCENARIOS = {"service_construction", "catalog_sync", "dashboard_load", "ranking", "login", "completion"}
+
+
+def test_summary_percentiles_are_in_milliseconds():
+    summary = summarize([i * 1_000_000 for i in range(1, 101)])
+    assert summary["n"] == 100
+    assert summary["min_ms"] == 1 and summary["max_ms"] == 100
+    assert summary["p50_ms"] == pytest.approx(50.5)
+    assert summary["p95_ms"] == pytest.approx(95.05)
+    assert summary["p99_ms"] == pytest.approx(99.01)
+
+
+def test_measure_skips_warmup_and_counts_errors():
+    calls = []
+
+    def function(i):
+        calls.append(i)
+        if i == 3:
+            raise RuntimeError("boom")
+
+    result = measure(function, n=5, warmup=2)
+    assert calls == list(range(7))
+    assert result["n"] == 4 and result["errors"] == 1
+    assert result["first_call_ms"] is not None
+
+
+def result(p50: float, p95: float, errors: int = 0) -> dict:
+    return {"p50_ms": p50, "p95_ms": p95, "p99_ms": p95, "errors": errors}
+
+
+def test_regressions_respect_threshold_and_noise_floor():
+    baseline = {"results": {
+        "ranking": result(10.0, 20.0),
+        "login": result(0.10, 0.12),
+        "completion": result(1.0, 2.0),
+    }}
+    current = {"results": {
+        "ranking": result(11.5, 30.0),    # p95 が +50%
+        "login": result(0.13, 0.15),      # +30% だが差は 0.05ms 未満
+        "completion": result(1.0, 2.0, errors=2),
+        "dashboard_load": result(5.0, 6.0),  # ベースラインに無い
+    }}
+    assert compare_results(baseline, current, threshold=0.2) == [
+        "ranking: p95_ms 20.000ms -> 30.000ms (+50%)",
+        "completion: errors 0 -> 2",
+    ]
+
+
+def test_every_scenario_runs_against_a_seeded_schema(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "benchmark_test")
+    try:
+        prepare_schema("benchmark_test", 200)
+        results = run_benchmarks(200, n=3, warmup=1, log=lambda line: None)
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS benchmark_test CASCADE")
+        conn.commit()
+        conn.close()
+
+    assert set(results["results"]) == SCENARIOS
+    assert all(r["errors"] == 0 and r["n"] == 3 for r in results["results"].values())
+    assert results["meta"]["schema"] == "benchmark_test"
+    assert results["meta"]["attendees"] == 200
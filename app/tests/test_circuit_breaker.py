@@ -0,0 +1,162 @@
+"""
+circuit_breaker モジュールのテスト
+"""
+import os
+import threading
+import time
+
+import psycopg2
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import task_db
+import tasks
+from apptest_load import APP_DIR
+from circuit_breaker import (
+    CircuitBreaker, CircuitOpenError, QueryTimeoutError, ReadOnlyCache, STATE_CLOSED, STATE_OPEN,
+)
+from user import BUSY_MESSAGE, User
+
+
+def failing_connect():
+    raise psycopg2.OperationalError("could not connect to server")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3)
+    for _ in range(3):
+        with pytest.raises(psycopg2.OperationalError):
+            breaker.call(failing_connect)
+    assert breaker.state == STATE_OPEN
+
+    # 開いた後は接続を試さずに即失敗する
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: calls.append(1))
+    assert calls == []
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    with pytest.raises(psycopg2.OperationalError):
+        breaker.call(failing_connect)
+    assert breaker.call(lambda: "ok") == "ok"
+    with pytest.raises(psycopg2.OperationalError):
+        breaker.call(failing_connect)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_non_connection_errors_do_not_trip():
+    breaker = CircuitBreaker(failure_threshold=1)
+    with pytest.raises(ValueError):
+        breaker.call(lambda: int("x"))
+    assert breaker.state == STATE_CLOSED
+
+
+def test_background_probe_closes_breaker_on_recovery():
+    recovered = threading.Event()
+
+    def probe():
+        if not recovered.is_set():
+            raise psycopg2.OperationalError("still down")
+
+    breaker = CircuitBreaker(failure_threshold=1, probe_interval=0.01, probe=probe)
+    with pytest.raises(psycopg2.OperationalError):
+        breaker.call(failing_connect)
+    time.sleep(0.05)
+    assert breaker.state == STATE_OPEN
+    assert breaker.last_error == "still down"
+
+    recovered.set()
+    deadline = time.monotonic() + 2
+    while breaker.state == STATE_OPEN and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.call(lambda: "ok") == "ok"
+
+
+def test_read_only_cache_serves_last_snapshot():
+    cache = ReadOnlyCache()
+    tasks = [{"id": 1, "title": "a", "completed": True}, {"id": 2, "title": "b", "completed": False}]
+    cache.remember_snapshot(10, {"tasks": tasks, "rank": {"rank": 1, "total_users": 5}, "task_stats": {1: 3}})
+
+    snapshot = cache.dashboard_snapshot(10)
+    assert [task["completed"] for task in snapshot["tasks"]] == [True, False]
+    assert snapshot["rank"] == {"rank": 1, "total_users": 5}
+    assert snapshot["as_of"] is not None
+
+    # 他のユーザーには同じタスク一覧を未完了として見せる
+    other = cache.dashboard_snapshot(11)
+    assert [task["completed"] for task in other["tasks"]] == [False, False]
+    assert other["rank"] is None
+
+
+def test_read_only_cache_falls_back_to_yaml_catalog():
+    snapshot = ReadOnlyCache().dashboard_snapshot(1)
+    assert snapshot["tasks"]
+    assert snapshot["as_of"] is None
+    assert not any(task["completed"] for task in snapshot["tasks"])
+
+
+def test_read_only_cache_remembers_ranking():
+    cache = ReadOnlyCache()
+    assert cache.ranking() == (None, None)
+    cache.remember_ranking([{"username": "a", "completed_tasks": 3}])
+    ranking, as_of = cache.ranking()
+    assert ranking == [{"username": "a", "completed_tasks": 3}]
+    assert as_of is not None
+
+
+class FlakyDashboardService:
+    """ダッシュボードの読み出しだけ失敗し、完了登録は通るタスクサービス"""
+
+    def __init__(self, read_error: Exception):
+        self.read_error = read_error
+        self.completed = []
+
+    def get_dashboard_snapshot(self, user_id, aggregates=False):
+        raise self.read_error
+
+    def mark_task_complete_and_count(self, task_id, user_id):
+        self.completed.append((task_id, user_id))
+        return len(self.completed)
+
+
+def run_dashboard(service, monkeypatch):
+    """読み出しに失敗するダッシュボードを開き、SWTミッションを1つ完了する"""
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    monkeypatch.setattr(task_db, "TaskService", lambda: None)
+    monkeypatch.setattr(tasks, "sync_yaml_to_db", lambda path: None)
+    monkeypatch.setattr(task_db, "get_task_service", lambda: service)
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "pages", "dashboard.py"), default_timeout=10)
+    at.session_state["user_info"] = {"name": "guest", "intent": "login", "user": User(id=1, username="guest")}
+    at.run()
+    assert not at.exception
+    warnings = [warning.value for warning in at.warning]
+
+    open_button = next(button for button in at.button if button.key and button.key.startswith("swt_btn_"))
+    task_id = int(open_button.key.rsplit("_", 1)[1])
+    open_button.click().run()
+    next(button for button in at.button if button.key == f"complete_swt_{task_id}").click().run()
+    assert not at.exception
+    return warnings, task_id
+
+
+def test_dashboard_still_completes_missions_when_the_read_falls_back(monkeypatch):
+    service = FlakyDashboardService(psycopg2.OperationalError("server closed the connection unexpectedly"))
+
+    warnings, task_id = run_dashboard(service, monkeypatch)
+
+    assert any("読み取り専用モード" in warning for warning in warnings)
+    assert service.completed == [(task_id, 1)]
+
+
+def test_dashboard_query_timeout_is_busy_not_read_only(monkeypatch):
+    service = FlakyDashboardService(QueryTimeoutError("canceling statement due to statement timeout"))
+
+    warnings, task_id = run_dashboard(service, monkeypatch)
+
+    assert BUSY_MESSAGE in warnings
+    assert not any("読み取り専用モード" in warning for warning in warnings)
+    assert service.completed == [(task_id, 1)]
@@ -0,0 +1,84 @@
+"""
+completion_journal モジュールのテスト
+"""
+import os
+from datetime import datetime
+
+import psycopg2
+
+from completion_journal import RECORD, CompletionJournal, JournalPosition
+from test_completion_writer import RecordingWriter
+
+COMPLETED_AT = datetime(2025, 9, 11, 10, 30, 15, 123456)
+
+
+def test_appended_records_survive_reopen(tmp_path):
+    journal = CompletionJournal(str(tmp_path))
+    journal.append(1, 10, COMPLETED_AT)
+    position = journal.append(2, 20, COMPLETED_AT)
+    journal.close()
+
+    reopened = CompletionJournal(str(tmp_path))
+    records = reopened.pending()
+
+    assert [(r.user_id, r.task_id, r.completed_at) for r in records] == [
+        (1, 10, COMPLETED_AT), (2, 20, COMPLETED_AT)
+    ]
+    assert records[-1].position == position
+    # 追記は既存レコードの後ろから続く
+    assert reopened.append(3, 30, COMPLETED_AT).offset == position.offset + RECORD.size
+
+
+def test_checkpoint_hides_applied_records_and_drops_old_segments(tmp_path):
+    journal = CompletionJournal(str(tmp_path), segment_size=RECORD.size * 2)
+    positions = [journal.append(user_id, 1, COMPLETED_AT) for user_id in range(5)]
+    assert len(os.listdir(tmp_path)) == 3
+
+    journal.mark_applied(positions[2])
+    journal.mark_applied(positions[1])  # 巻き戻しは無視
+
+    assert [r.user_id for r in journal.pending()] == [3, 4]
+    assert sorted(os.listdir(tmp_path)) == ["checkpoint", "journal-00000002.seg", "journal-00000003.seg"]
+    journal.close()
+    assert CompletionJournal(str(tmp_path)).checkpoint == positions[2]
+
+
+def test_torn_tail_record_is_ignored_and_overwritten(tmp_path):
+    journal = CompletionJournal(str(tmp_path))
+    journal.append(1, 10, COMPLETED_AT)
+    torn = journal.append(2, 20, COMPLETED_AT)
+    journal.close()
+
+    # 2件目の書き込み途中で電源が落ちた状態を再現
+    path = tmp_path / "journal-00000001.seg"
+    data = bytearray(path.read_bytes())
+    data[torn.offset - 6] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    reopened = CompletionJournal(str(tmp_path))
+    assert [r.user_id for r in reopened.pending()] == [1]
+    assert reopened.append(3, 30, COMPLETED_AT) == JournalPosition(1, torn.offset)
+    assert [r.user_id for r in reopened.pending()] == [1, 3]
+
+
+def test_writer_replays_unapplied_completions_once(tmp_path):
+    # DBに書けないまま終了したプロセス
+    down = RecordingWriter(fail_times=100, journal=CompletionJournal(str(tmp_path)))
+    down.submit(task_id=1, user_id=7)
+    down.submit(task_id=2, user_id=7)
+    down.submit(task_id=1, user_id=7)
+    try:
+        down.flush()
+    except psycopg2.OperationalError:
+        pass
+    down.journal.close()
+
+    # 再起動後はジャーナルから再送し、重複はまとめて1回だけ書く
+    restarted = RecordingWriter(journal=CompletionJournal(str(tmp_path)))
+    assert restarted.pending_task_ids(7) == {1, 2}
+    assert restarted.flush()
+    assert [[row[:2] for row in batch] for batch in restarted.batches] == [[(7, 1), (7, 2)]]
+    assert restarted.journal.pending() == []
+    restarted.close()
+
+    assert CompletionJournal(str(tmp_path)).pending() == []
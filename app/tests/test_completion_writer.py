@@ -0,0 +1,178 @@
+"""
+completion_writer モジュールのテスト
+"""
+import time
+
+import psycopg2
+
+from completion_writer import CompletionWriter, WriteBehindTaskService
+
+
+class RecordingWriter(CompletionWriter):
+    """DBの代わりに書き込んだバッチを記録するライター"""
+
+    def __init__(self, fail_times: int = 0, rejected_tasks=(), **options):
+        super().__init__(connection_params={}, **options)
+        self.batches = []
+        self.fail_times = fail_times
+        # 存在しないタスクとして外部キー違反にするタスクID
+        self.rejected_tasks = set(rejected_tasks)
+
+    def write_batch(self, rows):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise psycopg2.OperationalError("database is down")
+        if any(row[1] in self.rejected_tasks for row in rows):
+            raise psycopg2.IntegrityError("violates foreign key constraint")
+        self.batches.append(list(rows))
+
+
+class FakeTaskService:
+    def __init__(self, completed=()):
+        self.completed = set(completed)
+        self.reads = 0
+
+    def get_tasks_with_progress(self, user_id):
+        self.reads += 1
+        return [{"id": task_id, "completed": task_id in self.completed} for task_id in (1, 2, 3)]
+
+    def get_dashboard_snapshot(self, user_id, aggregates=False):
+        return {"tasks": self.get_tasks_with_progress(user_id), "rank": None, "task_stats": {}}
+
+
+def test_completions_are_batched_into_one_write():
+    writer = RecordingWriter(flush_interval=0.05)
+    writer.start()
+    try:
+        for user_id in range(100):
+            writer.submit(task_id=1, user_id=user_id)
+        assert writer.flush(timeout=5)
+    finally:
+        writer.close()
+
+    assert len(writer.batches) == 1
+    assert [row[0] for row in writer.batches[0]] == list(range(100))
+    assert writer.pending_task_ids(0) == set()
+
+
+def test_batches_respect_max_batch():
+    writer = RecordingWriter(max_batch=10)
+    for user_id in range(25):
+        writer.submit(task_id=1, user_id=user_id)
+
+    # ワーカーなしでも flush で書き切れる
+    assert writer.flush()
+    assert [len(batch) for batch in writer.batches] == [10, 10, 5]
+
+
+def test_failed_batch_is_requeued_and_retried():
+    writer = RecordingWriter(fail_times=2, retry_interval=0.01)
+    writer.start()
+    try:
+        writer.submit(task_id=2, user_id=7)
+        assert writer.pending_task_ids(7) == {2}
+        assert writer.flush(timeout=5)
+    finally:
+        writer.close()
+
+    assert [row[:2] for row in writer.batches[0]] == [(7, 2)]
+    assert writer.pending_task_ids(7) == set()
+
+
+def test_rejected_rows_are_dropped_without_blocking_the_queue():
+    writer = RecordingWriter(rejected_tasks={99})
+    writer.submit(task_id=1, user_id=1)
+    writer.submit(task_id=99, user_id=2)
+    writer.submit(task_id=2, user_id=3)
+
+    assert writer.flush(timeout=5)
+    assert [row[:2] for batch in writer.batches for row in batch] == [(1, 1), (3, 2)]
+    assert writer.pending_task_ids(2) == set()
+
+    # 捨てた行が先頭に残らず、後続の完了は通常どおり1文で書ける
+    writer.submit(task_id=3, user_id=4)
+    assert writer.flush(timeout=5)
+    assert [row[:2] for row in writer.batches[-1]] == [(4, 3)]
+
+
+def test_close_flushes_queued_completions():
+    writer = RecordingWriter(flush_interval=10)
+    writer.start()
+    writer.submit(task_id=3, user_id=1)
+    writer.close(timeout=5)
+
+    assert sum(len(batch) for batch in writer.batches) == 1
+
+
+def test_write_behind_service_reflects_pending_completions():
+    writer = RecordingWriter()
+    inner = FakeTaskService(completed={1})
+    service = WriteBehindTaskService(inner, writer)
+
+    assert service.get_dashboard_snapshot(5)["tasks"][1]["completed"] is False
+    reads = inner.reads
+
+    assert service.mark_task_complete_and_count(2, 5) == 2
+    assert inner.reads == reads  # 完了数は直前の読み出し結果から計算する
+    assert [task["completed"] for task in service.get_tasks_with_progress(5)] == [True, True, False]
+
+
+def test_completions_are_accepted_while_the_database_is_down(tmp_path):
+    from circuit_breaker import DatabaseUnavailableError
+    from completion_journal import CompletionJournal
+
+    attempts = []
+
+    def database_down():
+        attempts.append(1)
+        raise DatabaseUnavailableError("could not connect to server")
+
+    writer = RecordingWriter(fail_times=100, journal=CompletionJournal(str(tmp_path)))
+    service = WriteBehindTaskService(None, writer, service_factory=database_down)
+
+    # 完了数の読み出しに失敗しても、受け付けた完了は失敗扱いにしない
+    assert service.mark_task_complete_and_count(2, 5) == 1
+    assert service.mark_task_complete_and_count(3, 5) == 2
+    assert [(record.user_id, record.task_id) for record in writer.journal.pending()] == [(5, 2), (5, 3)]
+    assert len(attempts) == 1  # 2回目は1回目の数え直しで足りる
+
+    # 復旧したら読み出し用のサービスを作り直す
+    service._service_factory = lambda: FakeTaskService(completed={1})
+    assert [task["completed"] for task in service.get_tasks_with_progress(5)] == [True, True, True]
+    writer.journal.close()
+
+
+def test_writes_to_postgres(pg_params, pg_task_ids):
+    user_id = 900_000_000 + time.time_ns() % 1_000_000
+    writer = CompletionWriter(pg_params)
+    writer.start()
+    try:
+        for task_id in pg_task_ids[:5]:
+            writer.submit(task_id, user_id)
+        writer.submit(pg_task_ids[0], user_id)  # 重複は無視される
+        assert writer.flush(timeout=10)
+    finally:
+        writer.close()
+
+    with psycopg2.connect(**pg_params) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT task_id FROM progress WHERE user_id = %s ORDER BY task_id", (user_id,))
+            assert [row[0] for row in cur.fetchall()] == sorted(pg_task_ids[:5])
+            cur.execute("DELETE FROM progress WHERE user_id = %s", (user_id,))
+
+
+def test_unknown_task_is_dropped_in_postgres(pg_params, pg_task_ids):
+    user_id = 900_000_000 + time.time_ns() % 1_000_000
+    writer = CompletionWriter(pg_params)
+    try:
+        writer.submit(pg_task_ids[0], user_id)
+        writer.submit(max(pg_task_ids) + 1_000_000, user_id)  # 外部キー違反
+        assert writer.flush(timeout=10)
+    finally:
+        writer.close()
+
+    with psycopg2.connect(**pg_params) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT task_id FROM progress WHERE user_id = %s", (user_id,))
+            assert [row[0] for row in cur.fetchall()] == [pg_task_ids[0]]
+            cur.execute("DELETE FROM progress WHERE user_id = %s", (user_id,))
@@ -0,0 +1,39 @@
+"""
+ダッシュボードのセッション状態のテスト
+"""
+from dashboard_state import DashboardState
+
+
+def test_only_one_mission_is_open_at_a_time():
+    state = DashboardState()
+    state.open_task(3)
+    state.open_task(7)
+    assert not state.is_open(3) and state.is_open(7)
+    state.close_task(3)
+    assert state.is_open(7)
+    state.close_task(7)
+    assert state.open_task_id is None
+
+
+def test_clear_dialog_then_reward_dialog_switches_to_incomplete_only():
+    state = DashboardState()
+    state.open_task(5)
+    state.mission_cleared(5, "雪だるまを作る", milestone=10)
+    assert state.open_task_id is None
+    assert state.cleared_task_title == "雪だるまを作る" and state.reward_milestone == 10
+
+    state.dismiss_clear_dialog()
+    assert state.cleared_task_title is None and not state.show_only_incomplete
+    state.dismiss_reward_dialog()
+    assert state.reward_milestone == 0 and state.show_only_incomplete
+
+
+def test_clear_without_milestone_switches_to_incomplete_only():
+    state = DashboardState()
+    state.mission_cleared(5, "クイズ")
+    state.dismiss_clear_dialog()
+    assert state.reward_milestone == 0 and state.show_only_incomplete
+
+
+def test_state_has_no_instance_dict():
+    assert not hasattr(DashboardState(), "__dict__")
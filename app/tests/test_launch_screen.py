@@ -0,0 +1,56 @@
+"""
+ログイン画面のテスト
+"""
+import psycopg2
+from streamlit.testing.v1 import AppTest
+
+from apptest_load import MAIN_SCRIPT
+from benchmark import prepare_schema
+from synthetic_attendees import username_for
+
+
+def test_login_redirects_on_the_next_run_without_blocking(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "launch_test")
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    try:
+        prepare_schema("launch_test", 10)
+        at = AppTest.from_file(MAIN_SCRIPT, default_timeout=3)
+        at.run()
+        at.text_input(key="user_name_input").input(username_for(1))
+        # 以前は4秒スリープしていたので default_timeout=3 を超えていた
+        next(b for b in at.button if b.label == "遊びに行く！").click().run()
+        assert not at.exception
+        assert at.success[0].value == f"おかえりなさい {username_for(1)} さん！"
+        assert at.session_state["redirect_pending"]
+
+        # run_every のタイマーによる次の実行に相当
+        at.run()
+        assert not at.exception
+        assert "redirect_pending" not in at.session_state
+        assert any(button.key == "top_nav_ranking" for button in at.button)
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS launch_test CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def test_unknown_user_is_told_to_register(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "launch_test")
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    try:
+        prepare_schema("launch_test", 10)
+        at = AppTest.from_file(MAIN_SCRIPT, default_timeout=10)
+        at.run()
+        at.text_input(key="user_name_input").input("not_registered_yet")
+        next(b for b in at.button if b.label == "遊びに行く！").click().run()
+
+        assert not at.exception
+        assert at.error[0].value == "「not_registered_yet」は登録されていません。新規登録してください。"
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS launch_test CASCADE")
+        conn.commit()
+        conn.close()
@@ -0,0 +1,41 @@
+"""
+負荷シミュレーターのテスト
+"""
+import psycopg2
+
+from load_simulator import OPERATIONS, pool_wait_summary, run_ramp
+from benchmark import prepare_schema
+from metrics import DB_POOL_WAIT_SECONDS
+
+
+def test_pool_wait_summary_uses_the_difference_between_snapshots():
+    buckets = len(DB_POOL_WAIT_SECONDS.buckets)
+    before = ([0] * buckets, 0.0, 0)
+    counts = [0] * buckets
+    counts[0] = 90      # <= 0.5ms
+    counts[6] = 10      # <= 100ms
+    after = (counts, 0.5, 100)
+    assert pool_wait_summary(before, after) == {"count": 100, "mean_ms": 5.0, "p95_le_ms": 100.0}
+    assert pool_wait_summary(after, after)["count"] == 0
+
+
+def test_short_ramp_exercises_the_whole_flow(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "load_test")
+    try:
+        prepare_schema("load_test", 200)
+        result = run_ramp([1, 3], 1.0, 200, log=lambda text: None, post_rate=1.0)
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS load_test CASCADE")
+        conn.commit()
+        conn.close()
+
+    assert [step["concurrency"] for step in result["steps"]] == [1, 3]
+    for step in result["steps"]:
+        assert step["sessions"] > 0
+        assert set(step["operations"]) == set(OPERATIONS)
+        assert step["operations"]["login"]["n"] > 0 and not step["operations"]["login"]["errors"]
+        assert step["operations"]["complete"]["n"] > 0 and not step["operations"]["complete"]["errors"]
+        assert step["pool_wait"]["count"] > 0
+        assert set(step["outcomes"]) <= {"post_accepted", "post_flood_limited", "post_rejected"}
@@ -0,0 +1,57 @@
+"""
+metrics モジュールのテスト
+"""
+import urllib.request
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, SessionActivity, start_metrics_server
+
+
+def test_render_counter_gauge_histogram():
+    registry = MetricsRegistry()
+    counter = Counter("demo_total", "Demo counter.", ["kind"], registry=registry)
+    gauge = Gauge("demo_in_use", "Demo gauge.", registry=registry)
+    histogram = Histogram("demo_seconds", "Demo histogram.", ["query"], buckets=(0.1, 1.0), registry=registry)
+
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    histogram.observe(0.05, query="q")
+    histogram.observe(0.5, query="q")
+    histogram.observe(5, query="q")
+
+    text = registry.render()
+    assert "# TYPE demo_total counter" in text
+    assert 'demo_total{kind="a\\"b"} 3.0' in text
+    assert "demo_in_use 1.0" in text
+    assert 'demo_seconds_bucket{query="q",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{query="q",le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{query="q",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{query="q"} 3' in text
+
+
+def test_metrics_server_serves_registry():
+    registry = MetricsRegistry()
+    Counter("served_total", "Served counter.", registry=registry).inc()
+    server = start_metrics_server(0, host="127.0.0.1", registry=registry)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode()
+        assert response.headers["Content-Type"].startswith("text/plain")
+        assert "served_total 1.0" in body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_session_activity_counts_recent_sessions():
+    activity = SessionActivity(window_seconds=60)
+    activity.touch("a", now=0)
+    activity.touch("b", now=30)
+    activity.touch("a", now=50)
+
+    assert activity.count(now=70) == 2
+    assert activity.count(now=100) == 1
+    assert activity.count(now=200) == 0
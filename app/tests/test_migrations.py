@@ -0,0 +1,95 @@
+"""
+migrations モジュールのテスト（PostgreSQLが必要）
+"""
+import time
+
+import psycopg2
+import pytest
+
+from migrations import MIGRATION_LOCK_ID, apply_migrations, prebuild_indexes
+from task_db import CREATE_TASKS_TABLE_SQL, CREATE_PROGRESS_TABLE_SQL
+
+SCHEMA = "migration_test"
+
+
+@pytest.fixture
+def connect(pg_params):
+    """migration_test スキーマ（マイグレーション前のテーブルだけ）を向いた接続を作る"""
+    admin = psycopg2.connect(**pg_params)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        cur.execute(f"SET search_path = {SCHEMA}")
+        cur.execute(CREATE_TASKS_TABLE_SQL)
+        cur.execute(CREATE_PROGRESS_TABLE_SQL)
+    connections = []
+
+    def factory():
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute(f"SET search_path = {SCHEMA}")
+        conn.commit()
+        connections.append(conn)
+        return conn
+
+    yield factory
+    for conn in connections:
+        conn.close()
+    with admin.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    admin.close()
+
+
+def progress_indexes(conn) -> dict:
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_class t ON t.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            WHERE n.nspname = %s AND t.relname = 'progress'
+        """, (SCHEMA,))
+        return dict(cur.fetchall())
+
+
+def test_concurrent_start_skips_instead_of_waiting(connect):
+    holder, starting = connect(), connect()
+    with holder.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+
+    start = time.perf_counter()
+    assert apply_migrations(starting, lock_timeout_ms=50) == []
+    starting.commit()
+    assert time.perf_counter() - start < 1
+
+    holder.rollback()
+    assert apply_migrations(starting) == [1]
+    starting.commit()
+
+
+def test_busy_table_postpones_the_migration(connect):
+    holder, starting = connect(), connect()
+    with holder.cursor() as cur:
+        # 書き込み中のトランザクション（インデックス作成・制約の削除はこれを待つ）
+        cur.execute("LOCK TABLE progress IN ROW EXCLUSIVE MODE")
+
+    assert apply_migrations(starting, lock_timeout_ms=50) == []
+    starting.commit()
+
+    holder.rollback()
+    assert apply_migrations(starting, lock_timeout_ms=50) == [1]
+    starting.commit()
+
+
+def test_prebuilt_index_is_reused_by_the_migration(connect):
+    conn = connect()
+
+    assert prebuild_indexes(conn) == ["progress_user_task_idx"]
+    assert prebuild_indexes(conn) == []
+    assert progress_indexes(conn)["progress_user_task_idx"] is True
+
+    conn.autocommit = False
+    assert apply_migrations(conn) == [1]
+    conn.commit()
+    assert set(progress_indexes(conn)) == {"progress_pkey", "progress_user_task_idx"}
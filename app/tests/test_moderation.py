@@ -0,0 +1,181 @@
+"""
+moderation モジュールのテスト
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from moderation import (
+    ACTION_ALLOW, ACTION_HOLD, ACTION_REJECT, REASON_DUPLICATE, REASON_GLOBAL_RATE, REASON_USER_RATE,
+    AhoCorasick, FloodGuard, NgWordFilter, check_moderator_passphrase, estimate_similarity, is_moderator, minhash_sketch,
+    normalize_text
+)
+
+
+def test_normalize_folds_width_case_and_kana():
+    assert normalize_text("ＡＢＣ") == "abc"
+    assert normalize_text("ﾊﾞｶ") == "ばか"
+    assert normalize_text("カタカナ") == "かたかな"
+    assert normalize_text("ば　か・や-ろ う") == "ばかやろう"
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    matcher = AhoCorasick(["he", "she", "his", "hers"])
+
+    found = matcher.find_all("ushers")
+
+    assert {matcher.patterns[i] for i in found} == {"he", "she", "hers"}
+
+
+def test_aho_corasick_follows_failure_links():
+    matcher = AhoCorasick(["abcd", "bc", "c"])
+
+    assert {matcher.patterns[i] for i in matcher.find_all("xabcx")} == {"bc", "c"}
+    assert matcher.find_all("") == set()
+
+
+def test_filter_rejects_before_holding():
+    ng_filter = NgWordFilter(reject_words=["バカヤロウ"], hold_words=["https://", "副業"])
+
+    assert ng_filter.scan("質問です").action == ACTION_ALLOW
+    assert ng_filter.scan("副業の案内 https://example.com").action == ACTION_HOLD
+    result = ng_filter.scan("ﾊﾞｶ ﾔﾛｳ！副業")
+    assert result.action == ACTION_REJECT
+    assert result.matches == ["ばかやろう", "副業"]
+
+
+def test_filter_loads_yaml(tmp_path):
+    path = tmp_path / "ng.yml"
+    path.write_text("reject:\n  - 死ね\nhold:\n  - 電話番号\n", encoding="utf-8")
+
+    ng_filter = NgWordFilter.from_yaml(str(path))
+
+    assert ng_filter.scan("電話番号を教えて").action == ACTION_HOLD
+
+
+def test_moderators_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("MODERATORS", " yuki , sora,")
+
+    assert is_moderator("yuki") and is_moderator("sora")
+    assert not is_moderator("hana")
+    assert not is_moderator("")
+
+
+def test_moderator_passphrase_is_required(monkeypatch):
+    monkeypatch.delenv("MODERATOR_PASSPHRASE", raising=False)
+    # 未設定なら確認画面は誰も使えない
+    assert not check_moderator_passphrase("anything")
+
+    monkeypatch.setenv("MODERATOR_PASSPHRASE", "snow-secret")
+    assert check_moderator_passphrase("snow-secret")
+    assert not check_moderator_passphrase("snow-secre")
+    assert not check_moderator_passphrase("")
+
+
+def test_flood_guard_check_and_record_is_atomic():
+    guard = FloodGuard(per_user_limit=1, per_user_window=60, global_limit=1000)
+    barrier = threading.Barrier(8)
+
+    def submit(i):
+        barrier.wait()
+        return guard.check_and_record(1, f"同時に送った{i}番目の別々の質問です {i * 7919}").allowed
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(submit, range(8)))
+
+    assert results.count(True) == 1
+
+
+def test_flood_guard_cancel_releases_a_failed_submission():
+    guard = FloodGuard(per_user_limit=1, per_user_window=60)
+    message = "送信に失敗した質問をもう一度送ります"
+
+    result = guard.check_and_record(1, message)
+    assert result.allowed
+    guard.cancel(result.record)
+
+    assert guard.check_and_record(1, message).allowed
+    assert guard.check_and_record(1, message).reason == REASON_USER_RATE
+
+
+def test_flood_guard_cancel_removes_only_its_own_record():
+    clock = FakeClock()
+    guard = FloodGuard(per_user_limit=2, per_user_window=60, global_limit=2, clock=clock)
+    failed = guard.check_and_record(1, "受付に失敗する方の質問です")
+    clock.now += 1
+    accepted = guard.check_and_record(1, "並行して送って受け付けられた別の質問")
+    assert failed.allowed and accepted.allowed
+
+    # 後から記録された投稿ではなく、失敗した投稿の記録だけが外れる
+    guard.cancel(failed.record)
+    assert guard.check(2, "受付に失敗する方の質問です").allowed
+    assert guard.check(2, "並行して送って受け付けられた別の質問").reason == REASON_DUPLICATE
+    result = guard.check_and_record(1, "三つ目のまた違う質問")
+    assert result.allowed
+    assert guard.check(1, "四つ目のさらに違う質問").retry_after == 60
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_flood_guard_limits_each_user():
+    clock = FakeClock()
+    guard = FloodGuard(per_user_limit=2, per_user_window=60, clock=clock)
+
+    for i in range(2):
+        assert guard.check(1, f"質問その{i}は全く別の内容です").allowed
+        guard.record(1, f"質問その{i}は全く別の内容です")
+
+    result = guard.check(1, "三つ目のまた違う質問")
+    assert not result.allowed
+    assert result.reason == REASON_USER_RATE
+    assert result.retry_after == 60
+    assert guard.check(2, "三つ目のまた違う質問").allowed
+
+    clock.now = 61
+    assert guard.check(1, "三つ目のまた違う質問").allowed
+
+
+def test_flood_guard_limits_globally():
+    clock = FakeClock()
+    guard = FloodGuard(global_limit=3, global_window=10, clock=clock)
+    for user_id in range(3):
+        guard.record(user_id, f"user {user_id} asks something unique #{user_id * 7919}")
+
+    assert guard.check(99, "another question").reason == REASON_GLOBAL_RATE
+
+
+def test_flood_guard_detects_near_duplicates_across_users():
+    clock = FakeClock()
+    guard = FloodGuard(duplicate_window=600, clock=clock)
+    original = "Snowflakeの動的テーブルはどのくらいの頻度でリフレッシュされますか？運用時の注意点も知りたいです。"
+    guard.record(1, original)
+
+    assert guard.check(2, original.replace("Snowflake", "ＳＮＯＷＦＬＡＫＥ")).reason == REASON_DUPLICATE
+    assert guard.check(2, original + "！").reason == REASON_DUPLICATE
+    assert guard.check(2, "Streamlit in Snowflakeでのキャッシュの使い分けを教えてください").allowed
+
+    clock.now = 601
+    assert guard.check(2, original).allowed
+
+
+def test_flood_guard_memory_is_bounded():
+    clock = FakeClock()
+    guard = FloodGuard(max_users=100, max_recent=50, clock=clock)
+    for user_id in range(1000):
+        clock.now += 0.01
+        guard.record(user_id, f"question number {user_id} about topic {user_id * 31}")
+
+    assert guard.tracked_users() <= 100
+    assert len(guard._recent) == 50
+    assert len(guard._recent_digests) == 50
+
+
+def test_minhash_similarity_estimates_jaccard():
+    a = minhash_sketch("the quick brown fox jumps over the lazy dog")
+    assert estimate_similarity(a, a) == 1.0
+    assert estimate_similarity(a, minhash_sketch("completely unrelated text here")) < 0.2
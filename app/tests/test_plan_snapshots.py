@@ -0,0 +1,60 @@
+"""
+クエリプランのスナップショット比較テスト
+規模ごとに合成データを作り、tests/plan_snapshots/ のプランから回帰していないことを確かめる。
+意図してプランを変えたときは `python tests/plan_regression.py --update` で更新する。
+"""
+import copy
+
+import psycopg2
+import pytest
+
+from plan_regression import (
+    PLAN_QUERIES, SCALES, capture_plans, compare_plans, drop_schema, load_snapshot, seed_schema,
+)
+
+
+@pytest.fixture(scope="module", params=sorted(SCALES))
+def scale_plans(request, pg_params):
+    """(規模名, その規模で取った現在のプラン)"""
+    scale = request.param
+    schema = f"plan_{scale}"
+    conn = psycopg2.connect(**pg_params)
+    try:
+        seed_schema(conn, schema, SCALES[scale])
+        plans = capture_plans(conn, SCALES[scale])
+    finally:
+        drop_schema(conn, schema)
+        conn.close()
+    return scale, plans
+
+
+def test_snapshots_cover_every_query():
+    for scale in SCALES:
+        snapshot = load_snapshot(scale)
+        assert snapshot is not None, scale
+        assert set(snapshot["queries"]) == set(PLAN_QUERIES)
+
+
+def test_plans_match_snapshots(scale_plans):
+    scale, plans = scale_plans
+    problems = compare_plans(load_snapshot(scale), plans)
+    assert not problems, f"{scale}:\n" + "\n".join(problems)
+
+
+def test_new_seq_scan_and_cost_growth_are_reported():
+    snapshot = load_snapshot("large")
+    current = copy.deepcopy(snapshot)
+    current["queries"]["login_user"] = {
+        "total_cost": 2000.0,
+        "plan": {"Node Type": "Seq Scan", "Relation Name": "users"},
+    }
+    current["queries"]["user_ranking"]["total_cost"] *= 2
+
+    problems = compare_plans(snapshot, current)
+    assert any(p.startswith("login_user: users に新しい Seq Scan") for p in problems)
+    assert any(p.startswith("user_ranking: 推定コストが") for p in problems)
+    assert not any(p.startswith("tasks_with_progress") for p in problems)
+
+    # Postgres のメジャーバージョンが違えばコストは比べない
+    current["postgres"] = snapshot["postgres"] + 1
+    assert not any(p.startswith("user_ranking") for p in compare_plans(snapshot, current))
@@ -0,0 +1,101 @@
+"""
+接続プールとサーバー側プリペアドステートメントのテスト
+"""
+import time
+
+import psycopg2
+import pytest
+
+from task_db import (
+    ConnectionPool, TASKS_WITH_PROGRESS_SQL, _to_prepared_sql, execute_prepared,
+)
+from user import GET_OR_CREATE_USER_SQL
+
+
+def test_positional_and_named_params_are_numbered():
+    assert _to_prepared_sql("SELECT %s, %s") == ("SELECT $1, $2", [0, 1])
+
+    sql, keys = _to_prepared_sql(GET_OR_CREATE_USER_SQL)
+    assert keys == ["username"]
+    assert "%(username)s" not in sql and sql.count("$1") == 2
+
+
+@pytest.fixture
+def pool(pg_params):
+    pool = ConnectionPool(2, wait_timeout=0.5, **pg_params)
+    yield pool
+    pool.closeall()
+
+
+def server_prepared(conn) -> set:
+    with conn.cursor() as cur:
+        cur.execute("SELECT name FROM pg_prepared_statements")
+        return {row[0] for row in cur.fetchall()}
+
+
+def test_statement_is_prepared_once_per_connection(pool, pg_task_ids):
+    for _ in range(3):
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_prepared(cur, "tasks_with_progress", TASKS_WITH_PROGRESS_SQL, (1,))
+                assert len(cur.fetchall()) >= len(pg_task_ids)
+            first_conn = conn
+
+    # 同じ接続が使い回され、サーバー側にも1つだけ準備されている
+    with pool.connection() as conn:
+        assert conn is first_conn
+        assert conn.prepared == {"tasks_with_progress"}
+        assert server_prepared(conn) == {"tasks_with_progress"}
+
+
+def test_failed_connection_is_discarded(pool):
+    with pytest.raises(psycopg2.errors.DivisionByZero):
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_prepared(cur, "broken", "SELECT 1 / %s", (0,))
+    assert conn.closed
+
+    with pool.connection() as fresh:
+        assert fresh is not conn
+        assert fresh.prepared == set()
+
+
+def test_pool_waits_for_a_free_connection(pool):
+    from circuit_breaker import DB_UNAVAILABLE_ERRORS, PoolExhaustedError
+
+    with pool.connection(), pool.connection():
+        start = time.perf_counter()
+        with pytest.raises(PoolExhaustedError) as excinfo:
+            with pool.connection():
+                pass
+        assert time.perf_counter() - start >= 0.5
+    # 混雑は障害ではないので、ページは読み取り専用モードに切り替えない
+    assert not isinstance(excinfo.value, DB_UNAVAILABLE_ERRORS)
+
+
+def test_returned_connections_are_kept_up_to_maxconn(pool):
+    with pool.connection() as first, pool.connection() as second:
+        first.prepared.add("a")
+        second.prepared.add("b")
+
+    # 同時に借りた2本とも閉じられずに残り、PREPARE 済みの状態ごと使い回される
+    with pool.connection() as again, pool.connection() as other:
+        assert {id(again), id(other)} == {id(first), id(second)}
+        assert not again.closed and not other.closed
+
+
+def test_open_circuit_refuses_before_borrowing(pool):
+    import circuit_breaker
+
+    breaker = circuit_breaker.get_db_breaker()
+    breaker.probe = None
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(psycopg2.OperationalError("down"))
+
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        with pool.connection():
+            pass
+    # 借りられなかった枠は返っている
+    breaker.close()
+    with pool.connection(), pool.connection():
+        pass
@@ -0,0 +1,92 @@
+"""
+インデックスとクエリプランのテスト
+10万人規模の合成参加者データを専用スキーマに作り、ホットなクエリが EXPLAIN 上で
+マイグレーションのインデックスを使う（progress をシーケンシャルスキャンしない）ことを確かめる。
+"""
+import json
+
+import psycopg2
+import pytest
+
+from migrations import MIGRATIONS, apply_migrations
+from plan_regression import seed_schema, drop_schema
+from task_db import (
+    TASKS_WITH_PROGRESS_SQL, COMPLETED_COUNT_SQL, MARK_TASK_COMPLETE_SQL,
+    USER_RANKING_SQL, USER_RANK_SQL,
+)
+from synthetic_attendees import username_for
+from user import LOGIN_USER_SQL
+
+SCHEMA = "plan_test"
+USER_COUNT = 100_000
+
+
+@pytest.fixture(scope="module")
+def seeded_conn(pg_params):
+    """plan_test スキーマに10万人分の合成参加者を入れた接続"""
+    conn = psycopg2.connect(**pg_params)
+    try:
+        seed_schema(conn, SCHEMA, USER_COUNT)
+        yield conn
+    finally:
+        drop_schema(conn, SCHEMA)
+        conn.close()
+
+
+def explain(conn, sql: str, params=None) -> dict:
+    """EXPLAIN (FORMAT JSON) の最上位ノード（INSERT などは実行しない）"""
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cur.fetchone()[0]
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def scans_of(plan: dict, relation: str) -> list[tuple[str, str]]:
+    """テーブルごとの (ノード種別, インデックス名)"""
+    return [
+        (node["Node Type"], node.get("Index Name"))
+        for node in plan_nodes(plan)
+        if node.get("Relation Name") == relation
+    ]
+
+
+def test_migrations_are_idempotent(seeded_conn):
+    assert apply_migrations(seeded_conn) == []
+    with seeded_conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations ORDER BY version")
+        assert [row[0] for row in cur.fetchall()] == [version for version, _, _ in MIGRATIONS]
+        # 重複していた UNIQUE 制約のインデックスは消えている
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = %s AND tablename = 'progress'", (SCHEMA,))
+        assert {row[0] for row in cur.fetchall()} == {"progress_pkey", "progress_user_task_idx"}
+    seeded_conn.rollback()
+
+
+@pytest.mark.parametrize("sql", [TASKS_WITH_PROGRESS_SQL, COMPLETED_COUNT_SQL])
+def test_per_user_queries_read_only_the_index(seeded_conn, sql):
+    plan = explain(seeded_conn, sql, (USER_COUNT // 2,))
+    assert scans_of(plan, "progress") == [("Index Only Scan", "progress_user_task_idx")]
+
+
+@pytest.mark.parametrize("sql, params", [(USER_RANKING_SQL, None), (USER_RANK_SQL, (1,))])
+def test_ranking_does_not_scan_progress_heap(seeded_conn, sql, params):
+    plan = explain(seeded_conn, sql, params)
+    assert scans_of(plan, "progress") == [("Index Only Scan", "progress_user_task_idx")]
+
+
+def test_completion_upsert_uses_covering_index(seeded_conn):
+    plan = explain(seeded_conn, MARK_TASK_COMPLETE_SQL, (1, 1, "2025-09-11 10:00"))
+    assert plan["Conflict Arbiter Indexes"] == ["progress_user_task_idx"]
+
+
+def test_login_uses_username_index(seeded_conn):
+    plan = explain(seeded_conn, LOGIN_USER_SQL, (username_for(12345),))
+    assert scans_of(plan, "users") == [("Index Scan", "users_username_key")]
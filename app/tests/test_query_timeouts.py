@@ -0,0 +1,109 @@
+"""
+クエリ種別ごとのタイムアウト（statement_timeout / lock_timeout）のテスト
+"""
+import psycopg2
+import pytest
+
+import task_db
+from metrics import DB_QUERY_TIMEOUTS, track_query, query_timeout_kind
+
+
+@pytest.fixture
+def short_timeouts(monkeypatch):
+    """read を 50ms、write のロック待ちを 50ms にする"""
+    monkeypatch.setattr(task_db, "_QUERY_TIMEOUTS", {
+        "read": (50, 50), "aggregate": (1000, 100), "write": (1000, 50), "admin": (2000, 1000),
+    })
+
+
+def timeout_count(query: str, kind: str) -> float:
+    return DB_QUERY_TIMEOUTS._values.get((query, kind), 0.0)
+
+
+def test_timeout_statements_use_configured_values(short_timeouts):
+    assert task_db.with_timeouts("admin", "SELECT 1") == (
+        "SET LOCAL statement_timeout = 2000; SET LOCAL lock_timeout = 1000; SELECT 1"
+    )
+
+
+def test_configured_timeouts_accept_zero(monkeypatch):
+    monkeypatch.setattr(task_db, "_QUERY_TIMEOUTS", None)
+    monkeypatch.setattr(task_db.st, "secrets", {"database": {"read_timeout_ms": 0}})
+    monkeypatch.setenv("DB_AGGREGATE_TIMEOUT_MS", "0")
+    monkeypatch.setenv("DB_WRITE_LOCK_TIMEOUT_MS", "250")
+
+    timeouts = task_db.get_query_timeouts()
+
+    # 0（無制限）は既定値に戻さない
+    assert timeouts["read"] == (0, 100)
+    assert timeouts["aggregate"] == (0, 100)
+    assert timeouts["write"] == (1000, 250)
+
+
+def test_aggregates_have_their_own_budget():
+    assert task_db.DEFAULT_QUERY_TIMEOUTS["aggregate"][0] > task_db.DEFAULT_QUERY_TIMEOUTS["read"][0]
+
+
+def test_query_timeout_kind_ignores_other_errors():
+    assert query_timeout_kind(ValueError("x")) is None
+    assert query_timeout_kind(psycopg2.OperationalError("could not connect")) is None
+
+
+def test_slow_read_is_cancelled_and_counted(pg_params, short_timeouts):
+    before = timeout_count("slow_read", "statement")
+    conn = psycopg2.connect(**pg_params)
+    try:
+        with pytest.raises(psycopg2.errors.QueryCanceled):
+            with track_query("slow_read"):
+                with conn.cursor() as cur:
+                    cur.execute(task_db.with_timeouts("read", "SELECT pg_sleep(1)"))
+        conn.rollback()
+
+        # SET LOCAL なので次のトランザクションには残らない
+        with conn.cursor() as cur:
+            cur.execute("SHOW statement_timeout")
+            assert cur.fetchone()[0] == "0"
+    finally:
+        conn.close()
+    assert timeout_count("slow_read", "statement") == before + 1
+
+
+def test_lock_wait_is_bounded(pg_params, pg_task_ids, short_timeouts):
+    holder = psycopg2.connect(**pg_params)
+    waiter = psycopg2.connect(**pg_params)
+    try:
+        with holder.cursor() as cur:
+            cur.execute("SELECT id FROM tasks WHERE id = %s FOR UPDATE", (pg_task_ids[0],))
+        with pytest.raises(psycopg2.errors.LockNotAvailable) as excinfo:
+            with waiter.cursor() as cur:
+                cur.execute(task_db.with_timeouts("write", "SELECT id FROM tasks WHERE id = %s FOR UPDATE"),
+                            (pg_task_ids[0],))
+        assert query_timeout_kind(excinfo.value) == "lock"
+    finally:
+        holder.close()
+        waiter.close()
+
+
+def test_async_deadline_cancels_and_keeps_connection_usable(pg_params, short_timeouts):
+    from task_db_async import EventLoopThread, create_async_pool, deadline
+
+    runner = EventLoopThread()
+    pool = create_async_pool(pg_params, max_size=1)
+    runner.run(pool.open(wait=True))
+
+    async def slow_then_fast():
+        async with pool.connection() as conn:
+            try:
+                async with deadline(conn, "read"):
+                    await conn.execute("SELECT pg_sleep(1)")
+            except Exception as e:
+                kind = query_timeout_kind(e)
+            async with deadline(conn, "read"):
+                cur = await conn.execute("SELECT 1 AS one")
+            return kind, (await cur.fetchone())["one"]
+
+    try:
+        assert runner.run(slow_then_fast(), 10) == ("statement", 1)
+    finally:
+        runner.run(pool.close())
+        runner.stop()
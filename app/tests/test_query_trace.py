@@ -0,0 +1,114 @@
+"""
+クエリトレースと再生のテスト
+"""
+from datetime import datetime
+from decimal import Decimal
+
+import psycopg2
+
+import query_trace
+from benchmark import prepare_schema
+from query_replay import load_events, replay, resolve_params
+from query_trace import QueryTracer, Redacted, read_trace
+
+
+def test_trace_round_trip_anonymizes_text(tmp_path):
+    path = str(tmp_path / "trace.svqt")
+    tracer = QueryTracer(path, salt=b"test")
+    sql = """
+        SELECT *
+        FROM users WHERE username = %s
+    """
+    tracer.record("login_user", sql, ("alice",), "read", 0, 1_500_000)
+    tracer.record("login_user", sql, ("alice",), "read", 0, 2_000_000)
+    tracer.record("login_user", sql, ("bob",), "read", 0, 1_000_000, error=True)
+    tracer.record("mark", "INSERT INTO progress VALUES (%s, %s, %s)", (7, 3, datetime.now()), "write", 0, 0)
+    tracer.record("named", "SELECT %(a)s, %(b)s", {"a": None, "b": Decimal("1")}, "read", 0, 0)
+    tracer.close()
+
+    trace = read_trace(path)
+    assert [statement.label for statement in trace.statements.values()] == ["login_user", "mark", "named"]
+    assert trace.statements[0].sql == "SELECT * FROM users WHERE username = %s"
+    assert trace.statements[2].names == ("a", "b")
+    assert len(trace.calls) == 5
+    alice, alice_again, bob = (call.params[0] for call in trace.calls[:3])
+    assert isinstance(alice, Redacted) and alice.kind == "text"
+    assert alice == alice_again and alice != bob
+    assert [call.duration_us for call in trace.calls[:3]] == [1500, 2000, 1000]
+    assert trace.calls[2].error
+    assert trace.calls[3].params == (7, 3, Redacted("datetime"))
+    assert trace.calls[4].params == (None, Redacted("other"))
+    with open(path, "rb") as f:
+        assert b"alice" not in f.read()
+
+
+def test_truncated_trace_keeps_complete_records(tmp_path):
+    path = str(tmp_path / "trace.svqt")
+    tracer = QueryTracer(path)
+    for user_id in range(3):
+        tracer.record("user_rank", "SELECT %s", (user_id,), "read", 0, 0)
+    tracer.close()
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+    assert [call.params for call in read_trace(path).calls] == [(0,), (1,)]
+
+
+def test_trace_write_errors_do_not_fail_the_query(tmp_path, monkeypatch):
+    tracer = QueryTracer(str(tmp_path / "trace.svqt"))
+
+    def disk_full(*args, **kwargs):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(tracer, "record", disk_full)
+    monkeypatch.setattr(query_trace, "_TRACER", tracer)
+    monkeypatch.setattr(query_trace, "_TRACER_RESOLVED", True)
+
+    with query_trace.trace_query("login_user", "SELECT * FROM users WHERE username = %s", ("someone",)):
+        result = "ok"
+
+    assert result == "ok"
+    assert query_trace.get_tracer() is None
+
+
+def test_resolve_params_maps_tokens_to_attendees(tmp_path):
+    path = str(tmp_path / "trace.svqt")
+    tracer = QueryTracer(path)
+    tracer.record("get_or_create_user", "SELECT %(username)s", {"username": "alice"}, "write", 0, 0)
+    tracer.close()
+    statements, events = load_events([str(tmp_path)])
+    params = resolve_params(statements[0], events[0].params, attendees=100)
+    assert list(params) == ["username"] and params["username"].startswith("attendee")
+
+
+def test_traced_services_replay_against_a_seeded_schema(pg_params, pg_task_ids, monkeypatch, tmp_path):
+    from task_db import TaskService
+    from user import UserService
+
+    monkeypatch.setenv("DB_SCHEMA", "replay_test")
+    tracer = QueryTracer(str(tmp_path / "trace.svqt"))
+    try:
+        prepare_schema("replay_test", 200)
+        monkeypatch.setattr(query_trace, "_TRACER", tracer)
+        monkeypatch.setattr(query_trace, "_TRACER_RESOLVED", True)
+        _, _, user, _ = UserService().get_or_create_user("attendee000042")
+        service = TaskService()
+        service.get_dashboard_snapshot(user.id, aggregates=True)
+        service.mark_task_complete_and_count(pg_task_ids[0], user.id)
+        service.get_user_ranking()
+        tracer.close()
+
+        statements, events = load_events([str(tmp_path)])
+        result = replay(statements, events, speed=10.0, workers=2, attendees=200)
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS replay_test CASCADE")
+        conn.commit()
+        conn.close()
+
+    assert {statement.label for statement in statements} >= {
+        "get_or_create_user", "tasks_with_progress", "user_rank", "task_completion_counts",
+        "mark_task_complete", "completed_count", "user_ranking",
+    }
+    assert result["events"] == len(events) and result["errors"] == 0, result["error_messages"]
+    assert sum(query["n"] for query in result["queries"].values()) == len(events)
@@ -0,0 +1,43 @@
+"""
+セッションのメモリ計測ツールのテスト
+"""
+from dataclasses import dataclass
+
+import psycopg2
+
+from benchmark import prepare_schema
+from session_memory import deep_sizeof, key_type, measure
+
+
+def test_key_types_group_ids_and_widgets():
+    assert key_type("show_quiz_12") == "show_quiz_{id}"
+    assert key_type("$$ID-0442fdb24ac6ea96c287194d8be1192c-swt_btn_15") == "widget:swt_btn_{id}"
+    assert key_type("$$STREAMLIT_INTERNAL_KEY_TESTING") == "internal"
+    assert key_type("user_info") == "user_info"
+
+
+def test_deep_sizeof_follows_containers_once():
+    @dataclass
+    class Holder:
+        items: list
+
+    shared = "x" * 1000
+    assert deep_sizeof([shared, shared]) < deep_sizeof([shared, "y" * 1000])
+    assert deep_sizeof(Holder([shared])) > deep_sizeof(shared)
+
+
+def test_dashboard_keeps_one_compact_state_key(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "session_memory_test")
+    try:
+        prepare_schema("session_memory_test", 50)
+        result = measure(sessions=1, missions=3, attendees=50)
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS session_memory_test CASCADE")
+        conn.commit()
+        conn.close()
+
+    assert result["key_types"]["dashboard_state"]["keys_per_session"] == 1
+    assert not [kind for kind in result["key_types"] if kind.startswith("show_")]
+    assert 0 < result["state_bytes_per_session"]
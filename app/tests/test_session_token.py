@@ -0,0 +1,82 @@
+"""
+署名付きセッショントークンのテスト
+"""
+import psycopg2
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import launch_screen
+from apptest_load import MAIN_SCRIPT
+from benchmark import prepare_schema
+from session_token import TOKEN_PARAM, InvalidSessionToken, issue_token, verify_token
+from synthetic_attendees import username_for
+from user import User
+
+SECRET = b"test-secret"
+
+
+def test_token_round_trip():
+    token = issue_token(User(id=42, username="雪:だるま"), SECRET, ttl_seconds=60, now=1000)
+    restored = verify_token(token, SECRET, now=1059)
+    assert (restored.id, restored.username) == (42, "雪:だるま")
+
+
+@pytest.mark.parametrize("mutate, reason", [
+    (lambda token: token.replace("v1.", "v2.", 1), "malformed"),
+    (lambda token: token + ".extra", "malformed"),
+    (lambda token: "v1.é." + token.rsplit(".", 1)[1], "malformed"),
+    (lambda token: token.rsplit(".", 1)[0] + ".é", "malformed"),
+    (lambda token: token[:-2] + ("AA" if not token.endswith("AA") else "BB"), "signature"),
+    (lambda token: issue_token(User(id=1, username="other"), SECRET, 60, now=1000).rsplit(".", 1)[0]
+     + "." + token.rsplit(".", 1)[1], "signature"),
+])
+def test_tampered_tokens_are_rejected(mutate, reason):
+    token = issue_token(User(id=42, username="alice"), SECRET, ttl_seconds=60, now=1000)
+    with pytest.raises(InvalidSessionToken) as error:
+        verify_token(mutate(token), SECRET, now=1001)
+    assert error.value.reason == reason
+
+
+def test_expired_and_foreign_tokens_are_rejected():
+    token = issue_token(User(id=42, username="alice"), SECRET, ttl_seconds=60, now=1000)
+    with pytest.raises(InvalidSessionToken, match="expired"):
+        verify_token(token, SECRET, now=1060)
+    with pytest.raises(InvalidSessionToken, match="signature"):
+        verify_token(token, b"another-secret", now=1001)
+
+
+def test_new_browser_session_is_restored_without_the_database_login(pg_params, monkeypatch):
+    monkeypatch.setenv("DB_SCHEMA", "token_test")
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    monkeypatch.setenv("SESSION_TOKEN_SECRET", SECRET.decode())
+
+    def no_login():
+        raise AssertionError("ユーザーサービスを使わずに復元されるはず")
+
+    try:
+        prepare_schema("token_test", 10)
+        at = AppTest.from_file(MAIN_SCRIPT, default_timeout=10)
+        at.run()
+        at.text_input(key="user_name_input").input(username_for(3))
+        next(b for b in at.button if b.label == "遊びに行く！").click().run()
+        token = at.query_params[TOKEN_PARAM]
+        token = token[0] if isinstance(token, list) else token
+
+        # 再読み込み（新しいブラウザセッション）に相当
+        monkeypatch.setattr(launch_screen, "get_user_service", no_login)
+        reloaded = AppTest.from_file(MAIN_SCRIPT, default_timeout=10)
+        reloaded.query_params[TOKEN_PARAM] = token
+        reloaded.run()
+        assert not reloaded.exception
+        assert reloaded.session_state["user_info"]["user"].username == username_for(3)
+        assert any(button.key == "top_nav_ranking" for button in reloaded.button)
+
+        # ログアウトするとトークンも消える
+        reloaded.button(key="logout_btn").click().run()
+        assert TOKEN_PARAM not in reloaded.query_params
+    finally:
+        conn = psycopg2.connect(**pg_params)
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS token_test CASCADE")
+        conn.commit()
+        conn.close()
@@ -0,0 +1,53 @@
+"""
+slack_client のレート制限のテスト
+"""
+
+from slack_client import TokenBucket, parse_retry_after
+
+
+class FakeClock:
+    """テスト用の手動時計"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_limits_rate_after_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=clock, sleep=clock.sleep)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 1.0
+
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0.5
+    assert bucket.acquire() is True
+    assert clock.now == 101.0
+
+
+def test_token_bucket_pause_honors_retry_after():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=5, clock=clock, sleep=clock.sleep)
+
+    bucket.pause(30)
+    assert bucket.seconds_until_available() == 30
+    assert bucket.acquire(timeout=10) is False
+
+    clock.now += 30
+    assert bucket.seconds_until_available() == 1.0
+    assert bucket.acquire() is True
+    assert clock.now == 131.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(None, default=2.0) == 2.0
+    assert parse_retry_after("not a date", default=3.0) == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
@@ -0,0 +1,228 @@
+"""
+slack_outbox モジュールのテスト（PostgreSQLが必要）
+"""
+import os
+
+import psycopg2
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import slack_outbox
+from apptest_load import APP_DIR
+from slack_outbox import STATUS_FAILED, STATUS_HELD, STATUS_QUEUED, STATUS_REJECTED, STATUS_SENT, SlackOutbox
+from user import User
+
+SCHEMA = "outbox_test"
+
+
+@pytest.fixture
+def outbox_schema(pg_params, monkeypatch):
+    """アウトボックスを空のスキーマに作る（他のテストやアプリの行を取得しない）"""
+    conn = psycopg2.connect(**pg_params)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    monkeypatch.setenv("DB_SCHEMA", SCHEMA)
+    yield conn
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.close()
+
+
+@pytest.fixture
+def make_outbox(outbox_schema):
+    def factory(slack_client, **options) -> SlackOutbox:
+        return SlackOutbox(slack_client, **options)
+    return factory
+
+
+def query_row(conn, outbox_id: int) -> dict:
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT status, attempts, last_error,
+                   next_attempt_at > CURRENT_TIMESTAMP AS deferred
+            FROM {SCHEMA}.slack_outbox WHERE id = %s
+        """, (outbox_id,))
+        status, attempts, last_error, deferred = cur.fetchone()
+    return {"status": status, "attempts": attempts, "last_error": last_error, "deferred": deferred}
+
+
+def test_claim_leases_rows_until_the_lease_expires(make_outbox, slack_client, outbox_schema):
+    outbox = make_outbox(slack_client, lease_seconds=60)
+    first, second = outbox.enqueue("one"), outbox.enqueue("two")
+
+    claimed = outbox.claim_batch()
+    assert [(row["id"], row["message"], row["attempts"]) for row in claimed] == [(first, "one", 1), (second, "two", 1)]
+    assert query_row(outbox_schema, first)["status"] == "sending"
+    # リース中は他のワーカーから見えない
+    assert outbox.claim_batch() == []
+
+    # ワーカーが送信中に止まってリースが切れた場合は取り直す
+    with outbox_schema.cursor() as cur:
+        cur.execute(f"UPDATE {SCHEMA}.slack_outbox SET next_attempt_at = CURRENT_TIMESTAMP - interval '1 second' "
+                    f"WHERE id = %s", (first,))
+    reclaimed = outbox.claim_batch()
+    assert [(row["id"], row["attempts"]) for row in reclaimed] == [(first, 2)]
+
+
+def test_claim_skips_rows_locked_by_another_worker(make_outbox, slack_client, pg_params):
+    outbox = make_outbox(slack_client)
+    locked, free = outbox.enqueue("locked"), outbox.enqueue("free")
+
+    other = psycopg2.connect(**pg_params)
+    try:
+        with other.cursor() as cur:
+            cur.execute(f"SELECT id FROM {SCHEMA}.slack_outbox WHERE id = %s FOR UPDATE", (locked,))
+            assert [row["id"] for row in outbox.claim_batch()] == [free]
+        other.rollback()
+    finally:
+        other.close()
+    assert [row["id"] for row in outbox.claim_batch()] == [locked]
+
+
+def test_expired_lease_is_not_delivered_or_overwritten(make_outbox, slack_stub, slack_client, outbox_schema):
+    outbox = make_outbox(slack_client)
+    other = make_outbox(slack_client)
+    first, second = outbox.enqueue("first"), outbox.enqueue("second")
+    post_payload = slack_client.post_payload
+
+    def slow_post(payload):
+        # 1件目の送信中にリースが切れ、別のワーカーが両方を取り直す
+        if len(slack_stub.messages) == 0:
+            with outbox_schema.cursor() as cur:
+                cur.execute(f"UPDATE {SCHEMA}.slack_outbox SET next_attempt_at = CURRENT_TIMESTAMP - interval '1 second'")
+            assert [row["id"] for row in other.claim_batch()] == [first, second]
+        return post_payload(payload)
+
+    slack_client.post_payload = slow_post
+    outbox.process_once()
+
+    # 1件目の送信結果は新しい所有者の状態を上書きせず、2件目は送らない
+    assert len(slack_stub.messages) == 1
+    for outbox_id in (first, second):
+        row = query_row(outbox_schema, outbox_id)
+        assert row["status"] == "sending" and row["attempts"] == 2
+
+
+def test_process_once_delivers_and_marks_sent(make_outbox, slack_stub, slack_client, outbox_schema):
+    outbox = make_outbox(slack_client)
+    outbox_id = outbox.enqueue("hello outbox")
+
+    assert outbox.process_once() == (1, False)
+
+    assert query_row(outbox_schema, outbox_id)["status"] == STATUS_SENT
+    assert any("hello outbox" in message for message in slack_stub.messages)
+
+
+def test_server_errors_are_retried_with_backoff_then_failed(make_outbox, make_slack_stub, make_slack_client,
+                                                            outbox_schema):
+    client = make_slack_client(make_slack_stub(error_rate=1.0))
+    outbox = make_outbox(client, max_attempts=2)
+    outbox_id = outbox.enqueue("flaky")
+
+    outbox.process_once()
+    row = query_row(outbox_schema, outbox_id)
+    assert row["status"] == STATUS_QUEUED and row["attempts"] == 1 and row["deferred"]
+    assert row["last_error"]
+    # バックオフ中は取得されない
+    assert outbox.claim_batch() == []
+
+    with outbox_schema.cursor() as cur:
+        cur.execute(f"UPDATE {SCHEMA}.slack_outbox SET next_attempt_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (outbox_id,))
+    outbox.process_once()
+    row = query_row(outbox_schema, outbox_id)
+    assert row["status"] == STATUS_FAILED and row["attempts"] == 2
+
+
+def test_rate_limited_rows_are_requeued_without_using_an_attempt(make_outbox, make_slack_stub, make_slack_client,
+                                                                 outbox_schema):
+    client = make_slack_client(make_slack_stub(rate_limit=0.001, retry_after=30))
+    outbox = make_outbox(client)
+    # 1件目で受付枠を使い切り、2件目で429を受ける
+    sent, limited = outbox.enqueue("first"), outbox.enqueue("second")
+
+    outbox.process_once()
+
+    assert query_row(outbox_schema, sent)["status"] == STATUS_SENT
+    row = query_row(outbox_schema, limited)
+    assert row["status"] == STATUS_QUEUED and row["attempts"] == 0 and row["deferred"]
+
+
+def test_held_rows_wait_for_release(make_outbox, slack_client, outbox_schema):
+    outbox = make_outbox(slack_client)
+    outbox_id = outbox.enqueue("needs review", status=STATUS_HELD)
+
+    assert outbox.claim_batch() == []
+    assert outbox.release_held(outbox_id)
+    assert not outbox.release_held(outbox_id)
+    assert [row["id"] for row in outbox.claim_batch()] == [outbox_id]
+
+
+def test_held_rows_can_be_rejected(make_outbox, slack_client, outbox_schema):
+    outbox = make_outbox(slack_client)
+    rejected, kept = outbox.enqueue("spam", status=STATUS_HELD), outbox.enqueue("maybe", status=STATUS_HELD)
+
+    assert [row["id"] for row in outbox.list_held()] == [rejected, kept]
+    assert outbox.reject_held(rejected)
+
+    assert query_row(outbox_schema, rejected)["status"] == STATUS_REJECTED
+    assert [row["id"] for row in outbox.list_held()] == [kept]
+    assert outbox.claim_batch() == []
+
+
+def test_moderator_releases_held_post_from_review_page(make_outbox, slack_client, outbox_schema, monkeypatch):
+    outbox = make_outbox(slack_client)
+    monkeypatch.setattr(slack_outbox, "get_slack_outbox", lambda: outbox)
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    monkeypatch.setenv("MODERATORS", "moderator")
+    monkeypatch.setenv("MODERATOR_PASSPHRASE", "snow-secret")
+    outbox_id = outbox.enqueue("https://example.com を見てください", status=STATUS_HELD)
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "pages", "review.py"), default_timeout=10)
+    at.session_state["user_info"] = {"name": "moderator", "intent": "login", "user": User(id=1, username="moderator")}
+    at.run()
+    assert not at.exception
+    at.text_input(key="moderator_passphrase").input("snow-secret")
+    at.button(key="verify_moderator").click().run()
+    at.button(key=f"release_post_{outbox_id}").click().run()
+
+    assert query_row(outbox_schema, outbox_id)["status"] == STATUS_QUEUED
+    assert any("送信キューに戻しました" in message.value for message in at.success)
+
+
+def test_review_page_is_only_for_moderators(make_outbox, slack_client, monkeypatch):
+    outbox = make_outbox(slack_client)
+    monkeypatch.setattr(slack_outbox, "get_slack_outbox", lambda: outbox)
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    monkeypatch.setenv("MODERATORS", "moderator")
+    outbox.enqueue("held", status=STATUS_HELD)
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "pages", "review.py"), default_timeout=10)
+    at.session_state["user_info"] = {"name": "guest", "intent": "login", "user": User(id=2, username="guest")}
+    at.run()
+
+    assert not at.exception
+    assert not [button for button in at.button if button.key and button.key.startswith("release_post_")]
+
+
+@pytest.mark.parametrize("passphrase", [None, "wrong"])
+def test_moderator_name_alone_does_not_open_review_page(make_outbox, slack_client, monkeypatch, passphrase):
+    outbox = make_outbox(slack_client)
+    monkeypatch.setattr(slack_outbox, "get_slack_outbox", lambda: outbox)
+    monkeypatch.setenv("METRICS_ENABLED", "0")
+    monkeypatch.setenv("MODERATORS", "moderator")
+    monkeypatch.setenv("MODERATOR_PASSPHRASE", "snow-secret")
+    outbox.enqueue("090-1234-5678 に電話して", status=STATUS_HELD)
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "pages", "review.py"), default_timeout=10)
+    at.session_state["user_info"] = {"name": "moderator", "intent": "login", "user": User(id=1, username="moderator")}
+    at.run()
+    if passphrase:
+        at.text_input(key="moderator_passphrase").input(passphrase)
+        at.button(key="verify_moderator").click().run()
+
+    assert not at.exception
+    assert not [button for button in at.button if button.key and button.key.startswith("release_post_")]
+    assert not any("090-1234-5678" in text.value for text in at.text)
@@ -0,0 +1,52 @@
+"""
+ローカルWebhookスタブ経由の slack_client 送信テスト
+"""
+
+
+def test_send_anonymous_message_reaches_stub(slack_stub, slack_client):
+    success, _ = slack_client.send_anonymous_message("テスト投稿です", username="tester")
+
+    assert success
+    assert len(slack_stub.messages) == 1
+    assert "テスト投稿です" in slack_stub.messages[0]
+    assert "tester" not in slack_stub.messages[0]
+
+
+def test_invalid_payload_returns_400(slack_stub, slack_client):
+    success, _, status_code = slack_client.post_payload({"username": "bot"})
+
+    assert not success
+    assert status_code == 400
+
+
+def test_server_errors_are_reported(make_slack_stub, make_slack_client):
+    stub = make_slack_stub(error_rate=1.0)
+    client = make_slack_client(stub)
+
+    success, _, status_code = client.post_payload(client.build_anonymous_payload("hello"))
+
+    assert not success
+    assert status_code == 500
+
+
+def test_429_pauses_shared_rate_limiter(make_slack_stub, make_slack_client):
+    stub = make_slack_stub(retry_after=5)
+    client = make_slack_client(stub)
+    stub.script_responses(429)
+
+    success, _, status_code = client.post_payload(client.build_anonymous_payload("hello"))
+
+    assert not success
+    assert status_code == 429
+    assert 4 < client.rate_limiter.seconds_until_available() <= 5
+
+
+def test_client_waits_out_retry_after_from_stub(make_slack_stub, make_slack_client):
+    stub = make_slack_stub(rate_limit=2)
+    client = make_slack_client(stub)
+
+    results = [client.post_payload(client.build_anonymous_payload(f"m{i}"))[2] for i in range(3)]
+
+    # 2件目はスタブ側で429、3件目はクライアントがRetry-Afterだけ待ってから送る
+    assert results == [200, 429, 200]
+    assert stub.status_counts == {200: 2, 429: 1}
@@ -0,0 +1,69 @@
+"""
+合成参加者データ生成のテスト
+"""
+import os
+import statistics
+
+import psycopg2
+import pytest
+
+import synthetic_attendees
+from synthetic_attendees import APP_DIR, generate_attendees, load_attendees, create_schema
+from tasks import load_tasks_from_yaml
+
+TASKS = load_tasks_from_yaml(os.path.join(APP_DIR, "tasks.yml"))
+
+
+def test_same_seed_gives_same_attendees():
+    assert list(generate_attendees(50, TASKS, seed=7)) == list(generate_attendees(50, TASKS, seed=7))
+    assert list(generate_attendees(50, TASKS, seed=7)) != list(generate_attendees(50, TASKS, seed=8))
+
+
+@pytest.mark.parametrize("argv", [["--replace"], ["--replace", "--schema", "PUBLIC"]])
+def test_replace_refuses_the_public_schema(argv, monkeypatch):
+    def connect(**params):
+        raise AssertionError("DBに接続する前に止める")
+
+    monkeypatch.setattr(synthetic_attendees.psycopg2, "connect", connect)
+    monkeypatch.setattr("sys.argv", ["synthetic_attendees.py", *argv])
+
+    with pytest.raises(SystemExit) as excinfo:
+        synthetic_attendees.main()
+    assert excinfo.value.code == 2
+
+
+def test_completions_are_skewed_and_within_event_days():
+    attendees = list(generate_attendees(2000, TASKS))
+    counts = [len(progress) for _, progress in attendees]
+    # 数件だけの人が多く、全制覇に近い人は少ない
+    assert statistics.median(counts) < statistics.mean(counts)
+    assert max(counts) > 3 * statistics.median(counts)
+
+    task_ids = {task["id"] for task in TASKS}
+    for (user_id, _, created_at), progress in attendees:
+        assert created_at[:10] in ("2025-09-11", "2025-09-12")
+        assert len({task_id for _, task_id, _ in progress}) == len(progress)
+        for progress_user, task_id, completed_at in progress:
+            assert progress_user == user_id and task_id in task_ids
+            assert completed_at > created_at
+            assert "09:00:00" <= completed_at[11:] < "19:00:00"
+
+
+def test_load_appends_after_existing_users(pg_params):
+    conn = psycopg2.connect(**pg_params)
+    try:
+        create_schema(conn, "synthetic_test")
+        assert load_attendees(conn, 100, replace=True)[0] == 100
+        load_attendees(conn, 50, seed=1)
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*), MAX(id) FROM users")
+            assert cur.fetchone() == (150, 150)
+            # アプリからの登録はシーケンスの続きになる
+            cur.execute("INSERT INTO users (username) VALUES ('walk_in') RETURNING id")
+            assert cur.fetchone()[0] == 151
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS synthetic_test CASCADE")
+        conn.commit()
+        conn.close()
@@ -0,0 +1,144 @@
+"""
+task_db_async モジュールのテスト
+"""
+import asyncio
+import time
+
+import pytest
+from psycopg_pool import PoolTimeout
+
+from circuit_breaker import STATE_CLOSED, CircuitBreaker, PoolExhaustedError
+from task_db_async import BlockingService, EventLoopThread
+
+
+class FakeAsyncService:
+    """1クエリ50msかかる非同期サービス"""
+
+    async def query(self, value):
+        await asyncio.sleep(0.05)
+        return value
+
+    async def snapshot(self):
+        return await asyncio.gather(self.query(1), self.query(2), self.query(3))
+
+    def sync_helper(self):
+        return "sync"
+
+    async def exhausted(self):
+        raise PoolTimeout("couldn't get a connection after 5.00 sec")
+
+
+@pytest.fixture
+def runner():
+    runner = EventLoopThread()
+    yield runner
+    runner.stop()
+
+
+def test_blocking_service_runs_coroutines_on_loop_thread(runner):
+    service = BlockingService(FakeAsyncService(), runner)
+
+    assert service.query("x") == "x"
+    assert service.sync_helper() == "sync"
+
+
+def test_concurrent_queries_overlap(runner):
+    service = BlockingService(FakeAsyncService(), runner)
+
+    start = time.perf_counter()
+    assert service.snapshot() == [1, 2, 3]
+
+    # 3クエリ分（150ms）ではなく1クエリ分程度で終わる
+    assert time.perf_counter() - start < 0.12
+
+
+def test_pool_timeout_is_busy_not_a_breaker_failure(runner):
+    breaker = CircuitBreaker(failure_threshold=1)
+    service = BlockingService(FakeAsyncService(), runner, breaker=breaker)
+
+    with pytest.raises(PoolExhaustedError):
+        service.exhausted()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_async_snapshot_matches_sync_backend(pg_params, runner):
+    from task_db import TaskService
+    from task_db_async import AsyncTaskService, create_async_pool
+    from user import UserService
+
+    TaskService()
+    ok, _, user = UserService().register_user(f"async_test_{time.time_ns()}")
+    assert ok
+
+    pool = create_async_pool(pg_params, max_size=3)
+    runner.run(pool.open(wait=True))
+    try:
+        service = BlockingService(AsyncTaskService(pool), runner)
+        expected = TaskService().get_dashboard_snapshot(user.id, aggregates=True)
+        actual = service.get_dashboard_snapshot(user.id, aggregates=True)
+        # 既定ではユーザー自身の進捗だけを取得する
+        assert service.get_dashboard_snapshot(user.id) == {**expected, "rank": None, "task_stats": {}}
+    finally:
+        runner.run(pool.close())
+
+    assert [dict(row) for row in actual["tasks"]] == [dict(row) for row in expected["tasks"]]
+    assert dict(actual["rank"]) == dict(expected["rank"])
+    assert actual["task_stats"] == expected["task_stats"]
+
+
+@pytest.fixture
+def proxied_pool(pg_params, runner):
+    """往復回数を数えるプロキシ（片道5ms）越しの非同期プール"""
+    from latency_proxy import LatencyProxy
+    from task_db_async import create_async_pool
+
+    with LatencyProxy(pg_params["host"], pg_params["port"], delay=0.005) as proxy:
+        pool = create_async_pool(dict(pg_params, host="127.0.0.1", port=proxy.port, sslmode="disable"), max_size=1)
+        runner.run(pool.open(wait=True))
+        yield proxy, pool
+        runner.run(pool.close())
+
+
+def test_pipelined_operations_take_one_round_trip(proxied_pool, runner, pg_task_ids):
+    from task_db import TaskService
+    from task_db_async import PipelinedTaskService, PipelinedUserService
+
+    proxy, pool = proxied_pool
+    task_service = BlockingService(PipelinedTaskService(pool), runner)
+    user_service = BlockingService(PipelinedUserService(pool), runner)
+    task_id = pg_task_ids[0]
+    username = f"pipeline_test_{time.time_ns()}"
+
+    proxy.reset()
+    ok, _, user = user_service.register_user(username)
+    assert ok and proxy.round_trips == 1
+
+    proxy.reset()
+    assert user_service.register_user(username)[:2] == (False, "同じ名前のユーザーが既に存在します")
+    assert proxy.round_trips == 1
+
+    proxy.reset()
+    assert task_service.mark_task_complete_and_count(task_id, user.id) == 1
+    assert proxy.round_trips == 1
+
+    proxy.reset()
+    snapshot = task_service.get_dashboard_snapshot(user.id, aggregates=True)
+    assert proxy.round_trips == 1
+    assert snapshot["rank"]["completed_tasks"] == 1
+    assert snapshot["task_stats"][task_id] >= 1
+    assert snapshot == {**TaskService().get_dashboard_snapshot(user.id, aggregates=True), "tasks": snapshot["tasks"]}
+
+
+def test_async_get_or_create_user_is_one_round_trip(proxied_pool, runner):
+    from task_db_async import AsyncUserService
+
+    proxy, pool = proxied_pool
+    service = BlockingService(AsyncUserService(pool), runner)
+    username = f"async_get_or_create_{time.time_ns()}"
+
+    proxy.reset()
+    ok, _, user, created = service.get_or_create_user(username)
+    assert ok and created and proxy.round_trips == 1
+
+    ok, _, again, created = service.get_or_create_user(username)
+    assert ok and not created and again == user
@@ -0,0 +1,115 @@
+"""
+user モジュールのテスト（PostgreSQLが必要）
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from metrics import DB_QUERY_ERRORS
+from circuit_breaker import PoolExhaustedError
+from user import BUSY_MESSAGE, LOGIN_ERROR, LOGIN_NOT_FOUND, LOGIN_SUCCESS, LOGIN_TIMEOUT, RETRY_MESSAGE, UserService
+
+
+def test_get_or_create_user_creates_once(pg_params):
+    service = UserService()
+    username = f"get_or_create_{time.time_ns()}"
+
+    ok, _, created_user, created = service.get_or_create_user(f"  {username} ")
+    assert ok and created
+    assert created_user.username == username
+
+    ok, message, existing_user, created = service.get_or_create_user(username)
+    assert ok and not created
+    assert message == "ログインしました！"
+    assert existing_user == created_user
+
+
+def test_get_or_create_user_rejects_blank_name(pg_params):
+    assert UserService().get_or_create_user("  ") == (False, "名前を入力してください", None, False)
+
+
+def test_concurrent_sign_ups_create_one_user(pg_params):
+    service = UserService()
+    username = f"race_{time.time_ns()}"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: service.get_or_create_user(username), range(16)))
+
+    assert all(ok for ok, _, _, _ in results)
+    assert sum(created for _, _, _, created in results) == 1
+    assert len({user.id for _, _, user, _ in results}) == 1
+
+
+def test_swallowed_auth_errors_are_counted(pg_params, monkeypatch):
+    service = UserService()
+
+    def broken_connection():
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(service, "get_connection", broken_connection)
+    before = DB_QUERY_ERRORS._values.get(("login_user",), 0)
+
+    ok, message, user, status = service.login_user("anyone")
+
+    assert not ok and user is None and status == LOGIN_ERROR
+    assert message.startswith("ログインに失敗しました")
+    assert DB_QUERY_ERRORS._values.get(("login_user",), 0) == before + 1
+
+
+def test_exhausted_pool_is_reported_as_busy(pg_params, monkeypatch):
+    service = UserService()
+
+    def exhausted_pool():
+        raise PoolExhaustedError("no database connection available within 5s")
+
+    monkeypatch.setattr(service, "get_connection", exhausted_pool)
+
+    assert service.login_user("anyone") == (False, BUSY_MESSAGE, None, LOGIN_TIMEOUT)
+    assert service.get_or_create_user("anyone") == (False, BUSY_MESSAGE, None, False)
+
+
+def test_login_user_reports_status(pg_params):
+    service = UserService()
+    username = f"login_status_{time.time_ns()}"
+
+    assert service.login_user(username)[3] == LOGIN_NOT_FOUND
+    service.get_or_create_user(username)
+    ok, _, user, status = service.login_user(username)
+    assert ok and status == LOGIN_SUCCESS and user.username == username
+
+
+def test_get_or_create_user_fails_cleanly_when_the_row_vanishes(pg_params, monkeypatch):
+    class EmptyCursor:
+        connection = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, sql, params=None):
+            pass
+
+        def fetchone(self):
+            return None
+
+    class EmptyConnection:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self, **kwargs):
+            return EmptyCursor()
+
+        def commit(self):
+            pass
+
+    # 挿入が競合し、読み直しでも行が見つからない状況
+    service = UserService()
+    monkeypatch.setattr(service, "get_connection", EmptyConnection)
+
+    assert service.get_or_create_user("vanished") == (False, RETRY_MESSAGE, None, False)
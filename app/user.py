@@ -6,11 +6,56 @@ from datetime import datetime
 from typing import Optional
 import psycopg2
 import psycopg2.extras
-import os
-import streamlit as st
+from task_db import load_connection_params, get_db_backend, get_connection_pool, execute_prepared, with_timeouts
+import circuit_breaker
+from metrics import track_query, record_query_error, USER_AUTH_TOTAL
+from query_trace import trace_query
 
 
-@dataclass
+CREATE_USERS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# 登録済みなら既存行、未登録なら新規行を1文で返す（created で区別）
+GET_OR_CREATE_USER_SQL = """
+    WITH inserted AS (
+        INSERT INTO users (username) VALUES (%(username)s)
+        ON CONFLICT (username) DO NOTHING
+        RETURNING id, username, created_at, TRUE AS created
+    )
+    SELECT * FROM inserted
+    UNION ALL
+    SELECT id, username, created_at, FALSE AS created
+    FROM users
+    WHERE username = %(username)s AND NOT EXISTS (SELECT 1 FROM inserted)
+"""
+
+LOGIN_USER_SQL = "SELECT * FROM users WHERE username = %s"
+
+REGISTER_USER_SQL = "INSERT INTO users (username) VALUES (%s) RETURNING *"
+
+# タイムアウト・接続プールの待ち切れ時（DBが混雑している）に画面に出すメッセージ
+BUSY_MESSAGE = "サーバーが混み合っています。しばらくしてから再度お試しください。"
+
+# ログイン結果の状態（画面はメッセージの文言ではなくこれで分岐する。メトリクスの result ラベルと同じ値）
+LOGIN_SUCCESS = "success"
+LOGIN_INVALID = "invalid"
+LOGIN_NOT_FOUND = "not_found"
+LOGIN_TIMEOUT = "timeout"
+LOGIN_ERROR = "error"
+
+# 登録と同時に行が消えるなど、一時的に取得できなかった場合のメッセージ
+RETRY_MESSAGE = "ユーザー情報を取得できませんでした。もう一度お試しください。"
+
+# 同時登録で相手の行が文のスナップショットに見えなかった場合の再取得
+SELECT_USER_SQL = "SELECT id, username, created_at, FALSE AS created FROM users WHERE username = %(username)s"
+
+
+@dataclass(slots=True)
 class User:
     """ユーザーエンティティ"""
     id: Optional[int]
@@ -22,62 +67,38 @@ class UserService:
     """ユーザーサービス"""
     
     def __init__(self):
-        # Streamlit Cloud環境での接続パラメータ
-        try:
-            # Streamlit Secretsから接続情報を取得
-
-            db_config = st.secrets.get("database", {})  # Streamlit secrets.toml または Cloud Secrets
-            self.connection_params = {
-                "host": db_config.get("host") or os.getenv("DB_HOST", "localhost"),
-                "database": db_config.get("database") or os.getenv("DB_NAME", "snowvillage"),
-                "user": db_config.get("user") or os.getenv("DB_USER", "postgres"),
-                "password": db_config.get("password") or os.getenv("DB_PASSWORD", ""),
-                "port": int(db_config.get("port") or os.getenv("DB_PORT", "5432")),
-                "sslmode": db_config.get("sslmode", "prefer"),
-                "connect_timeout": int(db_config.get("connect_timeout") or os.getenv("DB_CONNECT_TIMEOUT", "10")),
-                "application_name": "snowvillage_go_app",
-            }
-        except Exception as e:
-            # Secretsが利用できない場合（ローカル開発環境）
-            print(f"Using fallback database configuration: {e}")
-            self.connection_params = {
-                'host': os.getenv('DB_HOST', 'postgres-dev'),
-                'database': os.getenv('DB_NAME', 'snowvillage'),
-                'user': os.getenv('DB_USER', 'postgres'),
-                'password': os.getenv('DB_PASSWORD', 'devpassword'),
-                'port': int(os.getenv('DB_PORT', '5432')),
-                'sslmode': 'prefer',
-                'connect_timeout': 10,
-                'application_name': 'snowvillage_go_app'
-            }
+        self.connection_params = load_connection_params()
         self._init_db()
     
     def _init_db(self):
         """データベース初期化"""
+        # ブレーカーが開いていれば接続を待たずに失敗させる
+        circuit_breaker.get_db_breaker().before_call()
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                with psycopg2.connect(**self.connection_params) as conn:
+                with circuit_breaker.connect(self.connection_params) as conn:
                     with conn.cursor() as cursor:
-                        cursor.execute("""
-                            CREATE TABLE IF NOT EXISTS users (
-                                id SERIAL PRIMARY KEY,
-                                username VARCHAR(50) UNIQUE NOT NULL,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        """)
+                        cursor.execute(with_timeouts("admin", CREATE_USERS_TABLE_SQL))
                         conn.commit()
                     print(f"Database connection successful (attempt {attempt + 1})")
                     return
+            except circuit_breaker.CircuitOpenError:
+                raise
             except psycopg2.OperationalError as e:
                 print(f"Database connection attempt {attempt + 1} failed: {e}")
                 if attempt == max_retries - 1:
-                    raise Exception(f"Failed to connect to database after {max_retries} attempts: {e}")
+                    raise circuit_breaker.DatabaseUnavailableError(f"Failed to connect to database after {max_retries} attempts: {e}")
             except Exception as e:
                 print(f"Database initialization error: {e}")
                 if attempt == max_retries - 1:
                     raise
     
+    def get_connection(self):
+        """プールから接続を借りる（with で使い、抜けるとプールに返る）"""
+        return get_connection_pool(self.connection_params).connection()
+
+    @track_query("register_user")
     def register_user(self, username: str) -> tuple[bool, str, Optional[User]]:
         """新規ユーザー登録"""
         if not username or not username.strip():
@@ -86,23 +107,20 @@ class UserService:
         username = username.strip()
         
         try:
-            with psycopg2.connect(**self.connection_params) as conn:
+            with self.get_connection() as conn:
                 with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
                     # 既存ユーザーチェック
-                    cursor.execute(
-                        "SELECT * FROM users WHERE username = %s", 
-                        (username,)
-                    )
+                    with trace_query("register_user_exists", LOGIN_USER_SQL, (username,), "write"):
+                        cursor.execute(with_timeouts("write", LOGIN_USER_SQL), (username,))
                     existing = cursor.fetchone()
                     
                     if existing:
+                        USER_AUTH_TOTAL.inc(action="register", result="duplicate")
                         return False, "同じ名前のユーザーが既に存在します", None
                     
                     # 新規ユーザー作成
-                    cursor.execute(
-                        "INSERT INTO users (username) VALUES (%s) RETURNING *",
-                        (username,)
-                    )
+                    with trace_query("register_user", REGISTER_USER_SQL, (username,), "write"):
+                        cursor.execute(REGISTER_USER_SQL, (username,))
                     user_data = cursor.fetchone()
                     
                     user = User(
@@ -112,25 +130,70 @@ class UserService:
                     )
                     
                     conn.commit()
+                    USER_AUTH_TOTAL.inc(action="register", result="success")
                     return True, "登録が完了しました！", user
                     
         except Exception as e:
+            if record_query_error("register_user", e) or isinstance(e, circuit_breaker.DB_BUSY_ERRORS):
+                USER_AUTH_TOTAL.inc(action="register", result="timeout")
+                return False, BUSY_MESSAGE, None
+            USER_AUTH_TOTAL.inc(action="register", result="error")
             return False, f"登録に失敗しました: {str(e)}", None
     
-    def login_user(self, username: str) -> tuple[bool, str, Optional[User]]:
-        """ユーザーログイン"""
+    @track_query("get_or_create_user")
+    def get_or_create_user(self, username: str) -> tuple[bool, str, Optional[User], bool]:
+        """ユーザーを取得、いなければ登録（戻り値の最後は新規作成したかどうか）"""
         if not username or not username.strip():
-            return False, "名前を入力してください", None
+            return False, "名前を入力してください", None, False
         
         username = username.strip()
         
         try:
-            with psycopg2.connect(**self.connection_params) as conn:
+            with self.get_connection() as conn:
                 with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                    cursor.execute(
-                        "SELECT * FROM users WHERE username = %s", 
-                        (username,)
-                    )
+                    execute_prepared(cursor, "get_or_create_user", GET_OR_CREATE_USER_SQL,
+                                     {"username": username}, "write")
+                    user_data = cursor.fetchone()
+                    if not user_data:
+                        # 同時に登録した相手のコミット待ちで競合した場合は、コミット後の行を読み直す
+                        with trace_query("select_user", SELECT_USER_SQL, {"username": username}, "write"):
+                            cursor.execute(SELECT_USER_SQL, {"username": username})
+                        user_data = cursor.fetchone()
+                conn.commit()
+        except Exception as e:
+            if record_query_error("get_or_create_user", e) or isinstance(e, circuit_breaker.DB_BUSY_ERRORS):
+                USER_AUTH_TOTAL.inc(action="get_or_create", result="timeout")
+                return False, BUSY_MESSAGE, None, False
+            USER_AUTH_TOTAL.inc(action="get_or_create", result="error")
+            return False, f"ユーザー情報の取得に失敗しました: {str(e)}", None, False
+        
+        if not user_data:
+            # 競合した相手の行が読み直す前に消された場合
+            USER_AUTH_TOTAL.inc(action="get_or_create", result="error")
+            return False, RETRY_MESSAGE, None, False
+        
+        user = User(
+            id=user_data['id'],
+            username=user_data['username'],
+            created_at=user_data['created_at']
+        )
+        created = user_data['created']
+        USER_AUTH_TOTAL.inc(action="get_or_create", result="created" if created else "existing")
+        message = "登録が完了しました！" if created else "ログインしました！"
+        return True, message, user, created
+    
+    @track_query("login_user")
+    def login_user(self, username: str) -> tuple[bool, str, Optional[User], str]:
+        """ユーザーログイン（戻り値の最後は LOGIN_* の状態）"""
+        if not username or not username.strip():
+            return False, "名前を入力してください", None, LOGIN_INVALID
+        
+        username = username.strip()
+        
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                    execute_prepared(cursor, "login_user", LOGIN_USER_SQL, (username,))
                     user_data = cursor.fetchone()
                     
                     if user_data:
@@ -139,9 +202,23 @@ class UserService:
                             username=user_data['username'],
                             created_at=user_data['created_at']
                         )
-                        return True, "ログインしました！", user
+                        USER_AUTH_TOTAL.inc(action="login", result=LOGIN_SUCCESS)
+                        return True, "ログインしました！", user, LOGIN_SUCCESS
                     else:
-                        return False, "ユーザーが見つかりません", None
+                        USER_AUTH_TOTAL.inc(action="login", result=LOGIN_NOT_FOUND)
+                        return False, "ユーザーが見つかりません", None, LOGIN_NOT_FOUND
                         
         except Exception as e:
-            return False, f"ログインに失敗しました: {str(e)}", None
\ No newline at end of file
+            if record_query_error("login_user", e) or isinstance(e, circuit_breaker.DB_BUSY_ERRORS):
+                USER_AUTH_TOTAL.inc(action="login", result=LOGIN_TIMEOUT)
+                return False, BUSY_MESSAGE, None, LOGIN_TIMEOUT
+            USER_AUTH_TOTAL.inc(action="login", result=LOGIN_ERROR)
+            return False, f"ログインに失敗しました: {str(e)}", None, LOGIN_ERROR
+
+
+def get_user_service():
+    """設定されたバックエンドのユーザーサービスを取得"""
+    if get_db_backend() in ("async", "pipeline"):
+        from task_db_async import get_async_user_service
+        return get_async_user_service()
+    return UserService()